@@ -0,0 +1,206 @@
+"""
+End-to-end benchmark of the API hot paths, run in-process against a throwaway test database.
+
+Generates a synthetic dataset at the requested scale (see datagen.SCALES), then times every scenario and records
+its latency percentiles, the number of queries of one run and the peak Python memory of one run. Mail goes to
+the locmem backend and Celery tasks run eagerly, so the notification and summary work is part of the timings.
+
+Results are written to JSON. When a baseline file is given, every scenario is compared against it and the
+benchmark exits with status 1 if any latency or memory figure grew by more than --tolerance, or if any scenario
+runs more queries than in the baseline.
+
+Usage:
+    python benchmarks/bench_api.py [--scale 10k|1m|10m] [--iterations 50] [--output results.json]
+                                   [--baseline benchmarks/baselines/10k.json] [--tolerance 0.2]
+    python benchmarks/bench_api.py --scale 10k --output benchmarks/baselines/10k.json   # refresh a baseline
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import platform
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'splitwise.settings')
+os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+
+import django
+django.setup()
+
+from django.core import mail
+from django.core.cache import cache
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, CaptureQueriesContext
+from rest_framework.test import APIRequestFactory
+from splitwise.celery import app as celery_app
+from user.models import User
+from expense.views import AddExpense, UserPassbook
+from expense.utility import generate_balances
+from expense.tasks import send_weekly_summary_email
+
+import datagen
+
+# Figures compared against the baseline with a relative tolerance, the query count must not grow at all.
+TOLERATED_METRICS = ('p50_ms', 'p95_ms', 'peak_kib')
+
+
+def build_scenarios(user_ids, seed=7):
+    """
+    Returns a dictionary of scenario name -> callable running one request or task.
+    """
+    rng = random.Random(seed)
+    factory = APIRequestFactory()
+    add_expense = AddExpense.as_view()
+    user_passbook = UserPassbook.as_view()
+
+    def create_expense():
+        payer, *others = rng.sample(user_ids, datagen.PARTICIPANTS_PER_EXPENSE)
+        request = factory.post('/api/expense', {
+            'payer': payer,
+            'amount': '250.00',
+            'expense_type': 'equal',
+            'participant_detail': [{'id': user_id} for user_id in [payer] + others],
+        }, format='json')
+        response = add_expense(request)
+        assert response.status_code == 201, response.data
+
+    def simplified_balances():
+        generate_balances(simplify=True)
+
+    def user_passbook_page():
+        # The cache is cleared so every run measures the database path, not a cache hit.
+        cache.clear()
+        user = rng.choice(user_ids)
+        response = user_passbook(factory.get(f'/api/passbook/{user}'), user=user)
+        response.render()
+        assert response.status_code == 200
+
+    def weekly_summary():
+        send_weekly_summary_email()
+        mail.outbox.clear()
+
+    return {
+        'add_expense': create_expense,
+        'generate_balances': simplified_balances,
+        'user_passbook': user_passbook_page,
+        'weekly_summary_email': weekly_summary,
+    }
+
+
+def percentile(sorted_values, fraction):
+    """
+    Nearest-rank percentile of an already sorted list.
+    """
+    index = min(len(sorted_values) - 1, max(0, round(fraction * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def measure(scenario, iterations):
+    """
+    Runs a scenario once to warm up, once under CaptureQueriesContext and tracemalloc, then `iterations` times
+    untraced for the latency figures, so tracing overhead never leaks into the timings.
+    """
+    scenario()
+    with CaptureQueriesContext(connection) as queries:
+        tracemalloc.start()
+        scenario()
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    latencies = []
+    for _ in range(iterations):
+        start = time.perf_counter()
+        scenario()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return {
+        'iterations': iterations,
+        'p50_ms': round(percentile(latencies, 0.50), 3),
+        'p95_ms': round(percentile(latencies, 0.95), 3),
+        'p99_ms': round(percentile(latencies, 0.99), 3),
+        'max_ms': round(latencies[-1], 3),
+        'queries': len(queries),
+        'peak_kib': round(peak / 1024, 1),
+    }
+
+
+def compare(results, baseline, tolerance):
+    """
+    Returns a list of human readable regressions of `results` against `baseline`.
+    """
+    regressions = []
+    for name, figures in results['scenarios'].items():
+        expected = baseline.get('scenarios', {}).get(name)
+        if expected is None:
+            continue
+        for metric in TOLERATED_METRICS:
+            if figures[metric] > expected[metric] * (1 + tolerance):
+                regressions.append(f'{name}: {metric} {expected[metric]} -> {figures[metric]}')
+        if figures['queries'] > expected['queries']:
+            regressions.append(f'{name}: queries {expected["queries"]} -> {figures["queries"]}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', choices=sorted(datagen.SCALES), default='10k')
+    parser.add_argument('--iterations', type=int, default=50)
+    parser.add_argument('--scenarios', nargs='+', help='only run these scenarios')
+    parser.add_argument('--output', help='write the results to this JSON file')
+    parser.add_argument('--baseline', help='compare the results against this JSON file')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative growth of latency and memory')
+    args = parser.parse_args()
+
+    setup_test_environment()
+    celery_app.conf.task_always_eager = True
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        start = time.perf_counter()
+        dataset = datagen.generate(args.scale, stdout=sys.stdout)
+        print(f'Generated {dataset} in {time.perf_counter() - start:.1f}s')
+
+        user_ids = list(User.objects.values_list('id', flat=True))
+        scenarios = build_scenarios(user_ids)
+        results = {
+            'scale': args.scale,
+            'dataset': dataset,
+            'python': platform.python_version(),
+            'database': connection.vendor,
+            'scenarios': {},
+        }
+        print(f'{"scenario":<22} {"p50 ms":>9} {"p95 ms":>9} {"p99 ms":>9} {"queries":>8} {"peak KiB":>10}')
+        for name, scenario in scenarios.items():
+            if args.scenarios and name not in args.scenarios:
+                continue
+            figures = measure(scenario, args.iterations)
+            results['scenarios'][name] = figures
+            print(f'{name:<22} {figures["p50_ms"]:>9.2f} {figures["p95_ms"]:>9.2f} {figures["p99_ms"]:>9.2f} '
+                  f'{figures["queries"]:>8} {figures["peak_kib"]:>10.1f}')
+    finally:
+        runner.teardown_databases(old_config)
+
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2)
+
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+        if baseline.get('scale') != results['scale']:
+            print(f'Baseline was recorded at scale {baseline.get("scale")}, not {results["scale"]}.')
+            sys.exit(2)
+        regressions = compare(results, baseline, args.tolerance)
+        for regression in regressions:
+            print(f'REGRESSION {regression}')
+        if regressions:
+            sys.exit(1)
+        print('No regression against the baseline.')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,145 @@
+"""
+Benchmark of notification latency and task throughput under a mixed notification and weekly summary load.
+
+Runs in-process Celery workers on the in-memory broker with a mail backend that sleeps like an SMTP server, then
+publishes a burst of weekly summary chunks followed by a stream of expense notification batches. Two layouts are
+compared with the same total number of worker threads:
+
+- shared: every task on the default queue, consumed by a single worker
+- split: notifications and summaries on their own queues (CELERY_TASK_ROUTES), each with its own worker
+
+Reports, per task, the p50/p95 time from publishing to completion, and the overall tasks per second.
+
+Usage:
+    python benchmarks/bench_celery_queues.py [--summaries 40] [--notifications 200] [--concurrency 4]
+                                             [--smtp-latency 0.02]
+"""
+import os
+import sys
+import time
+import argparse
+import threading
+import multiprocessing
+from collections import defaultdict
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+SUMMARY_TASK = 'expense.tasks.send_weekly_summary_chunk_task'
+NOTIFICATION_TASK = 'expense.tasks.send_email_batch_task'
+
+
+def setup_django(smtp_latency):
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'splitwise.settings'
+    os.environ['CELERY_BROKER_URL'] = 'memory://'
+    os.environ['BENCH_SMTP_LATENCY'] = str(smtp_latency)
+    import django
+    django.setup()
+    from django.conf import settings
+    settings.EMAIL_BACKEND = 'bench_celery_queues.SlowEmailBackend'
+
+
+def slow_email_backend():
+    from django.core.mail.backends.locmem import EmailBackend
+
+    class SlowEmailBackend(EmailBackend):
+        """
+        Locmem backend sleeping BENCH_SMTP_LATENCY seconds per message, like a round trip to an SMTP server.
+        """
+        def send_messages(self, messages):
+            time.sleep(float(os.environ['BENCH_SMTP_LATENCY']) * len(messages))
+            return super().send_messages(messages)
+
+    return SlowEmailBackend
+
+
+def __getattr__(name):
+    # The backend class can only be defined once Django is configured, Django imports it by name.
+    if name == 'SlowEmailBackend':
+        return slow_email_backend()
+    raise AttributeError(name)
+
+
+def run(layout, args):
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    setup_django(args.smtp_latency)
+    from celery import signals
+    from celery.contrib.testing.worker import start_worker
+    from splitwise.celery import app
+    from splitwise.task_metrics import PUBLISHED_AT_HEADER
+    from expense.tasks import send_weekly_summary_chunk_task, send_email_batch_task
+
+    # The in-memory transport polls its queues, once a second by default.
+    app.conf.broker_transport_options = {'polling_interval': 0.005}
+    if layout == 'shared':
+        # An explicit queue overrides CELERY_TASK_ROUTES.
+        options = {'queue': 'celery'}
+        workers = [(['celery'], args.concurrency * 2, 4)]
+    else:
+        options = {}
+        workers = [(['notifications'], args.concurrency, 4), (['summaries'], args.concurrency, 1)]
+
+    latencies, lock, finished = defaultdict(list), threading.Lock(), threading.Event()
+    expected = args.summaries + args.notifications
+
+    def record(sender=None, task=None, **kwargs):
+        latency = time.time() - float(task.request.get(PUBLISHED_AT_HEADER))
+        with lock:
+            latencies[task.name].append(latency)
+            if sum(len(values) for values in latencies.values()) == expected:
+                finished.set()
+    signals.task_postrun.connect(record, weak=False)
+
+    summary = [{'name': f'User {index}', 'email': f'user{index}@example.com', 'owed': [('Payer', 10.0)]}
+               for index in range(args.chunk_size)]
+    notification = [{'user_name': f'User {index}', 'user_email': f'user{index}@example.com',
+                     'owes_to_name': 'Payer', 'amount': '10.00'} for index in range(args.participants)]
+
+    # One solo worker per slot stands in for one prefork child, each prefetching its own messages.
+    contexts = [start_worker(app, pool='solo', queues=queues, prefetch_multiplier=prefetch,
+                             perform_ping_check=False, shutdown_timeout=60, loglevel='ERROR')
+                for queues, concurrency, prefetch in workers for _ in range(concurrency)]
+    for context in contexts:
+        context.__enter__()
+    try:
+        start = time.time()
+        for _ in range(args.summaries):
+            send_weekly_summary_chunk_task.apply_async((summary,), **options)
+        for _ in range(args.notifications):
+            send_email_batch_task.apply_async((notification,), **options)
+            time.sleep(args.interval)
+        finished.wait(timeout=600)
+        elapsed = time.time() - start
+    finally:
+        for context in reversed(contexts):
+            context.__exit__(None, None, None)
+
+    results = {}
+    for task_name, values in latencies.items():
+        values.sort()
+        results[task_name] = (len(values), values[len(values) // 2], values[int(len(values) * 0.95) - 1])
+    return results, sum(len(values) for values in latencies.values()) / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--summaries', type=int, default=40, help='weekly summary chunks published first')
+    parser.add_argument('--chunk-size', type=int, default=20, help='users in each summary chunk')
+    parser.add_argument('--notifications', type=int, default=200, help='notification batches published next')
+    parser.add_argument('--participants', type=int, default=3, help='recipients of each notification batch')
+    parser.add_argument('--interval', type=float, default=0.02, help='seconds between two notification batches')
+    parser.add_argument('--concurrency', type=int, default=4, help='worker threads per queue in the split layout')
+    parser.add_argument('--smtp-latency', type=float, default=0.02, help='seconds spent sending each message')
+    args = parser.parse_args()
+
+    print(f'{"layout":<8} {"task":<16} {"tasks":>6} {"p50 s":>8} {"p95 s":>8} {"tasks/s":>8}')
+    context = multiprocessing.get_context('spawn')
+    for layout in ('shared', 'split'):
+        with context.Pool(1) as pool:
+            results, throughput = pool.apply(run, (layout, args))
+        for task_name, label in ((NOTIFICATION_TASK, 'notification'), (SUMMARY_TASK, 'summary')):
+            count, p50, p95 = results.get(task_name, (0, 0, 0))
+            print(f'{layout:<8} {label:<16} {count:>6} {p50:>8.3f} {p95:>8.3f} {throughput:>8.1f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Benchmark of expense write throughput with several concurrent writers under each database profile.
+
+For every profile a fresh database is created, then N worker processes, standing in for gunicorn and Celery
+workers, create expenses through create_expense at the same time. Reports expenses per second and the number of
+expenses that failed, eg. with "database is locked".
+
+SQLite profiles run against a throwaway file in a temporary directory. The postgresql profile uses the database
+configured by the POSTGRES_* variables, which should be a dedicated benchmark database: its tables are created
+with migrate --run-syncdb and the benchmark rows are left in it.
+
+Usage:
+    python benchmarks/bench_db_concurrency.py [--profiles sqlite-basic sqlite] [--workers 1 4 8]
+                                              [--expenses 200] [--users 50] [--participants 5]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import multiprocessing
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def setup_django(profile, sqlite_name):
+    """
+    Configures Django for one profile. Settings are read from the environment at import time, so this only
+    runs in freshly spawned processes.
+    """
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'splitwise.settings'
+    os.environ['DB_PROFILE'] = profile
+    os.environ['SQLITE_NAME'] = sqlite_name
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+    import django
+    django.setup()
+
+
+def create_schema(profile, sqlite_name, users):
+    setup_django(profile, sqlite_name)
+    from django.core.management import call_command
+    from user.models import User
+    call_command('migrate', run_syncdb=True, verbosity=0)
+    for i in range(users):
+        User.objects.create(name=f'bench{i}', email=f'bench{i}@example.com', mobile_number='9000000000')
+    return list(User.objects.filter(email__startswith='bench').values_list('id', flat=True))
+
+
+def create_expenses(profile, sqlite_name, user_ids, expenses, participants, seed, start_at):
+    """
+    Worker body: creates expenses one request at a time, the way a web worker would.
+    Returns the number of created and failed expenses.
+    """
+    setup_django(profile, sqlite_name)
+    from django.db import connection
+    from expense.utility import create_expense
+    connection.ensure_connection()
+
+    rng = random.Random(seed)
+    created = failed = 0
+    while time.time() < start_at:
+        time.sleep(0.001)
+    for _ in range(expenses):
+        payer, *others = rng.sample(user_ids, participants)
+        try:
+            response = create_expense({
+                'payer': payer,
+                'amount': '100.00',
+                'expense_type': 'equal',
+                'participant_detail': [{'id': user_id} for user_id in [payer] + others],
+            })
+            created += response.status_code == 201
+            failed += response.status_code != 201
+        except Exception:
+            failed += 1
+    return created, failed
+
+
+def run(profile, workers, args):
+    with tempfile.TemporaryDirectory() as directory:
+        sqlite_name = os.path.join(directory, 'bench.sqlite3')
+        context = multiprocessing.get_context('spawn')
+        with context.Pool(1) as pool:
+            user_ids = pool.apply(create_schema, (profile, sqlite_name, args.users))
+
+        with context.Pool(workers) as pool:
+            start_at = time.time() + 2 + workers * 0.5
+            jobs = [pool.apply_async(create_expenses, (profile, sqlite_name, user_ids, args.expenses,
+                                                       args.participants, seed, start_at))
+                    for seed in range(workers)]
+            results = [job.get() for job in jobs]
+            elapsed = time.time() - start_at
+    created = sum(result[0] for result in results)
+    failed = sum(result[1] for result in results)
+    return created, failed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--profiles', nargs='+', default=['sqlite-basic', 'sqlite'])
+    parser.add_argument('--workers', nargs='+', type=int, default=[1, 4, 8])
+    parser.add_argument('--expenses', type=int, default=200, help='expenses created by each worker')
+    parser.add_argument('--users', type=int, default=50)
+    parser.add_argument('--participants', type=int, default=5)
+    args = parser.parse_args()
+
+    print(f'{"profile":>14} {"workers":>8} {"created":>8} {"failed":>7} {"seconds":>9} {"expenses/s":>11}')
+    for profile in args.profiles:
+        for workers in args.workers:
+            created, failed, elapsed = run(profile, workers, args)
+            print(f'{profile:>14} {workers:>8} {created:>8} {failed:>7} {elapsed:>9.2f} {created / elapsed:>11.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark of the memory footprint of the ledger engine in expense/engine.py.
+
+Builds synthetic pair balances, then measures with tracemalloc the memory held by the nested
+{creditor userId: {debtor userId: Decimal}} dictionaries the simplified balance endpoint builds, against the bytes
+of the engine arrays. The engine is then saved, mapped back and walked to compute every net position, and the time
+of each step is reported. The mapped file lives in the page cache, so it is shared by every process mapping it.
+
+Usage:
+    python benchmarks/bench_ledger_engine.py [--users 100000] [--pairs 1000000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def generate_pairs(users, pairs, seed=42):
+    """
+    Returns a (user_low_id, user_high_id) -> signed Decimal dictionary of `pairs` distinct pairs.
+    """
+    rng = random.Random(seed)
+    balances = {}
+    while len(balances) < pairs:
+        low = rng.randint(1, users - 1)
+        high = rng.randint(low + 1, min(low + 50, users))
+        balances[(low, high)] = Decimal(rng.randint(-100000, 100000) or 1) / 100
+    return balances
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--pairs', type=int, default=1000000)
+    args = parser.parse_args()
+
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'splitwise.settings'
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+    import django
+    django.setup()
+    from expense.engine import LedgerEngine
+    from expense.netting import group_by_creditor
+    from expense.splits import CENT
+
+    pair_balances = generate_pairs(args.users, args.pairs)
+    user_keys = {user_id: f'user{user_id}_{user_id:08x}' for user_id in range(1, args.users + 1)}
+
+    tracemalloc.start()
+    # Fresh Decimals, as when the amounts are read from the database. The userId strings are shared with the input.
+    nested = group_by_creditor(((user_keys[low], user_keys[high]), amount.quantize(CENT))
+                               for (low, high), amount in pair_balances.items())
+    dictionary_bytes = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del nested
+
+    start = time.perf_counter()
+    engine = LedgerEngine.from_pair_balances(pair_balances, user_keys, watermark=0)
+    build_seconds = time.perf_counter() - start
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, 'ledger_engine.bin')
+        start = time.perf_counter()
+        engine.save(path)
+        save_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped = LedgerEngine.open(path)
+        open_seconds = time.perf_counter() - start
+        start = time.perf_counter()
+        mapped.net_positions()
+        positions_seconds = time.perf_counter() - start
+        file_bytes = os.path.getsize(path)
+        del mapped
+
+    print(f'{"pairs":>10} {"dict B/pair":>12} {"engine B/pair":>14} {"file MB":>8} '
+          f'{"build s":>8} {"save s":>7} {"open s":>7} {"positions s":>12}')
+    print(f'{len(engine):>10} {dictionary_bytes / len(engine):>12.1f} {engine.nbytes / len(engine):>14.1f} '
+          f'{file_bytes / 1e6:>8.1f} {build_seconds:>8.2f} {save_seconds:>7.2f} {open_seconds:>7.4f} '
+          f'{positions_seconds:>12.2f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Benchmark for the pairwise netting engine in expense/netting.py, which nets the shares of new expenses into
+Balance deltas when expenses are created or imported.
+
+Feeds synthetic (debtor, creditor, amount) rows through net_pair_balances at growing row counts and
+reports the throughput of each run. Rows are generated lazily so memory is bounded by the number of pairs.
+A linear engine keeps rows per second roughly constant as the row count grows.
+
+Usage:
+    python benchmarks/bench_netting.py [--users 100000] [--rows 10000000] [--counterparties 20]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+from decimal import Decimal
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense.netting import net_pair_balances
+
+
+def generate_rows(users, rows, counterparties, seed=42):
+    """
+    Yields passbook-like rows where each user only deals with a fixed set of counterparties.
+    """
+    rng = random.Random(seed)
+    amounts = [Decimal(cents) / 100 for cents in range(1, 100001, 37)]
+    for _ in range(rows):
+        debtor = rng.randrange(users)
+        creditor = (debtor + rng.randint(1, counterparties)) % users
+        yield debtor, creditor, rng.choice(amounts)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--counterparties', type=int, default=20)
+    args = parser.parse_args()
+
+    row_counts = sorted({max(args.rows // 100, 1), max(args.rows // 10, 1), args.rows})
+    print(f'{"rows":>12} {"pairs":>10} {"seconds":>9} {"rows/s":>12}')
+    for row_count in row_counts:
+        start = time.perf_counter()
+        pair_balances = net_pair_balances(generate_rows(args.users, row_count, args.counterparties))
+        elapsed = time.perf_counter() - start
+        print(f'{row_count:>12} {len(pair_balances):>10} {elapsed:>9.2f} {row_count / elapsed:>12.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,59 @@
+"""
+Benchmark of the parallel balance rebuild (rebuild_balances --workers N) on a synthetic ledger.
+
+Generates a ledger at the requested scale (see datagen.SCALES) in a throwaway SQLite file, since every worker
+process opens its own connection to it, then aggregates it with a growing number of worker processes and reports
+rows per second and the speedup over a single worker. The speedup is bounded by the number of cores and, on
+SQLite, by how well the file is cached.
+
+Usage:
+    python benchmarks/bench_rebuild_balances.py [--scale 1m] [--workers 1 2 4 8] [--database path.sqlite3]
+"""
+import os
+import sys
+import time
+import argparse
+import tempfile
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--scale', default='1m', help='one of 10k, 1m or 10m passbook rows')
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--database', help='reuse this SQLite file, the ledger is only generated when it is missing')
+    args = parser.parse_args()
+
+    directory = tempfile.TemporaryDirectory()
+    database = args.database or os.path.join(directory.name, 'ledger.sqlite3')
+    generate = not os.path.exists(database)
+    os.environ['SQLITE_NAME'] = database
+    os.environ['DJANGO_SETTINGS_MODULE'] = 'splitwise.settings'
+    os.environ.setdefault('CELERY_BROKER_URL', 'memory://')
+
+    import django
+    django.setup()
+    from django.core.management import call_command
+    from expense.ledger import parallel_pair_balances
+    import datagen
+
+    if generate:
+        call_command('migrate', run_syncdb=True, verbosity=0)
+        start = time.perf_counter()
+        dataset = datagen.generate(args.scale, stdout=sys.stdout)
+        print(f'Generated {dataset} in {time.perf_counter() - start:.1f}s')
+
+    print(f'{"workers":>8} {"rows":>10} {"pairs":>9} {"seconds":>9} {"rows/s":>11} {"speedup":>8}')
+    baseline = None
+    for workers in args.workers:
+        start = time.perf_counter()
+        balances, rows = parallel_pair_balances(workers)
+        elapsed = time.perf_counter() - start
+        baseline = baseline or elapsed
+        print(f'{workers:>8} {rows:>10} {len(balances):>9} {elapsed:>9.2f} {rows / elapsed:>11.0f} {baseline / elapsed:>8.2f}')
+    directory.cleanup()
+
+
+if __name__ == '__main__':
+    main()
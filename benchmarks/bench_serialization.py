@@ -0,0 +1,80 @@
+"""
+Benchmark comparing passbook serialization throughput of PassbookSerializer and FlatPassbookSerializer.
+
+Creates a throwaway test database, fills it with synthetic passbook rows and serializes the same queryset
+through both serializers, reporting rows per second and the number of queries of each run.
+
+Usage:
+    python benchmarks/bench_serialization.py [--sizes 10000 100000] [--users 1000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'splitwise.settings')
+
+import django
+django.setup()
+
+from django.db import connection
+from django.test.runner import DiscoverRunner
+from django.test.utils import setup_test_environment, CaptureQueriesContext
+from user.models import User
+from expense.models import Passbook
+from expense.serializers import PassbookSerializer, FlatPassbookSerializer
+
+
+def populate(users, rows, seed=42):
+    """
+    Adds synthetic passbook rows between random users until the table holds the requested number of rows.
+    """
+    rng = random.Random(seed)
+    if User.objects.count() < users:
+        User.objects.bulk_create([
+            User(userId=f'user_{index}', name=f'User {index}', email=f'user{index}@example.com', mobile_number='9000000000')
+            for index in range(users)
+        ])
+    user_ids = list(User.objects.values_list('id', flat=True))
+    missing = rows - Passbook.objects.count()
+    Passbook.objects.bulk_create([
+        Passbook(user_id=rng.choice(user_ids), owes_to_id=rng.choice(user_ids), amount=rng.randint(1, 100000) / 100)
+        for _ in range(missing)
+    ], batch_size=5000)
+
+
+def measure(label, rows, serialize):
+    with CaptureQueriesContext(connection) as queries:
+        start = time.perf_counter()
+        data = serialize()
+        elapsed = time.perf_counter() - start
+    assert len(data) == rows
+    print(f'{label:<24} {rows:>8} {elapsed:>9.2f} {rows / elapsed:>12.0f} {len(queries):>8}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000])
+    parser.add_argument('--users', type=int, default=1000)
+    args = parser.parse_args()
+
+    setup_test_environment()
+    runner = DiscoverRunner(verbosity=0)
+    old_config = runner.setup_databases()
+    try:
+        print(f'{"serializer":<24} {"rows":>8} {"seconds":>9} {"rows/s":>12} {"queries":>8}')
+        for size in sorted(args.sizes):
+            populate(args.users, size)
+            queryset = Passbook.objects.order_by('id')
+            measure('PassbookSerializer', size,
+                    lambda: PassbookSerializer(queryset.select_related('user', 'owes_to'), many=True).data)
+            measure('FlatPassbookSerializer', size,
+                    lambda: FlatPassbookSerializer(FlatPassbookSerializer.prepare_queryset(queryset), many=True).data)
+    finally:
+        runner.teardown_databases(old_config)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,56 @@
+"""
+Micro-benchmark for the share computation in expense/splits.py.
+
+Times equal, percentage and exact splits of a 1000-participant expense (the API's maximum) and checks that
+every split adds up to the total exactly.
+
+Usage:
+    python benchmarks/bench_splits.py [--participants 1000] [--repeat 1000]
+"""
+import os
+import sys
+import time
+import random
+import argparse
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from expense.splits import to_minor_units, from_minor_units, split_equal, split_by_weights
+
+
+def random_weights(count, total, rng):
+    """
+    Returns count non-negative integers adding up to total.
+    """
+    cuts = sorted(rng.randint(0, total) for _ in range(count - 1))
+    return [high - low for low, high in zip([0] + cuts, cuts + [total])]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--participants', type=int, default=1000)
+    parser.add_argument('--repeat', type=int, default=1000)
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    total_minor = to_minor_units('9999999.99')
+    basis_points = random_weights(args.participants, 10000, rng)
+    exact_amounts = [str(from_minor_units(share)) for share in random_weights(args.participants, total_minor, rng)]
+
+    scenarios = [
+        ('equal', lambda: split_equal(total_minor, args.participants)),
+        ('percent', lambda: split_by_weights(total_minor, basis_points)),
+        ('exact', lambda: [to_minor_units(amount) for amount in exact_amounts]),
+    ]
+    print(f'{"split":<8} {"participants":>12} {"us/split":>10} {"splits/s":>10}')
+    for name, split in scenarios:
+        assert sum(split()) == total_minor
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            split()
+        elapsed = time.perf_counter() - start
+        print(f'{name:<8} {args.participants:>12} {elapsed / args.repeat * 1e6:>10.1f} {args.repeat / elapsed:>10.0f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+"""
+Synthetic data generator shared by the API benchmarks.
+
+Fills the database with users, expenses and their passbook entries at a named scale, then rebuilds the Balance
+table from the passbook. Rows are generated and inserted in chunks, so memory stays bounded at every scale.
+
+Must be imported after django.setup().
+"""
+import random
+from io import StringIO
+from decimal import Decimal
+from django.core.management import call_command
+from user.models import User
+from expense.models import Expense, Passbook
+
+# Passbook rows of each scale.
+SCALES = {
+    '10k': 10_000,
+    '1m': 1_000_000,
+    '10m': 10_000_000,
+}
+PARTICIPANTS_PER_EXPENSE = 5
+ROWS_PER_USER = 100
+CHUNK_SIZE = 5000
+
+
+def user_count(rows):
+    return max(rows // ROWS_PER_USER, 100)
+
+
+def generate(scale, seed=42, stdout=None):
+    """
+    Populates the database for one of the SCALES.
+
+    Parameters:
+    - scale (str): A key of SCALES.
+    - seed (int): Seed of the random generator, the same seed always produces the same dataset.
+    - stdout: Optional stream for progress messages.
+
+    Returns: A dictionary with the number of users, expenses and passbook rows created.
+
+    Notes:
+    - Each expense is split equally between its payer and PARTICIPANTS_PER_EXPENSE - 1 other users, the payer's
+      own share is written like the API does, so every expense produces PARTICIPANTS_PER_EXPENSE passbook rows.
+    """
+    rows = SCALES[scale]
+    users = user_count(rows)
+    rng = random.Random(seed)
+
+    for start in range(0, users, CHUNK_SIZE):
+        User.objects.bulk_create([
+            User(userId=f'bench_{index}', name=f'Bench User {index}', email=f'bench{index}@example.com',
+                 mobile_number='9000000000')
+            for index in range(start, min(start + CHUNK_SIZE, users))
+        ])
+    user_ids = list(User.objects.filter(userId__startswith='bench_').values_list('id', flat=True))
+
+    expenses = rows // PARTICIPANTS_PER_EXPENSE
+    expenses_per_chunk = CHUNK_SIZE // PARTICIPANTS_PER_EXPENSE
+    for start in range(0, expenses, expenses_per_chunk):
+        groups = [rng.sample(user_ids, PARTICIPANTS_PER_EXPENSE) for _ in range(min(expenses_per_chunk, expenses - start))]
+        share_cents = [rng.randint(100, 50000) for _ in groups]
+        chunk = Expense.objects.bulk_create([
+            Expense(payer_id=group[0], amount=Decimal(cents * PARTICIPANTS_PER_EXPENSE) / 100, expense_type='equal')
+            for group, cents in zip(groups, share_cents)
+        ])
+        Passbook.objects.bulk_create([
+            Passbook(expense=expense, user_id=participant_id, owes_to_id=group[0], amount=Decimal(cents) / 100)
+            for expense, group, cents in zip(chunk, groups, share_cents) for participant_id in group
+        ])
+        if stdout is not None and (start // expenses_per_chunk) % 100 == 99:
+            stdout.write(f'  {(start + len(chunk)) * PARTICIPANTS_PER_EXPENSE} / {rows} passbook rows\n')
+
+    call_command('rebuild_balances', stdout=stdout if stdout is not None else StringIO())
+    return {'users': len(user_ids), 'expenses': expenses, 'passbook_rows': expenses * PARTICIPANTS_PER_EXPENSE}
@@ -1,5 +1,13 @@
 from django.contrib import admin
-from .models import Expense, Passbook
+from .models import Group, Expense, Passbook, Balance, DailyRollup, Outbox, PendingNotification, LedgerCheckpoint, BalanceSnapshot, PassbookCompaction
 
+admin.site.register(Group)
 admin.site.register(Expense)
 admin.site.register(Passbook)
+admin.site.register(Balance)
+admin.site.register(DailyRollup)
+admin.site.register(Outbox)
+admin.site.register(PendingNotification)
+admin.site.register(LedgerCheckpoint)
+admin.site.register(BalanceSnapshot)
+admin.site.register(PassbookCompaction)
@@ -0,0 +1,13 @@
+from django.urls import path
+from django.views.decorators.csrf import csrf_exempt
+from .async_views import (AsyncAddExpense,
+                          AsyncRetreiveExpense,
+                          AsyncListPassbook,
+                          AsyncUserPassbook)
+
+urlpatterns = [
+    path('expense',csrf_exempt(AsyncAddExpense.as_view())), # async endpoint for creating new expense and listing all the expenses
+    path('expense/<int:user>',AsyncRetreiveExpense.as_view()), # async endpoint to show user specific expenses
+    path('passbook',AsyncListPassbook.as_view()), # async endpoint for listing all passbook entries
+    path('passbook/<int:user>',AsyncUserPassbook.as_view()), # async endpoint to show user specific passbook
+]
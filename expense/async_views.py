@@ -0,0 +1,91 @@
+import json
+from asgiref.sync import sync_to_async
+from django.views import View
+from django.db.models import Q
+from django.http import JsonResponse
+from rest_framework import status
+from rest_framework.utils.encoders import JSONEncoder
+from .models import Expense, Passbook
+from .pagination import alist_response
+from .serializers import ExpenseSerializer, FlatPassbookSerializer
+from .cache import cache_key, acached_data, user_scope, BALANCES_SCOPE
+from .utility import create_expense, generate_balances
+
+
+def json_response(data, status_code=status.HTTP_200_OK):
+    return JsonResponse(data, status=status_code, safe=False, encoder=JSONEncoder)
+
+
+async def list_or_stream(request, queryset, serializer_class):
+    result = await alist_response(request, queryset, serializer_class)
+    if isinstance(result, tuple):
+        return json_response(*result)
+    return result
+
+
+class AsyncAddExpense(View):
+    """
+    Async version of AddExpense.
+
+    Methods: GET and POST
+
+    Listing uses the async ORM. Creating an expense needs a transaction, which Django's async ORM cannot open,
+    so the write runs in a worker thread through sync_to_async. The notifications of the participants are added
+    to their digest buffers in the same transaction, so the response does not wait on the broker.
+    """
+    async def get(self, request, *args, **kwargs):
+        return await list_or_stream(request, Expense.objects.all(), ExpenseSerializer)
+
+    async def post(self, request, *args, **kwargs):
+        try:
+            request_data = json.loads(request.body)
+        except ValueError:
+            return json_response({"Error":"Request body must be JSON"}, status.HTTP_400_BAD_REQUEST)
+        if not isinstance(request_data, dict):
+            return json_response({"Error":"Request body must be a JSON object"}, status.HTTP_400_BAD_REQUEST)
+        response = await sync_to_async(create_expense)(request_data)
+        return json_response(response.data, response.status_code)
+
+
+class AsyncRetreiveExpense(View):
+    """
+    Async version of RetreiveExpense.
+
+    Methods: GET
+    """
+    async def get(self, request, *args, **kwargs):
+        return await list_or_stream(request, Expense.objects.filter(payer=kwargs['user']), ExpenseSerializer)
+
+
+class AsyncListPassbook(View):
+    """
+    Async version of ListPassbook.
+
+    Methods: GET
+    """
+    async def get(self, request, *args, **kwargs):
+        if request.GET.get('simplify', False):
+            async def build():
+                # Same read path as ListPassbook, so both endpoints cache what generate_balances returns, from the
+                # ledger engine when it is enabled.
+                return await sync_to_async(generate_balances)(True), status.HTTP_200_OK
+            return json_response(*await acached_data(cache_key('simplified_balances', [BALANCES_SCOPE]), build))
+        return await list_or_stream(request, Passbook.objects.all(), FlatPassbookSerializer)
+
+
+class AsyncUserPassbook(View):
+    """
+    Async version of UserPassbook.
+
+    Methods: GET
+    """
+    async def get(self, request, *args, **kwargs):
+        user = kwargs['user']
+        queryset = Passbook.objects.filter(Q(user=user) | Q(owes_to=user))
+        if request.GET.get('stream') == 'ndjson':
+            return await list_or_stream(request, queryset, FlatPassbookSerializer)
+
+        async def build():
+            return await alist_response(request, queryset, FlatPassbookSerializer)
+        key = cache_key('user_passbook', [user_scope(user)], [request.GET.get('cursor', ''), request.GET.get('page_size', '')])
+        return json_response(*await acached_data(key, build))
@@ -0,0 +1,131 @@
+from django.core.cache import cache
+from rest_framework import status
+from rest_framework.response import Response
+from splitwise.settings import LEDGER_CACHE_TIMEOUT, LEDGER_CACHE_ENABLED
+
+BALANCES_SCOPE = 'balances'
+HITS_KEY = 'ledger_cache:hits'
+MISSES_KEY = 'ledger_cache:misses'
+
+
+def user_scope(user_id):
+    return f'user:{user_id}'
+
+
+def group_scope(group_id):
+    return f'group:{group_id}'
+
+
+def get_version(scope):
+    """
+    Returns the current version counter of a ledger scope, starting at 1.
+    """
+    return cache.get_or_set(f'ledger_version:{scope}', 1, timeout=None)
+
+
+def bump_versions(scopes):
+    """
+    Increments the version counters of the given scopes, so every cache entry built from them is never read again.
+
+    Notes:
+    - Call it once the ledger change is committed (transaction.on_commit), otherwise a concurrent reader could
+      cache the old ledger under the new version.
+    """
+    for scope in scopes:
+        key = f'ledger_version:{scope}'
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 2, timeout=None)
+
+
+def bump_ledger_versions(user_ids, group_id=None):
+    """
+    Invalidates the cached passbook of every given user and the cached simplified balances,
+    and those of the group the change belongs to, if any.
+    """
+    group_scopes = [group_scope(group_id)] if group_id is not None else []
+    bump_versions([user_scope(user_id) for user_id in set(user_ids)] + [BALANCES_SCOPE] + group_scopes)
+
+
+def cache_key(name, scopes, params=()):
+    """
+    Builds a cache key carrying the current version of every scope the cached value depends on.
+    """
+    versions = ':'.join(f'{scope}@{get_version(scope)}' for scope in scopes)
+    return ':'.join([f'ledger_cache:{name}', versions, *[str(param) for param in params]])
+
+
+def cached_response(key, build_response):
+    """
+    Read-through cache for GET responses.
+
+    Parameters:
+    - key (str): Versioned cache key built with cache_key.
+    - build_response (callable): Builds the Response on a miss. Only 200 responses are cached.
+
+    Returns: The cached or freshly built Response.
+
+    Notes:
+    - Responses are always built when LEDGER_CACHE_ENABLED is off, see splitwise/settings.py.
+    """
+    if not LEDGER_CACHE_ENABLED:
+        return build_response()
+    data = cache.get(key)
+    if data is not None:
+        _count(HITS_KEY)
+        return Response(data,status=status.HTTP_200_OK)
+
+    _count(MISSES_KEY)
+    response = build_response()
+    if response.status_code == status.HTTP_200_OK:
+        cache.set(key, response.data, timeout=LEDGER_CACHE_TIMEOUT)
+    return response
+
+
+async def acached_data(key, build):
+    """
+    Async counterpart of cached_response.
+
+    Parameters:
+    - key (str): Versioned cache key built with cache_key.
+    - build (coroutine function): Builds a (data, status) tuple on a miss. Only 200 results are cached.
+
+    Returns: The cached or freshly built (data, status) tuple.
+    """
+    if not LEDGER_CACHE_ENABLED:
+        return await build()
+    data = await cache.aget(key)
+    if data is not None:
+        await _acount(HITS_KEY)
+        return data, status.HTTP_200_OK
+
+    await _acount(MISSES_KEY)
+    data, status_code = await build()
+    if status_code == status.HTTP_200_OK:
+        await cache.aset(key, data, timeout=LEDGER_CACHE_TIMEOUT)
+    return data, status_code
+
+
+def cache_stats():
+    """
+    Returns the hit and miss counters of the ledger cache.
+    """
+    counters = cache.get_many([HITS_KEY, MISSES_KEY])
+    return {"hits": counters.get(HITS_KEY, 0), "misses": counters.get(MISSES_KEY, 0)}
+
+
+def _count(key):
+    try:
+        cache.incr(key)
+    except ValueError:
+        cache.add(key, 0, timeout=None)
+        cache.incr(key)
+
+
+async def _acount(key):
+    try:
+        await cache.aincr(key)
+    except ValueError:
+        await cache.aadd(key, 0, timeout=None)
+        await cache.aincr(key)
@@ -0,0 +1,263 @@
+import os
+import mmap
+import struct
+import tempfile
+from array import array
+from bisect import bisect_left
+from django.conf import settings
+from .models import Passbook
+from .ledger import aggregate_pair_balances, latest_checkpoint
+from .splits import to_minor_units, from_minor_units
+
+# File header: magic, format version, watermark, number of users, number of pairs, size of the userId blob.
+MAGIC = b'SWLEDGER'
+VERSION = 1
+HEADER = struct.Struct('<8sIxxxxqqqq')
+
+
+class LedgerEngine:
+    """
+    Compact, read-only copy of the pair balances of a balance snapshot.
+
+    Users are numbered 0..n-1 in increasing user id order and the pairs are stored in compressed sparse row form:
+    the pairs of user i, with i as the lower index, are cols[row_ptr[i]:row_ptr[i + 1]], each col being the index
+    of the higher user and the matching amounts the signed balance in minor units, positive when the lower user
+    owes the higher one. A pair costs 12 bytes (a 4 byte index and an 8 byte amount) and a user 24 bytes plus its
+    userId, against a few hundred bytes for a pair in nested dictionaries of Decimal.
+
+    Notes:
+    - Once saved, the engine is opened with mmap and every array is a memoryview over the mapping, so the worker
+      processes of one host share the same pages of the page cache and nothing is parsed at startup.
+    - The arrays use the byte order of the host that wrote them, the file is not meant to be copied across platforms.
+    """
+    def __init__(self, watermark, user_ids, key_offsets, keys, row_ptr, cols, amounts):
+        self.watermark = watermark
+        self.user_ids = user_ids
+        self.key_offsets = key_offsets
+        self.keys = keys
+        self.row_ptr = row_ptr
+        self.cols = cols
+        self.amounts = amounts
+
+    @classmethod
+    def from_pair_balances(cls, pair_balances, user_keys, watermark):
+        """
+        Builds an engine from a pair balance dictionary.
+
+        Parameters:
+        - pair_balances (dict): (user_low_id, user_high_id) -> signed amount, as returned by current_pair_balances.
+        - user_keys (dict): user id -> userId of every user of pair_balances.
+        - watermark (int): Id of the last passbook entry included in pair_balances.
+        """
+        user_ids = array('q', sorted({user_id for pair in pair_balances for user_id in pair}))
+        index = {user_id: position for position, user_id in enumerate(user_ids)}
+
+        key_offsets, keys = array('q', [0]), bytearray()
+        for user_id in user_ids:
+            keys += user_keys[user_id].encode()
+            key_offsets.append(len(keys))
+
+        rows = sorted((index[low], index[high], to_minor_units(amount))
+                      for (low, high), amount in pair_balances.items() if amount != 0)
+        row_ptr, cols, amounts = array('q', [0] * (len(user_ids) + 1)), array('i'), array('q')
+        for low, high, amount in rows:
+            row_ptr[low + 1] += 1
+            cols.append(high)
+            amounts.append(amount)
+        for position in range(len(user_ids)):
+            row_ptr[position + 1] += row_ptr[position]
+        return cls(watermark, user_ids, key_offsets, bytes(keys), row_ptr, cols, amounts)
+
+    @classmethod
+    def open(cls, path):
+        """
+        Maps a file written by save() and returns an engine reading its arrays in place.
+
+        Raises: ValueError when the file is not a ledger engine snapshot of this format version.
+        """
+        with open(path, 'rb') as snapshot:
+            buffer = mmap.mmap(snapshot.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(buffer) < HEADER.size:
+            raise ValueError(f'{path} is not a ledger engine snapshot.')
+        magic, version, watermark, users, pairs, key_bytes = HEADER.unpack_from(buffer)
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f'{path} is not a ledger engine snapshot.')
+
+        view, offset = memoryview(buffer), HEADER.size
+
+        def section(typecode, length):
+            nonlocal offset
+            size = struct.calcsize(typecode) * length
+            values = view[offset:offset + size].cast(typecode)
+            offset += size + (-size % 8)
+            return values
+
+        user_ids = section('q', users)
+        key_offsets = section('q', users + 1)
+        row_ptr = section('q', users + 1)
+        cols = section('i', pairs)
+        amounts = section('q', pairs)
+        keys = view[offset:offset + key_bytes]
+        return cls(watermark, user_ids, key_offsets, keys, row_ptr, cols, amounts)
+
+    def save(self, path):
+        """
+        Writes the engine to `path`, atomically replacing any previous snapshot.
+
+        Notes:
+        - Processes that mapped the previous file keep reading it until they reopen the new one, see get_engine.
+        """
+        directory = os.path.dirname(os.path.abspath(path))
+        descriptor, temporary = tempfile.mkstemp(dir=directory, prefix='.ledger_engine.')
+        try:
+            with os.fdopen(descriptor, 'wb') as snapshot:
+                snapshot.write(HEADER.pack(MAGIC, VERSION, self.watermark, len(self.user_ids), len(self.cols),
+                                           len(self.keys)))
+                for values in (self.user_ids, self.key_offsets, self.row_ptr, self.cols, self.amounts):
+                    data = bytes(values)
+                    snapshot.write(data + b'\0' * (-len(data) % 8))
+                snapshot.write(bytes(self.keys))
+            os.replace(temporary, path)
+        except BaseException:
+            os.unlink(temporary)
+            raise
+
+    @property
+    def nbytes(self):
+        return sum(len(values) * values.itemsize
+                   for values in (self.user_ids, self.key_offsets, self.row_ptr, self.cols, self.amounts)) + len(self.keys)
+
+    def __len__(self):
+        return len(self.cols)
+
+    def index_of(self, user_id):
+        """
+        Returns the dense index of a user id, or None when the user has no balance in the engine.
+        """
+        position = bisect_left(self.user_ids, user_id)
+        if position < len(self.user_ids) and self.user_ids[position] == user_id:
+            return position
+        return None
+
+    def user_key(self, position):
+        return bytes(self.keys[self.key_offsets[position]:self.key_offsets[position + 1]]).decode()
+
+    def pairs(self):
+        """
+        Yields (low index, high index, signed minor units) for every pair, in index order.
+        """
+        row_ptr, cols, amounts = self.row_ptr, self.cols, self.amounts
+        for low in range(len(self.user_ids)):
+            for position in range(row_ptr[low], row_ptr[low + 1]):
+                yield low, cols[position], amounts[position]
+
+    def net_positions(self):
+        """
+        Returns an array of the net position of every user in minor units, indexed like user_ids.
+        """
+        positions = array('q', [0] * len(self.user_ids))
+        for low, high, amount in self.pairs():
+            positions[low] -= amount
+            positions[high] += amount
+        return positions
+
+
+def build_engine(path=None):
+    """
+    Writes the ledger engine snapshot of the latest balance checkpoint.
+
+    Parameters:
+    - path (str): Optional file to write, defaults to LEDGER_ENGINE_PATH.
+
+    Returns: The engine that was written.
+    """
+    from .utility import user_keys_of
+    checkpoint = latest_checkpoint()
+    pair_balances, watermark = {}, 0
+    if checkpoint is not None:
+        watermark = checkpoint.watermark
+        pair_balances = {(low, high): amount for low, high, amount in
+                         checkpoint.balances.values_list('user_low_id', 'user_high_id', 'amount').iterator()}
+    user_keys = user_keys_of({user_id for pair in pair_balances for user_id in pair})
+    engine = LedgerEngine.from_pair_balances(pair_balances, user_keys, watermark)
+    engine.save(path or settings.LEDGER_ENGINE_PATH)
+    return engine
+
+
+_loaded = {}
+
+
+def get_engine():
+    """
+    Returns the ledger engine of this process when LEDGER_ENGINE_ENABLED is set and its snapshot matches the
+    latest balance checkpoint, None otherwise.
+
+    Notes:
+    - The file is mapped once per process and mapped again when build_engine replaced it.
+    - An engine older than the latest checkpoint is not used: compact_passbook may already have deleted passbook
+      entries between both watermarks, which the engine could then never see.
+    """
+    if not settings.LEDGER_ENGINE_ENABLED:
+        return None
+    path = settings.LEDGER_ENGINE_PATH
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    version = (path, stat.st_ino, stat.st_mtime_ns, stat.st_size)
+    if _loaded.get('version') != version:
+        _loaded['engine'], _loaded['version'] = LedgerEngine.open(path), version
+    engine = _loaded['engine']
+    checkpoint = latest_checkpoint()
+    if engine.watermark != (checkpoint.watermark if checkpoint is not None else 0):
+        return None
+    return engine
+
+
+def delta_minor_units(engine):
+    """
+    Returns the passbook entries written after the engine watermark as (user_low_id, user_high_id) -> minor units.
+    """
+    delta = Passbook.objects.filter(id__gt=engine.watermark)
+    return {(low, high): to_minor_units(amount) for low, high, amount in aggregate_pair_balances(delta)}
+
+
+def engine_pair_balances(engine):
+    """
+    Yields ((low userId, high userId), signed amount) for every pair with an outstanding balance, reading the
+    engine plus the passbook entries written since its snapshot.
+    """
+    from .utility import user_keys_of
+    delta = delta_minor_units(engine)
+    user_ids = engine.user_ids
+    for low, high, amount in engine.pairs():
+        amount += delta.pop((user_ids[low], user_ids[high]), 0)
+        if amount:
+            yield (engine.user_key(low), engine.user_key(high)), from_minor_units(amount)
+
+    user_keys = user_keys_of({user_id for pair in delta for user_id in pair})
+    for (low, high), amount in delta.items():
+        if amount:
+            yield (user_keys[low], user_keys[high]), from_minor_units(amount)
+
+
+def engine_net_positions(engine):
+    """
+    Returns the net position of every user with outstanding debts, keyed by userId, reading the engine plus the
+    passbook entries written since its snapshot.
+    """
+    from .utility import user_keys_of
+    positions = engine.net_positions()
+    extra = {}
+    for (low, high), amount in delta_minor_units(engine).items():
+        for user_id, signed in ((low, -amount), (high, amount)):
+            position = engine.index_of(user_id)
+            if position is not None:
+                positions[position] += signed
+            else:
+                extra[user_id] = extra.get(user_id, 0) + signed
+
+    keyed = {engine.user_key(position): from_minor_units(amount) for position, amount in enumerate(positions) if amount}
+    user_keys = user_keys_of(extra)
+    keyed.update({user_keys[user_id]: from_minor_units(amount) for user_id, amount in extra.items() if amount})
+    return keyed
@@ -0,0 +1,177 @@
+import csv
+import json
+from django.db import transaction
+from user.models import User
+from splitwise.settings import IMPORT_CHUNK_SIZE
+from .models import Expense, Passbook
+from .serializers import ExpenseImportSerializer
+from .cache import bump_ledger_versions
+from .utility import compute_shares, parse_participant_ids, apply_balance_deltas, USER_LOOKUP_BATCH_SIZE
+from .netting import net_pair_balances
+from .rollups import rollup_deltas_dict, add_expense_to_rollups, apply_rollup_deltas
+
+
+def decode_lines(lines, invalid_lines):
+    """
+    Yields the lines of an import file as text, decoding bytes as UTF-8.
+
+    A line that is not valid UTF-8 is decoded with replacement characters and its number added to invalid_lines,
+    so read_records can reject the record it belongs to instead of aborting the whole import.
+    """
+    for line_number, line in enumerate(lines, 1):
+        if isinstance(line, bytes):
+            try:
+                line = line.decode('utf-8')
+            except UnicodeDecodeError:
+                invalid_lines.add(line_number)
+                line = line.decode('utf-8', errors='replace')
+        yield line
+
+
+def read_records(lines, content_format):
+    """
+    Parses an import file one record at a time.
+
+    Parameters:
+    - lines (iterable): Lines of the file, as text or as UTF-8 encoded bytes.
+    - content_format (str): "ndjson" or "csv". CSV files need a header row, their participant_detail column
+                            holds the participant list as JSON.
+
+    Yields: (line number, record, error) tuples, record is None when the line could not be parsed.
+    """
+    invalid_lines = set()
+    lines = decode_lines(lines, invalid_lines)
+    if content_format == 'csv':
+        reader = csv.DictReader(lines)
+        for row in reader:
+            # A quoted field may span several lines, every line read for this row is checked.
+            if invalid_lines:
+                invalid_lines.clear()
+                yield reader.line_num, None, "Line is not valid UTF-8"
+                continue
+            try:
+                row['participant_detail'] = json.loads(row.get('participant_detail') or '')
+            except ValueError:
+                yield reader.line_num, None, "participant_detail must be a JSON list"
+                continue
+            yield reader.line_num, row, None
+    else:
+        for line_number, line in enumerate(lines, 1):
+            if line_number in invalid_lines:
+                yield line_number, None, "Line is not valid UTF-8"
+                continue
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                yield line_number, None, "Invalid JSON"
+                continue
+            if not isinstance(record, dict):
+                yield line_number, None, "Each line must be a JSON object"
+                continue
+            yield line_number, record, None
+
+
+def import_expenses(records, on_reject, chunk_size=IMPORT_CHUNK_SIZE):
+    """
+    Validates and writes expenses in a streaming pass.
+
+    Parameters:
+    - records (iterable): (line number, record, error) tuples, as yielded by read_records.
+    - on_reject (callable): Called with (line number, record, error) for every record that is not imported.
+    - chunk_size (int): Number of expenses written per transaction.
+
+    Returns: The number of expenses created.
+
+    Notes:
+    - Records are validated and split as they are read, only one chunk is held in memory.
+    - Each chunk resolves all its users at once, then bulk creates its expenses, passbook entries and balance
+      updates in one transaction. Imported expenses do not send notification emails.
+    """
+    created, chunk = 0, []
+    for line_number, record, error in records:
+        if error is None:
+            expense, shares, error = validate_record(record)
+        if error is not None:
+            on_reject(line_number, record, error)
+            continue
+        chunk.append((line_number, record, expense, shares))
+        if len(chunk) == chunk_size:
+            created += write_chunk(chunk, on_reject)
+            chunk = []
+    if chunk:
+        created += write_chunk(chunk, on_reject)
+    return created
+
+
+def validate_record(record):
+    """
+    Validates one record and computes its shares without querying the database.
+
+    Returns: A tuple (expense, shares, error), expense is an unsaved Expense.
+    """
+    serializer = ExpenseImportSerializer(data=record)
+    if not serializer.is_valid():
+        return None, None, json.dumps(serializer.errors)
+    data = serializer.validated_data
+    participant_detail = data.pop('participant_detail')
+    try:
+        shares, error = compute_shares(data['expense_type'], data['amount'], participant_detail)
+    except (KeyError, TypeError):
+        return None, None, "Each participant must be an object with an id"
+    except (ValueError, ArithmeticError):
+        return None, None, "Invalid participant_detail"
+    if error:
+        return None, None, error
+    shares = parse_participant_ids(shares)
+    if shares is None:
+        return None, None, "Each participant's id must be an integer"
+    return Expense(payer_id=data.pop('payer'), **data), shares, None
+
+
+def existing_user_ids(user_ids):
+    user_ids = list(user_ids)
+    existing = set()
+    for start in range(0, len(user_ids), USER_LOOKUP_BATCH_SIZE):
+        existing.update(User.objects.filter(id__in=user_ids[start:start + USER_LOOKUP_BATCH_SIZE]).values_list('id', flat=True))
+    return existing
+
+
+def write_chunk(chunk, on_reject):
+    """
+    Writes a chunk of validated expenses in a single transaction, rejecting those referencing unknown users.
+
+    Returns: The number of expenses created.
+    """
+    referenced_ids = set()
+    for _, _, expense, shares in chunk:
+        referenced_ids.add(expense.payer_id)
+        referenced_ids.update(participant_id for participant_id, _ in shares)
+    known_ids = existing_user_ids(referenced_ids)
+
+    valid = []
+    for line_number, record, expense, shares in chunk:
+        missing_ids = sorted({expense.payer_id, *(participant_id for participant_id, _ in shares)} - known_ids)
+        if missing_ids:
+            on_reject(line_number, record, f"Users with ids {missing_ids} do not exist")
+        else:
+            valid.append((expense, shares))
+    if not valid:
+        return 0
+
+    rollup_deltas, affected_user_ids = rollup_deltas_dict(), set()
+    with transaction.atomic():
+        expenses = Expense.objects.bulk_create([expense for expense, _ in valid])
+        passbooks = []
+        for expense, (_, shares) in zip(expenses, valid):
+            add_expense_to_rollups(rollup_deltas, expense, shares)
+            affected_user_ids.add(expense.payer_id)
+            for participant_id, amount in shares:
+                passbooks.append(Passbook(expense=expense, user_id=participant_id, owes_to_id=expense.payer_id, amount=amount))
+                affected_user_ids.add(participant_id)
+        Passbook.objects.bulk_create(passbooks, batch_size=1000)
+        apply_balance_deltas(net_pair_balances((passbook.user_id, passbook.owes_to_id, passbook.amount) for passbook in passbooks))
+        apply_rollup_deltas(rollup_deltas)
+        transaction.on_commit(lambda: bump_ledger_versions(affected_user_ids))
+    return len(expenses)
@@ -0,0 +1,212 @@
+from datetime import timedelta
+from decimal import Decimal
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from django.db import transaction, connections
+from django.db.models import F, Case, When, Sum, Min, Max
+from django.db.models.functions import Least, Greatest
+from django.utils import timezone
+from splitwise.settings import SNAPSHOT_SAFETY_LAG
+from splitwise.db import setup_worker, database_names
+from .models import Passbook, LedgerCheckpoint, BalanceSnapshot, PassbookCompaction
+from .splits import CENT
+
+
+def aggregate_pair_balances(queryset=None):
+    """
+    Nets passbook entries into one signed amount per unordered user pair inside the database.
+
+    Parameters:
+    - queryset (QuerySet): Optional passbook queryset to aggregate, defaults to every entry.
+
+    Returns: A queryset of (user_low_id, user_high_id, amount) tuples, one per pair, in the same sign convention
+             as the Balance model: positive when user_low owes user_high.
+
+    Notes:
+    - Grouping and netting are done with a conditional aggregate, so only one row per pair leaves the database.
+    """
+    if queryset is None:
+        queryset = Passbook.objects.all()
+    amount_field = Passbook._meta.get_field('amount')
+    return queryset.exclude(user=F('owes_to')).\
+                    annotate(user_low_id=Least('user_id', 'owes_to_id'), user_high_id=Greatest('user_id', 'owes_to_id')).\
+                    values('user_low_id', 'user_high_id').\
+                    annotate(net_amount=Sum(Case(When(user_id=F('user_low_id'), then=F('amount')),
+                                                 default=-F('amount'),
+                                                 output_field=amount_field))).\
+                    exclude(net_amount=0).\
+                    values_list('user_low_id', 'user_high_id', 'net_amount')
+
+
+def latest_checkpoint():
+    return LedgerCheckpoint.objects.order_by('-watermark').first()
+
+
+def compacted_before():
+    """
+    Returns the latest `before` date passed to compact_passbook, entries created earlier may have been archived and
+    deleted. None when the passbook was never compacted.
+    """
+    return PassbookCompaction.objects.aggregate(before=Max('before'))['before']
+
+
+def current_pair_balances():
+    """
+    Returns the net balance of every user pair, reading the latest snapshot plus the passbook entries written since.
+
+    Returns: A dictionary (user_low_id, user_high_id) -> signed amount, positive when user_low owes user_high.
+
+    Notes:
+    - Only entries with an id above the checkpoint watermark are aggregated, so the cost depends on the activity
+      since the last checkpoint and on the number of pairs, not on the whole history.
+    """
+    balances, watermark = defaultdict(Decimal), 0
+    checkpoint = latest_checkpoint()
+    if checkpoint is not None:
+        watermark = checkpoint.watermark
+        for low, high, amount in checkpoint.balances.values_list('user_low_id', 'user_high_id', 'amount').iterator():
+            balances[(low, high)] = amount
+    for low, high, amount in aggregate_pair_balances(Passbook.objects.filter(id__gt=watermark)):
+        balances[(low, high)] += amount.quantize(CENT)
+    return {pair: amount for pair, amount in balances.items() if amount != 0}
+
+
+def parallel_pair_balances(workers, chunks_per_worker=4):
+    """
+    Computes the same balances as current_pair_balances, aggregating the passbook entries above the checkpoint
+    watermark in a pool of worker processes.
+
+    Parameters:
+    - workers (int): Number of worker processes.
+    - chunks_per_worker (int): The id range is cut into workers * chunks_per_worker slices, so a slow slice
+                               does not leave the other workers idle.
+
+    Returns: A (pair balances, number of passbook entries aggregated) tuple.
+
+    Notes:
+    - Every worker aggregates its id slices with its own database connection, the parent closes its connections
+      before the pool is started so none is shared with a forked worker. Workers are set up by
+      splitwise.db.setup_worker, so the pool works with the fork, spawn and forkserver start methods.
+    - The partial pair sums are merged pairwise by the pool, level after level, in log2(slices) rounds.
+    - Each process needs its own connection to the same database, an in-memory SQLite database cannot be used.
+    """
+    checkpoint = latest_checkpoint()
+    watermark = checkpoint.watermark if checkpoint is not None else 0
+    bounds = Passbook.objects.filter(id__gt=watermark).aggregate(low=Min('id'), high=Max('id'))
+    balances = defaultdict(Decimal)
+    if checkpoint is not None:
+        for low, high, amount in checkpoint.balances.values_list('user_low_id', 'user_high_id', 'amount').iterator():
+            balances[(low, high)] = amount
+    if bounds['low'] is None:
+        return dict(balances), 0
+    rows = Passbook.objects.filter(id__gte=bounds['low'], id__lte=bounds['high']).count()
+
+    slices = split_id_range(bounds['low'], bounds['high'], workers * chunks_per_worker)
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=setup_worker, initargs=(database_names(),)) as executor:
+        partials = list(executor.map(aggregate_id_range, slices))
+        while len(partials) > 1:
+            pairs = [partials[index:index + 2] for index in range(0, len(partials), 2)]
+            partials = list(executor.map(merge_pair_balances, pairs))
+
+    for pair, amount in partials[0].items():
+        balances[pair] += amount
+    return {pair: amount for pair, amount in balances.items() if amount != 0}, rows
+
+
+def split_id_range(low, high, parts):
+    """
+    Cuts the inclusive id range [low, high] into at most `parts` contiguous (first, last) slices.
+    """
+    size = max((high - low + 1 + parts - 1) // parts, 1)
+    return [(start, min(start + size - 1, high)) for start in range(low, high + 1, size)]
+
+
+def aggregate_id_range(bounds):
+    """
+    Worker body: nets the passbook entries with an id in the inclusive range `bounds` per user pair.
+    """
+    first, last = bounds
+    entries = Passbook.objects.filter(id__gte=first, id__lte=last)
+    return {(low, high): amount.quantize(CENT) for low, high, amount in aggregate_pair_balances(entries)}
+
+
+def merge_pair_balances(partials):
+    """
+    Worker body: adds up one or two partial pair balance dictionaries.
+    """
+    merged = dict(partials[0])
+    for partial in partials[1:]:
+        for pair, amount in partial.items():
+            merged[pair] = merged.get(pair, 0) + amount
+    return merged
+
+
+def group_pair_balances(group_id):
+    """
+    Returns the net balance of every user pair within a group, in the same format as current_pair_balances.
+
+    Notes:
+    - Only the passbook entries of the group are aggregated, found through passbook_group_user_idx,
+      so the cost depends on the size of the group and not on the whole passbook.
+    """
+    return {(low, high): amount.quantize(CENT)
+            for low, high, amount in aggregate_pair_balances(Passbook.objects.filter(group_id=group_id))}
+
+
+def net_positions(pair_balances):
+    """
+    Returns the net position of every user with outstanding debts in a pair balance dictionary, keyed by user id.
+    Positive positions are owed money, negative positions owe money.
+    """
+    positions = defaultdict(Decimal)
+    for (low, high), amount in pair_balances.items():
+        positions[low] -= amount
+        positions[high] += amount
+    return {user_id: amount for user_id, amount in positions.items() if amount != 0}
+
+
+def current_net_positions():
+    """
+    Returns the net position of every user with outstanding debts, keyed by user id.
+    """
+    return net_positions(current_pair_balances())
+
+
+def checkpoint_balances(safety_lag=SNAPSHOT_SAFETY_LAG):
+    """
+    Writes a new balance snapshot covering every passbook entry up to a watermark id.
+
+    Parameters:
+    - safety_lag (int): Entries younger than this many seconds are left for the next checkpoint, so a transaction
+                        that is still in flight with a lower id cannot be skipped by the watermark.
+
+    Returns: The new LedgerCheckpoint, or the previous one when there was nothing to checkpoint.
+
+    Notes:
+    - The new snapshot is the previous snapshot plus the aggregated entries between both watermarks, so a checkpoint
+      only reads the entries written since the previous one. Older checkpoints are deleted.
+    """
+    with transaction.atomic():
+        previous = LedgerCheckpoint.objects.select_for_update().order_by('-watermark').first()
+        previous_watermark = previous.watermark if previous is not None else 0
+        cutoff = timezone.now() - timedelta(seconds=safety_lag)
+        watermark = Passbook.objects.filter(id__gt=previous_watermark, created_at__lt=cutoff).aggregate(Max('id'))['id__max']
+        if watermark is None:
+            return previous
+
+        balances = defaultdict(Decimal)
+        if previous is not None:
+            for low, high, amount in previous.balances.values_list('user_low_id', 'user_high_id', 'amount').iterator():
+                balances[(low, high)] = amount
+        delta = Passbook.objects.filter(id__gt=previous_watermark, id__lte=watermark)
+        for low, high, amount in aggregate_pair_balances(delta):
+            balances[(low, high)] += amount.quantize(CENT)
+
+        checkpoint = LedgerCheckpoint.objects.create(watermark=watermark)
+        BalanceSnapshot.objects.bulk_create([
+            BalanceSnapshot(checkpoint=checkpoint, user_low_id=low, user_high_id=high, amount=amount)
+            for (low, high), amount in balances.items() if amount != 0
+        ], batch_size=1000)
+        LedgerCheckpoint.objects.exclude(pk=checkpoint.pk).delete()
+    return checkpoint
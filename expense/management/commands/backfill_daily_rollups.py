@@ -0,0 +1,47 @@
+from datetime import date
+from django.db import transaction
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from expense.models import DailyRollup
+from expense.rollups import compute_rollups
+from expense.ledger import compacted_before
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the DailyRollup table from the expenses and their passbook entries.
+
+    With --since only the rollups from that day on are rebuilt, older days are left untouched.
+    Once compact_passbook has run, the days it archived entries of can no longer be rebuilt, so --since must be the
+    day passed to its --before or later.
+    """
+    help = 'Backfills the daily per-user spending rollups from Expense and Passbook rows.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', help='First day to rebuild, as YYYY-MM-DD. Defaults to the whole history.')
+
+    def handle(self, *args, **options):
+        since = None
+        if options['since']:
+            try:
+                since = date.fromisoformat(options['since'])
+            except ValueError:
+                raise CommandError('--since must be a date formatted as YYYY-MM-DD')
+
+        compacted = compacted_before()
+        first_day = timezone.localdate(compacted) if compacted is not None else None
+        if first_day is not None and (since is None or since < first_day):
+            raise CommandError(f'Passbook entries created before {first_day} were archived by compact_passbook, '
+                               f'rebuilding earlier days would drop their shares. Pass --since {first_day} or later.')
+
+        rollups = compute_rollups(since)
+        with transaction.atomic():
+            stale = DailyRollup.objects.all()
+            if since is not None:
+                stale = stale.filter(day__gte=since)
+            stale.delete()
+            DailyRollup.objects.bulk_create([
+                DailyRollup(user_id=user_id, day=day, expense_type=expense_type, paid=paid, owed=owed, count=count)
+                for (user_id, day, expense_type), (paid, owed, count) in rollups.items()
+            ], batch_size=1000)
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(rollups)} daily rollups.'))
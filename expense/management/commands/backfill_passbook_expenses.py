@@ -0,0 +1,76 @@
+from decimal import Decimal
+from django.db import transaction
+from django.core.management.base import BaseCommand, CommandError
+from expense.models import Expense, Passbook, PassbookCompaction
+from expense.cache import bump_ledger_versions
+
+
+class Command(BaseCommand):
+    """
+    Links passbook entries written before Passbook.expense existed to their expense and copies its created_at.
+
+    Entries of an expense used to be saved one after another right before the expense itself, so for every payer
+    the unlinked entries, in id order, are consumed until they add up to the amount of the payer's next expense.
+    Expenses whose amount cannot be matched are skipped: a split rejected with a 400 used to leave its expense saved
+    without any entry. Entries left over once every expense was tried are reported and stay unlinked.
+
+    The command must run before compact_passbook archives any unlinked entry: with some of a payer's entries
+    missing, the remaining ones would be matched to the wrong expenses.
+    """
+    help = 'Backfills Passbook.expense and Passbook.created_at for entries created before they existed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true', help='Only report what would be linked.')
+
+    def handle(self, *args, **options):
+        if PassbookCompaction.objects.filter(unlinked_entries__gt=0).exists():
+            raise CommandError('compact_passbook already archived passbook entries not linked to an expense, '
+                               'the remaining entries can no longer be matched reliably.')
+        linked, skipped_expenses, unmatched_entries = 0, 0, 0
+        payer_ids = Passbook.objects.filter(expense__isnull=True).values_list('owes_to_id', flat=True).distinct()
+
+        for payer_id in payer_ids:
+            entries = list(Passbook.objects.filter(owes_to_id=payer_id, expense__isnull=True).order_by('id'))
+            expenses = Expense.objects.filter(payer_id=payer_id).exclude(passbook_entries__isnull=False).order_by('id')
+            updates, skipped = self.match_entries(entries, expenses)
+            skipped_expenses += skipped
+            unmatched_entries += len(entries) - len(updates)
+            if not updates:
+                continue
+            linked += len(updates)
+            if not options['dry_run']:
+                with transaction.atomic():
+                    Passbook.objects.bulk_update(updates, ['expense', 'created_at'], batch_size=1000)
+                bump_ledger_versions([payer_id] + [entry.user_id for entry in updates])
+
+        self.stdout.write(self.style.SUCCESS(f'Linked {linked} passbook entries.'))
+        if skipped_expenses:
+            self.stdout.write(self.style.WARNING(f'Skipped {skipped_expenses} expenses without matching entries.'))
+        if unmatched_entries:
+            self.stdout.write(self.style.WARNING(f'Left {unmatched_entries} passbook entries unlinked.'))
+
+    def match_entries(self, entries, expenses):
+        """
+        Assigns consecutive entries to each expense until their amounts add up to it.
+
+        Returns a tuple (updated entries, number of expenses skipped). An expense the next entries do not add up to
+        is skipped and those entries are tried against the following expense. Percentage splits round every share,
+        so a difference of up to one paisa per entry is accepted.
+        """
+        updates, position, skipped = [], 0, 0
+        for expense in expenses:
+            if position == len(entries):
+                break
+            running_total, start = Decimal(0), position
+            while position < len(entries) and running_total < expense.amount - Decimal('0.01') * (position - start):
+                running_total += entries[position].amount
+                position += 1
+            if abs(running_total - expense.amount) > Decimal('0.01') * (position - start):
+                position = start
+                skipped += 1
+                continue
+            for entry in entries[start:position]:
+                entry.expense = expense
+                entry.created_at = expense.created_at
+                updates.append(entry)
+        return updates, skipped
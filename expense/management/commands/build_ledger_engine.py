@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+from expense.ledger import checkpoint_balances
+from expense.engine import build_engine
+
+
+class Command(BaseCommand):
+    """
+    Writes the ledger engine snapshot read by the web workers when LEDGER_ENGINE_ENABLED is set.
+
+    The snapshot holds the balances of the latest checkpoint, with --checkpoint a new checkpoint is written first.
+    Once enabled, checkpoint_balances_task rewrites the snapshot after every checkpoint.
+    """
+    help = 'Writes the memory-mapped ledger engine snapshot from the latest balance checkpoint.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--checkpoint', action='store_true', help='Checkpoint the balances before writing.')
+        parser.add_argument('--path', help='File to write, defaults to LEDGER_ENGINE_PATH.')
+
+    def handle(self, *args, **options):
+        if options['checkpoint']:
+            checkpoint_balances()
+        engine = build_engine(options['path'])
+        per_pair = f', {engine.nbytes / len(engine):.1f} bytes per pair' if len(engine) else ''
+        self.stdout.write(self.style.SUCCESS(
+            f'Wrote {len(engine)} pairs of {len(engine.user_ids)} users up to passbook entry {engine.watermark} '
+            f'({engine.nbytes} bytes{per_pair}).'))
@@ -0,0 +1,73 @@
+import gzip
+import json
+from datetime import datetime, time
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+from django.core.management.base import BaseCommand, CommandError
+from django.core.serializers.json import DjangoJSONEncoder
+from expense.models import Passbook, PassbookCompaction
+from expense.ledger import latest_checkpoint
+from expense.cache import bump_ledger_versions
+
+
+class Command(BaseCommand):
+    """
+    Archives old passbook entries to a gzip compressed NDJSON file and deletes them.
+
+    Only entries already covered by the latest balance checkpoint are compacted, so balances, settlements and
+    rebuild_balances keep their totals. The per-user passbook listings no longer show the archived entries.
+    Entries of a group are kept: group balances and settlements are aggregated from the group's own entries.
+
+    Every run is recorded as a PassbookCompaction before anything is deleted, so backfill_daily_rollups and
+    backfill_passbook_expenses can refuse to rebuild from a passbook missing the archived entries.
+    """
+    help = 'Archives passbook entries covered by the latest balance checkpoint to a compressed file and deletes them.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--before', required=True, help='Only compact entries created before this date (YYYY-MM-DD).')
+        parser.add_argument('--archive', required=True, help='Path of the .ndjson.gz archive to write.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        checkpoint = latest_checkpoint()
+        if checkpoint is None:
+            raise CommandError('No balance checkpoint exists yet, run the checkpoint_balances_task first.')
+        try:
+            before = timezone.make_aware(datetime.combine(datetime.strptime(options['before'], '%Y-%m-%d').date(), time.min))
+        except ValueError:
+            raise CommandError('--before must be a date in YYYY-MM-DD format.')
+
+        entries = Passbook.objects.filter(id__lte=checkpoint.watermark, created_at__lt=before, group__isnull=True).order_by('id')
+        fields = ['id', 'expense_id', 'group_id', 'user_id', 'owes_to_id', 'amount', 'created_at']
+        archived, affected_user_ids, last_id = 0, set(), 0
+        compaction = PassbookCompaction.objects.create(watermark=checkpoint.watermark, before=before, archive=options['archive'])
+
+        with gzip.open(options['archive'], 'wt', encoding='utf-8') as archive:
+            while True:
+                batch = list(entries.filter(id__gt=last_id).values(*fields)[:options['batch_size']])
+                if not batch:
+                    break
+                for row in batch:
+                    archive.write(json.dumps(row, cls=DjangoJSONEncoder) + '\n')
+                    affected_user_ids.update((row['user_id'], row['owes_to_id']))
+                archive.flush()
+                last_id = batch[-1]['id']
+                archived += self.delete_batch(compaction, batch)
+
+        if not archived:
+            compaction.delete()
+        bump_ledger_versions(affected_user_ids)
+        self.stdout.write(self.style.SUCCESS(f'Archived {archived} passbook entries to {options["archive"]}.'))
+
+    def delete_batch(self, compaction, rows):
+        """
+        Deletes a batch of archived entries and counts them on the compaction in the same transaction. The archive
+        is written first, so a crash can only leave extra rows in the archive, never delete unarchived ones.
+        """
+        unlinked = sum(row['expense_id'] is None for row in rows)
+        with transaction.atomic():
+            deleted, _ = Passbook.objects.filter(id__in=[row['id'] for row in rows]).delete()
+            PassbookCompaction.objects.filter(pk=compaction.pk).update(
+                entries=F('entries') + deleted, unlinked_entries=F('unlinked_entries') + unlinked)
+        return deleted
@@ -0,0 +1,45 @@
+import json
+import time
+from django.core.management.base import BaseCommand, CommandError
+from splitwise.settings import IMPORT_CHUNK_SIZE
+from expense.importer import read_records, import_expenses
+
+
+class Command(BaseCommand):
+    """
+    Imports expenses from an NDJSON or CSV file.
+
+    Rejected records are written to a reject file as NDJSON lines holding the line number, the error and the record.
+    """
+    help = 'Imports expenses from an NDJSON or CSV file and writes the rejected records to a reject file.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='File to import.')
+        parser.add_argument('--format', choices=['ndjson', 'csv'], help='File format, guessed from the extension by default.')
+        parser.add_argument('--rejects', help='Reject file, defaults to <path>.rejects.ndjson.')
+        parser.add_argument('--chunk-size', type=int, default=IMPORT_CHUNK_SIZE, help='Expenses written per transaction.')
+
+    def handle(self, *args, **options):
+        path = options['path']
+        content_format = options['format'] or ('csv' if path.endswith('.csv') else 'ndjson')
+        rejects_path = options['rejects'] or f'{path}.rejects.ndjson'
+
+        rejected = 0
+        try:
+            with open(path, 'rb') as source, open(rejects_path, 'w', encoding='utf-8') as rejects:
+                def on_reject(line_number, record, error):
+                    nonlocal rejected
+                    rejected += 1
+                    rejects.write(json.dumps({"line": line_number, "error": error, "record": record}, default=str) + '\n')
+
+                start = time.perf_counter()
+                created = import_expenses(read_records(source, content_format), on_reject, options['chunk_size'])
+                elapsed = time.perf_counter() - start
+        except OSError as error:
+            raise CommandError(str(error))
+
+        rate = (created + rejected) / elapsed if elapsed else 0
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {created} expenses, rejected {rejected} in {elapsed:.2f}s ({rate:.0f} rows/s).'))
+        if rejected:
+            self.stdout.write(self.style.WARNING(f'Rejected records written to {rejects_path}.'))
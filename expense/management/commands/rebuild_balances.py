@@ -0,0 +1,64 @@
+import time
+from decimal import Decimal
+from django.db import transaction
+from django.core.management.base import BaseCommand
+from expense.models import Balance, Passbook
+from expense.ledger import latest_checkpoint, current_pair_balances, parallel_pair_balances
+from expense.cache import bump_versions, BALANCES_SCOPE
+
+
+class Command(BaseCommand):
+    """
+    Rebuilds the materialized Balance table from the Passbook history.
+
+    With --check the table is only compared against the Passbook history and every drifted pair is reported.
+    With --workers N the Passbook is aggregated by N processes over id ranges, for audits of very large ledgers.
+    """
+    help = 'Rebuilds the pairwise Balance table from Passbook entries, or checks it for drift with --check.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--check', action='store_true', help='Only report pairs whose stored balance has drifted.')
+        parser.add_argument('--workers', type=int, default=1, help='Number of processes aggregating the passbook.')
+
+    def handle(self, *args, **options):
+        expected = self.compute_balances(options['workers'])
+
+        if options['check']:
+            stored = {(row['user_low_id'], row['user_high_id']): row['amount']
+                      for row in Balance.objects.values('user_low_id', 'user_high_id', 'amount')}
+            drifted = 0
+            for pair in expected.keys() | stored.keys():
+                expected_amount, stored_amount = expected.get(pair, 0), stored.get(pair, 0)
+                if expected_amount != stored_amount:
+                    drifted += 1
+                    self.stdout.write(f'Pair {pair}: stored {stored_amount}, expected {expected_amount}')
+            if drifted:
+                self.stdout.write(self.style.ERROR(f'{drifted} drifted pairs found.'))
+            else:
+                self.stdout.write(self.style.SUCCESS('Balances are consistent with the passbook.'))
+            return
+
+        with transaction.atomic():
+            Balance.objects.all().delete()
+            Balance.objects.bulk_create(
+                [Balance(user_low_id=low, user_high_id=high, amount=amount) for (low, high), amount in expected.items()],
+                batch_size=1000,
+            )
+            transaction.on_commit(lambda: bump_versions([BALANCES_SCOPE]))
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {len(expected)} balances.'))
+
+    def compute_balances(self, workers=1):
+        """
+        Nets the latest snapshot and the passbook into one signed amount per unordered user pair, keyed by (user_low, user_high).
+        """
+        start = time.perf_counter()
+        if workers > 1:
+            balances, rows = parallel_pair_balances(workers)
+        else:
+            checkpoint = latest_checkpoint()
+            rows = Passbook.objects.filter(id__gt=checkpoint.watermark if checkpoint is not None else 0).count()
+            balances = current_pair_balances()
+        elapsed = time.perf_counter() - start
+        self.stdout.write(f'Aggregated {rows} passbook entries with {workers} worker{"s" if workers > 1 else ""} in {elapsed:.2f}s '
+                          f'({rows / elapsed if elapsed else 0:.0f} rows/s).')
+        return {pair: Decimal(amount).quantize(Decimal('0.01')) for pair, amount in balances.items()}
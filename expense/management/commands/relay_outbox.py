@@ -0,0 +1,33 @@
+import time
+from django.core.management.base import BaseCommand
+from splitwise.settings import OUTBOX_RELAY_BATCH_SIZE, OUTBOX_RELAY_INTERVAL
+from expense.outbox import relay_outbox
+
+
+class Command(BaseCommand):
+    """
+    Publishes the tasks waiting in the outbox to Celery.
+
+    Without --loop the outbox is drained once. With --loop the command keeps running as the relay process,
+    draining full batches back to back and sleeping --interval seconds whenever the outbox is empty.
+    """
+    help = 'Publishes the tasks waiting in the outbox to Celery.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true', help='Keep relaying until interrupted.')
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_RELAY_BATCH_SIZE)
+        parser.add_argument('--interval', type=float, default=OUTBOX_RELAY_INTERVAL, help='Seconds to sleep when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        published = 0
+        try:
+            while True:
+                relayed = relay_outbox(options['batch_size'])
+                published += relayed
+                if relayed < options['batch_size']:
+                    if not options['loop']:
+                        break
+                    time.sleep(options['interval'])
+        except KeyboardInterrupt:
+            pass
+        self.stdout.write(self.style.SUCCESS(f'Published {published} tasks.'))
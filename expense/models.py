@@ -1,7 +1,19 @@
 from django.db import models
+from django.core.serializers.json import DjangoJSONEncoder
 from user.models import User
 from django.core.validators import MaxValueValidator, MinValueValidator
 
+class Group(models.Model):
+    """
+    Set of users sharing expenses. Balances and settlements of a group only involve its own expenses.
+    """
+    name = models.CharField(max_length=100)
+    members = models.ManyToManyField(User, related_name='expense_groups')
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return self.name
+
 class Expense(models.Model):
     expense_choice = [
         ('equal','Equal'),
@@ -9,6 +21,7 @@ class Expense(models.Model):
         ('percent','Percent'),
     ]
     payer = models.ForeignKey(User, on_delete=models.CASCADE, related_name='expenses_paid',null = True)
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='expenses', null=True, blank=True)
     amount = models.DecimalField(max_digits=12, decimal_places=2, validators=[MinValueValidator(0),MaxValueValidator(100000000)],null =False)
     expense_type = models.CharField(max_length=10, choices=expense_choice , null =False)
     expense_name = models.CharField(max_length=200, blank = True)
@@ -16,10 +29,147 @@ class Expense(models.Model):
     created_at = models.DateTimeField(auto_now_add = True)
     updated_at = models.DateTimeField(auto_now = True)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['created_at', 'id'], name='expense_created_at_idx'),
+            models.Index(fields=['payer', 'created_at', 'id'], name='expense_payer_created_at_idx'),
+        ]
+
     def __str__(self):
         return f'{self.amount} payed by {self.payer}'
 
 class Passbook(models.Model):
-    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances')
-    owes_to = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owed_balances')
-    amount = models.DecimalField(max_digits=12, decimal_places=2)
\ No newline at end of file
+    # user and owes_to are covered by the composite indexes below, so they skip the default single column index.
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances', db_index=False)
+    owes_to = models.ForeignKey(User, on_delete=models.CASCADE, related_name='owed_balances', db_index=False)
+    expense = models.ForeignKey(Expense, on_delete=models.CASCADE, related_name='passbook_entries', null=True)
+    # Copied from the expense, covered by passbook_group_user_idx.
+    group = models.ForeignKey(Group, on_delete=models.CASCADE, related_name='passbook_entries', null=True, db_index=False)
+    amount = models.DecimalField(max_digits=12, decimal_places=2)
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', 'owes_to'], name='passbook_user_owes_to_idx'),
+            models.Index(fields=['owes_to', 'user'], name='passbook_owes_to_user_idx'),
+            models.Index(fields=['created_at'], name='passbook_created_at_idx'),
+            models.Index(fields=['group', 'user', 'owes_to'], name='passbook_group_user_idx'),
+        ]
+
+class Balance(models.Model):
+    """
+    Net amount outstanding between an unordered pair of users.
+
+    user_low always has the smaller primary key of the pair. A positive amount means user_low owes
+    user_high, a negative amount means user_high owes user_low.
+    """
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances_as_low')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='balances_as_high')
+    amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user_low', 'user_high'], name='unique_balance_pair'),
+        ]
+
+    def __str__(self):
+        return f'{self.user_low} -> {self.user_high}: {self.amount}'
+
+
+class DailyRollup(models.Model):
+    """
+    Spending of a user on one day for one expense type, kept up to date by every expense written.
+
+    paid is the total of the expenses the user paid, owed the total of the shares the user owes to other payers,
+    count the number of expenses the user took part in, as payer or participant.
+    """
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='daily_rollups')
+    day = models.DateField()
+    expense_type = models.CharField(max_length=10, choices=Expense.expense_choice)
+    paid = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    owed = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+    count = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['user', 'day', 'expense_type'], name='unique_daily_rollup'),
+        ]
+
+    def __str__(self):
+        return f'{self.user} on {self.day} ({self.expense_type}): paid {self.paid}, owed {self.owed}'
+
+
+class Outbox(models.Model):
+    """
+    Celery task waiting to be published, written in the same transaction as the data it is about.
+
+    Rows are drained and deleted by the outbox relay (manage.py relay_outbox).
+    """
+    task_name = models.CharField(max_length=200)
+    args = models.JSONField(encoder=DjangoJSONEncoder, default=list)
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return f'{self.task_name} queued at {self.created_at}'
+
+
+class PendingNotification(models.Model):
+    """
+    Expense notification waiting in its recipient's digest buffer.
+
+    Rows are written in the same transaction as the expense and flushed as one digest email per recipient
+    by flush_notification_digests_task once the recipient's buffer has been quiet for a while.
+    """
+    user_email = models.EmailField()
+    email_data = models.JSONField(encoder=DjangoJSONEncoder)
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['user_email', 'created_at'], name='pending_notification_user_idx'),
+        ]
+
+    def __str__(self):
+        return f'Notification for {self.user_email} queued at {self.created_at}'
+
+
+class LedgerCheckpoint(models.Model):
+    """
+    Point of the passbook history covered by the balance snapshot: every entry with an id up to the watermark.
+    """
+    watermark = models.BigIntegerField()
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return f'Checkpoint at passbook entry {self.watermark}'
+
+
+class BalanceSnapshot(models.Model):
+    """
+    Net amount between a pair of users at a checkpoint, in the same sign convention as Balance.
+    """
+    checkpoint = models.ForeignKey(LedgerCheckpoint, on_delete=models.CASCADE, related_name='balances')
+    user_low = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    user_high = models.ForeignKey(User, on_delete=models.CASCADE, related_name='+')
+    amount = models.DecimalField(max_digits=14, decimal_places=2)
+
+    def __str__(self):
+        return f'{self.user_low} -> {self.user_high}: {self.amount} at {self.checkpoint}'
+
+
+class PassbookCompaction(models.Model):
+    """
+    Run of compact_passbook: the entries outside a group, up to the watermark and created before `before`, were
+    written to the archive and deleted from the passbook.
+
+    unlinked_entries counts the archived entries that were not linked to an expense yet.
+    """
+    watermark = models.BigIntegerField()
+    before = models.DateTimeField()
+    archive = models.CharField(max_length=500)
+    entries = models.PositiveIntegerField(default=0)
+    unlinked_entries = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add = True)
+
+    def __str__(self):
+        return f'{self.entries} passbook entries before {self.before} archived to {self.archive}'
@@ -0,0 +1,85 @@
+import time
+import heapq
+from decimal import Decimal
+from collections import defaultdict
+
+
+def net_pair_balances(rows):
+    """
+    Nets debts between every pair of users in a single pass.
+
+    Parameters:
+    - rows (iterable): (debtor, creditor, amount) tuples, usually already aggregated per pair by the database.
+                       Debtor and creditor can be any comparable keys (primary keys or userIds).
+
+    Returns: A dictionary keyed by (low, high) pairs, where low < high. A positive amount means low owes high,
+             a negative amount means high owes low. Pairs that cancel out are left out.
+
+    Notes:
+    - Each row touches exactly one entry, so the cost is O(rows) regardless of the number of users.
+    - Rows where a user owes themselves are ignored.
+    """
+    pair_balances = defaultdict(Decimal)
+    for debtor, creditor, amount in rows:
+        if debtor == creditor:
+            continue
+        if debtor < creditor:
+            pair_balances[(debtor, creditor)] += amount
+        else:
+            pair_balances[(creditor, debtor)] -= amount
+    return {pair: amount for pair, amount in pair_balances.items() if amount != 0}
+
+
+def group_by_creditor(pair_balances):
+    """
+    Converts signed pair balances into the simplified balance format returned by the passbook API.
+
+    Parameters:
+    - pair_balances (dict or iterable): (low, high) -> signed amount, as returned by net_pair_balances.
+
+    Returns: A dictionary keyed by the user who is owed, mapping each debtor to the amount they owe.
+             Eg: {"alice_1a2b3c4d": {"bob_5e6f7a8b": 250.00}}
+    """
+    items = pair_balances.items() if isinstance(pair_balances, dict) else pair_balances
+    creditor_dict = defaultdict(dict)
+    for (low, high), amount in items:
+        if amount > 0:
+            creditor_dict[high][low] = amount
+        elif amount < 0:
+            creditor_dict[low][high] = -amount
+    return dict(creditor_dict)
+
+
+def settle_positions(net_positions, deadline=None):
+    """
+    Computes a near-minimal list of transfers that settles every user's net position.
+
+    Parameters:
+    - net_positions (dict): user -> net amount, positive for users who are owed money and negative for users who owe.
+    - deadline (float): Optional time.monotonic() value after which the computation stops early.
+
+    Returns: A tuple (transfers, complete). transfers is a list of (debtor, creditor, amount) tuples and complete is
+             False when the deadline was hit before every position was settled.
+
+    Notes:
+    - Greedy settlement: the largest debtor always pays the largest creditor, so every step settles at least one user.
+    - Both sides are kept in heaps, giving O(U log U) for U users with a non-zero position.
+    """
+    creditors = [(-amount, user) for user, amount in net_positions.items() if amount > 0]
+    debtors = [(amount, user) for user, amount in net_positions.items() if amount < 0]
+    heapq.heapify(creditors)
+    heapq.heapify(debtors)
+
+    transfers = []
+    while creditors and debtors:
+        if deadline is not None and time.monotonic() > deadline:
+            return transfers, False
+        credit, creditor = heapq.heappop(creditors)
+        debit, debtor = heapq.heappop(debtors)
+        amount = min(-credit, -debit)
+        transfers.append((debtor, creditor, amount))
+        if -credit > amount:
+            heapq.heappush(creditors, (credit + amount, creditor))
+        if -debit > amount:
+            heapq.heappush(debtors, (debit + amount, debtor))
+    return transfers, True
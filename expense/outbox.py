@@ -0,0 +1,31 @@
+from celery import current_app
+from django.db import transaction
+from splitwise.settings import OUTBOX_RELAY_BATCH_SIZE
+from .models import Outbox
+
+
+def relay_outbox(batch_size=OUTBOX_RELAY_BATCH_SIZE):
+    """
+    Publishes one batch of outbox tasks to Celery and deletes them.
+
+    Parameters:
+    - batch_size (int): Maximum number of outbox rows published in this call.
+
+    Returns: The number of tasks published.
+
+    Notes:
+    - Rows are claimed with select_for_update(skip_locked=True), so several relays can run side by side
+      without publishing the same row twice or waiting on each other.
+    - The whole batch is sent over one pooled producer connection. Rows are only deleted once every task of
+      the batch was accepted by the broker; a failure rolls the batch back and it is retried, which gives
+      at-least-once delivery.
+    """
+    with transaction.atomic():
+        events = list(Outbox.objects.select_for_update(skip_locked=True).order_by('id')[:batch_size])
+        if not events:
+            return 0
+        with current_app.producer_or_acquire() as producer:
+            for event in events:
+                current_app.tasks[event.task_name].apply_async(args=event.args, producer=producer)
+        Outbox.objects.filter(id__in=[event.id for event in events]).delete()
+    return len(events)
@@ -0,0 +1,142 @@
+import json
+import base64
+from django.db.models import Q
+from django.utils.dateparse import parse_datetime
+from django.http import StreamingHttpResponse
+from rest_framework import status
+from rest_framework.response import Response
+from rest_framework.utils.encoders import JSONEncoder
+from splitwise.settings import LISTING_PAGE_SIZE, LISTING_MAX_PAGE_SIZE, STREAM_CHUNK_SIZE
+
+
+def encode_cursor(created_at, pk):
+    """
+    Encodes the (created_at, id) position of the last row of a page into an opaque cursor.
+    """
+    position = f'{created_at.isoformat()}|{pk}'
+    return base64.urlsafe_b64encode(position.encode()).decode()
+
+
+def decode_cursor(cursor):
+    """
+    Decodes a cursor produced by encode_cursor.
+
+    Returns: A (created_at, id) tuple, or None if the cursor is malformed.
+    """
+    try:
+        created_at, pk = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        created_at = parse_datetime(created_at)
+        return (created_at, int(pk)) if created_at else None
+    except (ValueError, UnicodeDecodeError):
+        return None
+
+
+def list_response(request, queryset, serializer_class):
+    """
+    Lists a queryset page by page, or streams all of it as NDJSON when the request asks for ?stream=ndjson.
+
+    Parameters:
+    - request (Request): The incoming request. Reads the 'cursor', 'page_size' and 'stream' query parameters.
+    - queryset (QuerySet): The rows to list. The model must have a created_at field.
+    - serializer_class (Serializer): Serializer used for every row. Flat serializers exposing prepare_queryset
+                                     and position, like FlatPassbookSerializer, are fed plain value rows.
+
+    Returns: A Response with the page of results and the cursor of the next page, or a StreamingHttpResponse.
+    """
+    queryset = queryset.order_by('created_at', 'id')
+    if hasattr(serializer_class, 'prepare_queryset'):
+        queryset = serializer_class.prepare_queryset(queryset)
+    if request.query_params.get('stream') == 'ndjson':
+        return stream_ndjson(queryset, serializer_class)
+    return paginate_keyset(request, queryset, serializer_class)
+
+
+def paginate_keyset(request, queryset, serializer_class):
+    """
+    Returns one page of a queryset ordered by (created_at, id).
+
+    Notes:
+    - Keyset pagination: the next page starts strictly after the (created_at, id) of the last returned row,
+      so every page is an index range scan no matter how deep the client has paged.
+    - The response is {"next": <cursor or null>, "results": [...]}.
+    """
+    page, page_size, error = keyset_page(request.query_params, queryset)
+    if error:
+        return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+    return Response(build_page(list(page), page_size, serializer_class),status=status.HTTP_200_OK)
+
+
+def keyset_page(query_params, queryset):
+    """
+    Reads the 'page_size' and 'cursor' query parameters and slices the queryset to the requested page.
+
+    Returns: A tuple (page queryset, page size, error message). The page queryset holds one extra row,
+             used by build_page to tell whether there is a next page.
+    """
+    try:
+        page_size = min(int(query_params.get('page_size', LISTING_PAGE_SIZE)), LISTING_MAX_PAGE_SIZE)
+    except ValueError:
+        return None, None, "page_size must be an integer"
+    if page_size < 1:
+        return None, None, "page_size must be positive"
+
+    cursor = query_params.get('cursor')
+    if cursor:
+        position = decode_cursor(cursor)
+        if position is None:
+            return None, None, "Invalid cursor"
+        created_at, pk = position
+        queryset = queryset.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+    return queryset[:page_size + 1], page_size, None
+
+
+def build_page(rows, page_size, serializer_class):
+    """
+    Serializes the fetched rows of a page and computes the cursor of the next one.
+    """
+    next_cursor = encode_cursor(*row_position(serializer_class, rows[page_size - 1])) if len(rows) > page_size else None
+    return {"next": next_cursor, "results": serializer_class(rows[:page_size], many=True).data}
+
+
+def row_position(serializer_class, row):
+    """
+    Returns the (created_at, id) of a row, whether it is a model instance or a flat serializer's value row.
+    """
+    if hasattr(serializer_class, 'position'):
+        return serializer_class.position(row)
+    return row.created_at, row.pk
+
+
+def stream_ndjson(queryset, serializer_class):
+    """
+    Streams every row of a queryset as newline delimited JSON.
+
+    Rows are fetched with queryset.iterator(chunk_size=STREAM_CHUNK_SIZE) and serialized one at a time,
+    so a full export runs in constant memory.
+    """
+    def rows():
+        for instance in queryset.iterator(chunk_size=STREAM_CHUNK_SIZE):
+            yield json.dumps(serializer_class(instance).data, cls=JSONEncoder) + '\n'
+
+    return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+
+async def alist_response(request, queryset, serializer_class):
+    """
+    Async counterpart of list_response for Django async views, reading the rows with the async ORM.
+
+    Returns: A (data, status) tuple for a page, or a StreamingHttpResponse over queryset.aiterator() for ?stream=ndjson.
+    """
+    queryset = queryset.order_by('created_at', 'id')
+    if hasattr(serializer_class, 'prepare_queryset'):
+        queryset = serializer_class.prepare_queryset(queryset)
+    if request.GET.get('stream') == 'ndjson':
+        async def rows():
+            async for instance in queryset.aiterator(chunk_size=STREAM_CHUNK_SIZE):
+                yield json.dumps(serializer_class(instance).data, cls=JSONEncoder) + '\n'
+        return StreamingHttpResponse(rows(), content_type='application/x-ndjson')
+
+    page, page_size, error = keyset_page(request.GET, queryset)
+    if error:
+        return {"Error":error}, status.HTTP_400_BAD_REQUEST
+    return build_page([row async for row in page], page_size, serializer_class), status.HTTP_200_OK
@@ -0,0 +1,139 @@
+from decimal import Decimal
+from collections import defaultdict
+from django.db.models import F, Q, Case, When, Value, Sum, Count
+from django.db.models.functions import TruncDate, TruncWeek, TruncMonth
+from django.utils import timezone
+from .models import Expense, Passbook, DailyRollup
+
+BUCKETS = {
+    'day': None,
+    'week': TruncWeek,
+    'month': TruncMonth,
+}
+
+
+def add_expense_to_rollups(rollup_deltas, expense, shares):
+    """
+    Adds a new expense to a dictionary of (user_id, day, expense_type) -> [paid, owed, count] deltas.
+
+    Parameters:
+    - rollup_deltas (defaultdict): The deltas being accumulated, created with rollup_deltas_dict().
+    - expense (Expense): The saved expense, its created_at decides the day.
+    - shares (list): List of (participant id, amount owed) tuples of the expense.
+    """
+    day = timezone.localdate(expense.created_at)
+    payer_delta = rollup_deltas[(expense.payer_id, day, expense.expense_type)]
+    payer_delta[0] += expense.amount
+    payer_delta[2] += 1
+
+    owed = defaultdict(Decimal)
+    for participant_id, amount in shares:
+        if participant_id != expense.payer_id:
+            owed[participant_id] += amount
+    for participant_id, amount in owed.items():
+        participant_delta = rollup_deltas[(participant_id, day, expense.expense_type)]
+        participant_delta[1] += amount
+        participant_delta[2] += 1
+
+
+def rollup_deltas_dict():
+    return defaultdict(lambda: [Decimal(0), Decimal(0), 0])
+
+
+def apply_rollup_deltas(rollup_deltas, batch_size=500):
+    """
+    Adds paid, owed and count deltas to the daily rollups.
+
+    Notes:
+    - Must be called inside the transaction that writes the expenses.
+    - Missing rows are created first, then each batch is incremented with a single UPDATE using F() expressions,
+      the same way apply_balance_deltas updates balances, so concurrent expenses never overwrite each other.
+    """
+    rows = list(rollup_deltas.items())
+    for start in range(0, len(rows), batch_size):
+        batch = rows[start:start + batch_size]
+        DailyRollup.objects.bulk_create([DailyRollup(user_id=user_id, day=day, expense_type=expense_type)
+                                         for (user_id, day, expense_type), _ in batch],
+                                        ignore_conflicts=True)
+
+        row_filter = Q()
+        for (user_id, day, expense_type), _ in batch:
+            row_filter |= Q(user_id=user_id, day=day, expense_type=expense_type)
+
+        def delta(index, field):
+            return Case(
+                *[When(user_id=user_id, day=day, expense_type=expense_type, then=Value(deltas[index]))
+                  for (user_id, day, expense_type), deltas in batch],
+                output_field=DailyRollup._meta.get_field(field),
+            )
+        DailyRollup.objects.filter(row_filter).update(paid=F('paid') + delta(0, 'paid'),
+                                                      owed=F('owed') + delta(1, 'owed'),
+                                                      count=F('count') + delta(2, 'count'))
+
+
+def compute_rollups(since=None):
+    """
+    Recomputes the daily rollups from the expenses and their passbook entries.
+
+    Parameters:
+    - since (date): Optional first day to recompute, defaults to the whole history.
+
+    Returns: A rollup_deltas_dict() keyed by (user_id, day, expense_type).
+
+    Notes:
+    - Both totals are grouped by day in the database, so one row per user, day and expense type is fetched.
+    - Passbook entries not linked to an expense (see backfill_passbook_expenses) are not counted.
+    """
+    expenses = Expense.objects.filter(payer__isnull=False)
+    entries = Passbook.objects.filter(expense__isnull=False).exclude(user=F('owes_to'))
+    if since is not None:
+        expenses = expenses.filter(created_at__date__gte=since)
+        entries = entries.filter(expense__created_at__date__gte=since)
+
+    rollups = rollup_deltas_dict()
+    paid = expenses.annotate(day=TruncDate('created_at')).\
+                    values('payer_id', 'day', 'expense_type').\
+                    annotate(paid=Sum('amount'), count=Count('id')).\
+                    values_list('payer_id', 'day', 'expense_type', 'paid', 'count')
+    for user_id, day, expense_type, amount, count in paid.iterator():
+        rollups[(user_id, day, expense_type)][0] += amount
+        rollups[(user_id, day, expense_type)][2] += count
+
+    owed = entries.annotate(day=TruncDate('expense__created_at')).\
+                   values('user_id', 'day', 'expense__expense_type').\
+                   annotate(owed=Sum('amount'), count=Count('expense_id', distinct=True)).\
+                   values_list('user_id', 'day', 'expense__expense_type', 'owed', 'count')
+    for user_id, day, expense_type, amount, count in owed.iterator():
+        rollups[(user_id, day, expense_type)][1] += amount
+        rollups[(user_id, day, expense_type)][2] += count
+    return rollups
+
+
+def rollup_stats(user, date_from, date_to, bucket):
+    """
+    Returns the spending of a user between two days, both included, grouped by bucket and expense type.
+
+    Parameters:
+    - user (int): Id of the user.
+    - date_from, date_to (date): The range of days.
+    - bucket (str): A key of BUCKETS, the length of the periods the days are grouped into.
+
+    Returns: A list of dictionaries with the period start, expense type, paid, owed and count, ordered by period.
+
+    Notes:
+    - Only the rollup rows of the range are read, so the cost depends on the number of days, not of expenses.
+    """
+    rollups = DailyRollup.objects.filter(user=user, day__gte=date_from, day__lte=date_to)
+    truncate = BUCKETS[bucket]
+    period = truncate('day') if truncate is not None else F('day')
+    rows = rollups.annotate(period=period).\
+                   values('period', 'expense_type').\
+                   annotate(total_paid=Sum('paid'), total_owed=Sum('owed'), total_count=Sum('count')).\
+                   order_by('period', 'expense_type')
+    return [{
+        'period': row['period'],
+        'expense_type': row['expense_type'],
+        'paid': Decimal(row['total_paid']).quantize(Decimal('0.01')),
+        'owed': Decimal(row['total_owed']).quantize(Decimal('0.01')),
+        'count': row['total_count'],
+    } for row in rows]
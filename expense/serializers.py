@@ -1,7 +1,11 @@
 from rest_framework import serializers
-from .models import Expense,Passbook
+from .models import Group,Expense,Passbook
+from user.models import User
 from user.serializers import UserSerializer
 
+# Largest id the database can store, a larger one would overflow SQLite's INTEGER instead of being rejected.
+MAX_ID = 2 ** 63 - 1
+
 class PassbookSerializer(serializers.ModelSerializer):
     user = UserSerializer()
     owes_to = UserSerializer()
@@ -9,7 +13,84 @@ class PassbookSerializer(serializers.ModelSerializer):
         model = Passbook
         fields = ['id', 'user', 'owes_to', 'amount']
 
+class FlatPassbookSerializer:
+    """
+    Read-only serializer producing the same output as PassbookSerializer straight from .values_list() rows.
+
+    Used by the list endpoints, where building DRF fields for every nested user dominates the response time.
+    The related users are joined by the values_list query itself, so no extra query is made per row.
+
+    Usage mirrors a DRF serializer: FlatPassbookSerializer(rows, many=True).data
+    """
+    user_fields = [field.attname for field in User._meta.concrete_fields]
+    values_fields = ['id', 'created_at', 'amount'] + \
+                    [f'user__{field}' for field in user_fields] + \
+                    [f'owes_to__{field}' for field in user_fields]
+
+    def __init__(self, instance, many=False):
+        self.instance = instance
+        self.many = many
+
+    @classmethod
+    def prepare_queryset(cls, queryset):
+        return queryset.values_list(*cls.values_fields)
+
+    @staticmethod
+    def position(row):
+        """
+        Returns the (created_at, id) of a row, used as the pagination cursor.
+        """
+        return row[1], row[0]
+
+    @classmethod
+    def to_representation(cls, row):
+        user_count = len(cls.user_fields)
+        return {
+            'id': row[0],
+            'user': dict(zip(cls.user_fields, row[3:3 + user_count])),
+            'owes_to': dict(zip(cls.user_fields, row[3 + user_count:])),
+            'amount': str(row[2]),
+        }
+
+    @property
+    def data(self):
+        if self.many:
+            return [self.to_representation(row) for row in self.instance]
+        return self.to_representation(self.instance)
+
 class ExpenseSerializer(serializers.ModelSerializer):
     class Meta:
         model = Expense
-        fields = ['id', 'payer', 'amount', 'expense_type', 'expense_name', 'created_at', 'updated_at']
+        fields = ['id', 'payer', 'group', 'amount', 'expense_type', 'expense_name', 'created_at', 'updated_at']
+        # Expense.payer is nullable, but every new expense needs a payer to owe its shares to.
+        extra_kwargs = {'payer': {'required': True, 'allow_null': False}}
+
+class GroupSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Group
+        fields = ['id', 'name', 'members', 'created_at']
+
+class GroupMembersSerializer(serializers.Serializer):
+    """
+    Validates the body of a request adding members to a group. GroupSerializer then checks that the users exist.
+    """
+    members = serializers.ListField(child=serializers.IntegerField(max_value=MAX_ID))
+
+class ExpenseImportSerializer(serializers.ModelSerializer):
+    """
+    Validates one record of a bulk expense import.
+
+    The payer is taken as a plain id so validation never queries the database, the importer checks
+    the payer and participants of a whole chunk of records with a single query instead.
+    """
+    payer = serializers.IntegerField(max_value=MAX_ID)
+    participant_detail = serializers.ListField(child=serializers.DictField(), allow_empty=False, max_length=1000)
+
+    class Meta:
+        model = Expense
+        fields = ['payer', 'amount', 'expense_type', 'expense_name', 'note', 'participant_detail']
+
+    def validate_amount(self, value):
+        if value > 10000000:
+            raise serializers.ValidationError("Expense amount exceeds the maximum limit of 10,000,000.")
+        return value
@@ -0,0 +1,69 @@
+from decimal import Decimal, ROUND_HALF_UP
+
+MINOR_UNITS = 100
+CENT = Decimal('0.01')
+
+
+def to_minor_units(amount):
+    """
+    Converts an amount in rupees (Decimal, int, float or numeric string) to an integer number of paise.
+
+    Floats are converted through their string form, so 0.1 becomes 10 paise rather than 10.000000000000000555.
+    Amounts are rounded half up to the nearest paisa.
+
+    Raises:
+    - TypeError: When the amount is not a Decimal, int, float or string, eg. a list or a boolean.
+    - ValueError: When the amount is NaN or infinite.
+    - decimal.InvalidOperation: When a string is not a number.
+    """
+    if isinstance(amount, bool) or not isinstance(amount, (Decimal, int, float, str)):
+        raise TypeError(f'Amount must be a number, not {type(amount).__name__}')
+    if isinstance(amount, float):
+        amount = str(amount)
+    amount = Decimal(amount)
+    if not amount.is_finite():
+        raise ValueError('Amount must be a finite number')
+    return int((amount * MINOR_UNITS).quantize(Decimal(1), rounding=ROUND_HALF_UP))
+
+
+def from_minor_units(minor):
+    """
+    Converts an integer number of paise back to a Decimal amount in rupees with two decimal places.
+    """
+    return (Decimal(minor) / MINOR_UNITS).quantize(CENT)
+
+
+def split_by_weights(total_minor, weights):
+    """
+    Splits an integer total proportionally to integer weights with the largest-remainder method.
+
+    Parameters:
+    - total_minor (int): The amount to split, in paise.
+    - weights (list): Non-negative integer weight of every participant, eg. percentages in basis points.
+
+    Returns: A list of integer shares, one per weight, that always add up to total_minor exactly.
+
+    Notes:
+    - Every participant first gets the floor of their exact quota. The paise left over are then given one each
+      to the participants with the largest fractional remainders, earlier participants winning ties.
+    - All quotas are computed in one pass over the weights and the leftover is handed out with one sort,
+      so a split costs O(n log n) integer operations with no float rounding anywhere.
+    """
+    weight_total = sum(weights)
+    quotas = [divmod(total_minor * weight, weight_total) for weight in weights]
+    shares = [quota for quota, _ in quotas]
+    leftover = total_minor - sum(shares)
+    if leftover:
+        by_remainder = sorted(range(len(quotas)), key=lambda index: -quotas[index][1])
+        for index in by_remainder[:leftover]:
+            shares[index] += 1
+    return shares
+
+
+def split_equal(total_minor, count):
+    """
+    Splits an integer total into count shares that differ by at most one paisa, the first participants
+    receiving the extra paise.
+    """
+    base, leftover = divmod(total_minor, count)
+    return [base + 1 if index < leftover else base for index in range(count)]
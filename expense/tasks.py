@@ -1,12 +1,16 @@
+from smtplib import SMTPException
 from celery import shared_task
-from django.core.mail import send_mail
-from splitwise.settings import DEFAULT_FROM_EMAIL
-from expense.models import Passbook
-from user.models import User
-from collections import defaultdict
-from django.db.models import Sum
+from django.core.mail import send_mail, send_mass_mail, get_connection
+from splitwise.settings import (DEFAULT_FROM_EMAIL, NOTIFICATION_BATCH_SIZE, NOTIFICATION_MAX_RETRIES, WEEKLY_SUMMARY_CHUNK_SIZE,
+                                NOTIFICATION_DIGEST_WINDOW, NOTIFICATION_DIGEST_MAX_DELAY, NOTIFICATION_DIGEST_FLUSH_LIMIT,
+                                LEDGER_ENGINE_ENABLED)
+from expense.models import Passbook, PendingNotification, Outbox
+from expense.ledger import checkpoint_balances
+from expense.engine import build_engine
+from django.db import transaction
+from django.db.models import Sum, F, Q, Min, Max
 from django.utils import timezone
-from datetime import timedelta,datetime
+from datetime import timedelta,datetime,time
 
 from_email= DEFAULT_FROM_EMAIL
 
@@ -18,10 +22,124 @@ def send_email_task(email_data):
     Parameters: A dictionary containing email-related data, including user name, email address,
                 name of the person who owes, and the amount of the expense.
     """
+    subject, message, sender, recipient = build_expense_email(email_data)
+    send_mail(subject, message, sender, recipient)
+
+
+@shared_task
+def send_expense_notifications_task(email_data_list):
+    """
+    Sends the notifications of every participant of an expense from a single queued message.
+
+    Parameters: A list of email_data dictionaries, one per participant, as accepted by send_email_task.
+
+    The recipients are split into chunks of NOTIFICATION_BATCH_SIZE and each chunk is sent by its own
+    send_email_batch_task, so a failing chunk is retried without resending the others.
+
+    New expenses go through the digest buffers instead, this task still drains messages queued before them.
+    """
+    for start in range(0, len(email_data_list), NOTIFICATION_BATCH_SIZE):
+        send_email_batch_task.delay(email_data_list[start:start + NOTIFICATION_BATCH_SIZE])
+
+
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=NOTIFICATION_MAX_RETRIES)
+def send_email_batch_task(email_data_list):
+    """
+    Sends a chunk of expense notifications over a single SMTP connection.
+
+    Parameters: A list of email_data dictionaries, one per participant.
+
+    The whole chunk is retried with exponential backoff when the SMTP server or the network fails.
+    """
+    messages = [build_expense_email(email_data) for email_data in email_data_list]
+    send_mass_mail(messages, connection=get_connection())
+
+
+def build_expense_email(email_data):
+    """
+    Builds the expense notification for one participant.
+
+    Parameters: A dictionary containing email-related data, including user name, email address,
+                name of the person who owes, and the amount of the expense.
+
+    Returns: A (subject, message, from_email, recipient_list) tuple.
+    """
     subject = f'Notification: New Expense Created on Splitwise'
     message = f'''Dear {email_data['user_name']},\n\nYou've been included in a new expense by {email_data['owes_to_name']}.\n\nExpense Details:\nAmount: {email_data['amount']}\n\nPlease take a moment to review the details and address any necessary actions.\nThank you'''
     recipient = [email_data['user_email']]
-    send_mail(subject, message,from_email,recipient)
+    return subject, message, from_email, recipient
+
+
+@shared_task
+def flush_notification_digests_task():
+    """
+    Flushes the digest buffer of every recipient whose buffer is ready as one digest email.
+
+    A buffer is ready once no notification was added to it for NOTIFICATION_DIGEST_WINDOW seconds, or once its
+    oldest notification waited NOTIFICATION_DIGEST_MAX_DELAY seconds, so a recipient who keeps being added to
+    expenses still hears about them.
+
+    Returns: The number of notifications flushed.
+
+    Notes:
+    - Up to NOTIFICATION_DIGEST_FLUSH_LIMIT buffers are claimed per transaction with select_for_update(skip_locked=True).
+      Claimed rows are deleted and their digests written to the outbox in the same transaction, in chunks of
+      NOTIFICATION_BATCH_SIZE recipients, so a digest is neither lost nor sent twice if the flush fails halfway.
+    """
+    flushed = 0
+    while True:
+        now = timezone.now()
+        ready_emails = list(PendingNotification.objects.filter(created_at__lt=now).
+                                                        values('user_email').
+                                                        annotate(first=Min('created_at'), last=Max('created_at')).
+                                                        filter(Q(last__lt=now - timedelta(seconds=NOTIFICATION_DIGEST_WINDOW)) |
+                                                               Q(first__lt=now - timedelta(seconds=NOTIFICATION_DIGEST_MAX_DELAY))).
+                                                        order_by('user_email').
+                                                        values_list('user_email', flat=True)[:NOTIFICATION_DIGEST_FLUSH_LIMIT])
+        if not ready_emails:
+            return flushed
+
+        with transaction.atomic():
+            pending = list(PendingNotification.objects.select_for_update(skip_locked=True).
+                                                      filter(user_email__in=ready_emails, created_at__lt=now).
+                                                      order_by('user_email', 'id'))
+            digests = {}
+            for notification in pending:
+                digests.setdefault(notification.user_email, []).append(notification.email_data)
+            digests = list(digests.values())
+            for start in range(0, len(digests), NOTIFICATION_BATCH_SIZE):
+                Outbox.objects.create(task_name=send_digest_batch_task.name, args=[digests[start:start + NOTIFICATION_BATCH_SIZE]])
+            PendingNotification.objects.filter(id__in=[notification.id for notification in pending]).delete()
+        flushed += len(pending)
+
+        if len(ready_emails) < NOTIFICATION_DIGEST_FLUSH_LIMIT:
+            return flushed
+
+
+@shared_task(autoretry_for=(SMTPException, OSError), retry_backoff=True, max_retries=NOTIFICATION_MAX_RETRIES)
+def send_digest_batch_task(digests):
+    """
+    Sends a chunk of notification digests over a single SMTP connection.
+
+    Parameters: A list of digests, each one the list of email_data dictionaries buffered for one recipient.
+    """
+    messages = [build_digest_email(email_data_list) for email_data_list in digests]
+    send_mass_mail(messages, connection=get_connection())
+
+
+def build_digest_email(email_data_list):
+    """
+    Builds the digest of the expenses a recipient was added to. A single expense keeps the usual notification.
+
+    Parameters: The email_data dictionaries buffered for one recipient, oldest first.
+    """
+    if len(email_data_list) == 1:
+        return build_expense_email(email_data_list[0])
+    user_name, user_email = email_data_list[0]['user_name'], email_data_list[0]['user_email']
+    subject = f'Notification: {len(email_data_list)} New Expenses Created on Splitwise'
+    details = "\n".join(f"- Added by {email_data['owes_to_name']}, Amount: {email_data['amount']}" for email_data in email_data_list)
+    message = f'''Dear {user_name},\n\nYou've been included in {len(email_data_list)} new expenses.\n\nExpense Details:\n{details}\n\nPlease take a moment to review the details and address any necessary actions.\nThank you'''
+    return subject, message, from_email, [user_email]
 
 
 @shared_task
@@ -29,54 +147,77 @@ def send_weekly_summary_email():
     """
     Sends a weekly summary email to each user.
 
-    Queries passbook entries for each user to calculate the total amount owed to other users within the last week.
-    Then, sends an email containing the summary of amounts owed to other user.
+    Aggregates the passbook entries of the last week with a single query grouped by debtor and creditor,
+    streams the result ordered by debtor and splits it into chunks of WEEKLY_SUMMARY_CHUNK_SIZE users.
+    Each chunk is sent by its own send_weekly_summary_chunk_task, so the work spreads across workers
+    while this task only ever holds one chunk in memory.
 
     """
-    unique_users = User.objects.all()
-    today = timezone.now().date()
+    today = timezone.localdate()
 
     last_week_start = today - timedelta(days=today.weekday() + 7)
+    window_start = timezone.make_aware(datetime.combine(last_week_start, time.min))
+    window_end = timezone.make_aware(datetime.combine(today + timedelta(days=1), time.min))
 
-    for user in unique_users:
-        required_dict = defaultdict(float)
-        entries_per_user = Passbook.objects.filter(user=user,
-                                                    user__expenses_paid__created_at__date__gte=last_week_start,
-                                                    user__expenses_paid__created_at__date__lte=today
-                                                ).\
-                                            exclude(owes_to=user).\
-                                            values('owes_to__userId').\
-                                            annotate(total_amount=Sum('amount'))
-        for entry in entries_per_user:
-            owes_to_user_id = entry['owes_to__userId']
-            total_amount = float(entry['total_amount'])
-            required_dict[owes_to_user_id] += total_amount
-
-        if required_dict:
-            subject = 'Your Weekly Splitwise Summary'
-            message = format_email_message(user, required_dict)
-            send_mail(
-                subject = subject,
-                message = message,
-                from_email = from_email,
-                recipient_list = [user.email],
-                fail_silently=False)
-
-def format_email_message(user, required_dict):
+    # A plain range on created_at keeps the lookup on passbook_created_at_idx, a __date lookup could not use it.
+    weekly_totals = Passbook.objects.filter(created_at__gte=window_start, created_at__lt=window_end).\
+                                    exclude(owes_to=F('user')).\
+                                    values('user_id', 'user__name', 'user__email', 'owes_to_id', 'owes_to__name').\
+                                    annotate(total_amount=Sum('amount')).\
+                                    order_by('user_id')
+
+    chunk, summary = [], None
+    for entry in weekly_totals.iterator(chunk_size=2000):
+        if summary is None or summary['user_id'] != entry['user_id']:
+            if len(chunk) == WEEKLY_SUMMARY_CHUNK_SIZE:
+                send_weekly_summary_chunk_task.delay(chunk)
+                chunk = []
+            summary = {'user_id': entry['user_id'], 'name': entry['user__name'], 'email': entry['user__email'], 'owed': []}
+            chunk.append(summary)
+        summary['owed'].append((entry['owes_to__name'], float(entry['total_amount'])))
+
+    if chunk:
+        send_weekly_summary_chunk_task.delay(chunk)
+
+
+@shared_task(acks_late=True, reject_on_worker_lost=True)
+def send_weekly_summary_chunk_task(summaries):
+    """
+    Sends the weekly summary emails of a chunk of users over a single SMTP connection.
+
+    Parameters: A list of dictionaries with the user's name, email and the (creditor name, amount) pairs they owe.
+
+    The message is acknowledged once the chunk is sent, so a chunk held by a worker that dies is redelivered.
+    """
+    subject = 'Your Weekly Splitwise Summary'
+    messages = [(subject, format_email_message(summary['name'], summary['owed']), from_email, [summary['email']])
+                for summary in summaries]
+    send_mass_mail(messages, fail_silently=False, connection=get_connection())
+
+
+def format_email_message(user_name, owed_amounts):
     """
     Formats the email message containing the weekly Splitwise summary for a user.
 
     Parameters:
-    - user (User): The user to whom the email will be sent.
-    - required_dict (dict): A dictionary containing the summary of amounts owed to the user by other users.
-                            Keys are user IDs, and values are the total amounts owed.
+    - user_name (str): Name of the user to whom the email will be sent.
+    - owed_amounts (list): (name, total amount) pairs summarising what the user owes to each other user.
 
     Returns: The formatted email message containing the weekly Splitwise summary.
     """
-    formatted_summary = "\n".join([f"{User.objects.get(userId=user_id).name}: ₹{total_amount:.2f}" for user_id, total_amount in required_dict.items()])
-    total_owed_amount = sum(required_dict.values())
+    formatted_summary = "\n".join([f"{name}: ₹{total_amount:.2f}" for name, total_amount in owed_amounts])
+    total_owed_amount = sum(total_amount for _, total_amount in owed_amounts)
     formatted_summary += f"\n\nTotal Owed Amount: ₹{total_owed_amount:.2f}"
-    return f"""Dear {user.name},\n\nWe hope this message finds you well. As part of our weekly Splitwise summary, here's a breakdown of the amounts you owe to other users:\n\n{formatted_summary}\n\nPlease take a moment to review the details and address any necessary actions.\n\nThank you"""
+    return f"""Dear {user_name},\n\nWe hope this message finds you well. As part of our weekly Splitwise summary, here's a breakdown of the amounts you owe to other users:\n\n{formatted_summary}\n\nPlease take a moment to review the details and address any necessary actions.\n\nThank you"""
 
 
-    
\ No newline at end of file
+@shared_task
+def checkpoint_balances_task():
+    """
+    Checkpoints the net pair balances, so balance queries only aggregate the passbook entries written since.
+    The ledger engine snapshot is then rewritten from the new checkpoint when LEDGER_ENGINE_ENABLED is set.
+    """
+    checkpoint = checkpoint_balances()
+    if LEDGER_ENGINE_ENABLED:
+        build_engine()
+    return checkpoint.watermark if checkpoint is not None else None
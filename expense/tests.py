@@ -1,3 +1,857 @@
-from django.test import TestCase
+import json
+import time
+from io import StringIO
+from decimal import Decimal
+from datetime import timedelta
+from django.utils import timezone
+from django.test import TestCase, override_settings
+from django.db import connection
+from django.core.cache import cache
+from django.core.management import call_command
+from user.models import User
+from .models import Group, Expense, Passbook, Balance, DailyRollup
+from .ledger import aggregate_pair_balances, checkpoint_balances, current_pair_balances, split_id_range, merge_pair_balances
+from .utility import generate_balances, generate_settlements, compute_equal_shares, compute_exact_shares, compute_percentage_shares
+from .splits import split_by_weights
+from .netting import settle_positions
+from .serializers import PassbookSerializer, FlatPassbookSerializer
+from .cache import bump_ledger_versions, cache_stats
+from .engine import LedgerEngine, build_engine, get_engine
 
-# Create your tests here.
+
+class ExpenseCreationTests(TestCase):
+
+    def setUp(self):
+        self.users = [User.objects.create(name=f'User {index}', email=f'user{index}@example.com',
+                                          mobile_number=f'90000{index:05d}') for index in range(100)]
+
+    def post_expense(self, participant_detail, expense_type='equal'):
+        body = {"payer": self.users[0].pk, "amount": 600, "expense_type": expense_type,
+                "participant_detail": participant_detail}
+        return self.client.post('/api/expense', body, content_type='application/json')
+
+    def test_unknown_participant_is_rejected_before_anything_is_written(self):
+        response = self.post_expense([{"id": self.users[1].pk}, {"id": 999999}])
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+        self.assertFalse(Passbook.objects.exists())
+        self.assertFalse(Balance.objects.exists())
+
+    def test_malformed_participants_are_rejected(self):
+        self.assertEqual(self.post_expense([]).status_code, 400)
+        self.assertEqual(self.post_expense([{"name": "x"}]).status_code, 400)
+        self.assertEqual(self.post_expense([{"name": "x", "amount": 600}], 'exact').status_code, 400)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_participant_ids_must_be_integers(self):
+        for participant_id in (self.users[1].pk + 0.7, "1.7", True, 10 ** 30, None, [1]):
+            response = self.post_expense([{"id": self.users[0].pk}, {"id": participant_id}])
+            self.assertEqual(response.status_code, 400, participant_id)
+        body = f'{{"payer": {self.users[0].pk}, "amount": 600, "expense_type": "equal", "participant_detail": [{{"id": 1e309}}]}}'
+        self.assertEqual(self.client.post('/api/expense', body, content_type='application/json').status_code, 400)
+        response = self.client.post('/api/expense/bulk', body.replace('1e309', '1.7'), content_type='application/x-ndjson')
+        self.assertEqual(response.data['rejected'], [{"line": 1, "error": "Each participant's id must be an integer"}])
+        self.assertFalse(Expense.objects.exists())
+        self.assertEqual(self.post_expense([{"id": str(self.users[1].pk)}, {"id": float(self.users[2].pk)}]).status_code, 201)
+        self.assertEqual(sorted(Passbook.objects.values_list('user_id', flat=True)), [self.users[1].pk, self.users[2].pk])
+
+    def test_invalid_expense_fields_are_rejected(self):
+        participants = [{"id": self.users[0].pk}]
+        for body in ({"payer": 999999, "amount": 10}, {"payer": None, "amount": 10}, {"amount": 10},
+                     {"payer": self.users[0].pk, "amount": "abc"},
+                     {"payer": self.users[0].pk, "amount": 10, "group": 999999}):
+            body = dict(body, expense_type="equal", participant_detail=participants)
+            response = self.client.post('/api/expense', body, content_type='application/json')
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('Error', response.data)
+        self.assertFalse(Expense.objects.exists())
+
+    def test_query_count_does_not_grow_with_the_participants(self):
+        from django.test.utils import CaptureQueriesContext
+        with CaptureQueriesContext(connection) as small:
+            self.assertEqual(self.post_expense([{"id": user.pk} for user in self.users[:2]]).status_code, 201)
+        with CaptureQueriesContext(connection) as large:
+            self.assertEqual(self.post_expense([{"id": user.pk} for user in self.users]).status_code, 201)
+        self.assertEqual(len(large), len(small))
+        self.assertEqual(Passbook.objects.count(), 102)
+
+
+class BalanceTableTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        self.carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+
+    def post_expense(self, payer, participants, amount):
+        body = {"payer": payer.pk, "amount": amount, "expense_type": "equal",
+                "participant_detail": [{"id": user.pk} for user in participants]}
+        self.assertEqual(self.client.post('/api/expense', body, content_type='application/json').status_code, 201)
+
+    def test_expenses_in_both_directions_update_one_row_per_pair(self):
+        self.post_expense(self.alice, [self.alice, self.bob, self.carol], 90)
+        self.post_expense(self.bob, [self.alice, self.bob], 20)
+        self.post_expense(self.carol, [self.alice, self.carol], 10)
+
+        balances = {(row.user_low_id, row.user_high_id): row.amount for row in Balance.objects.all()}
+        self.assertEqual(balances, {(self.alice.pk, self.bob.pk): Decimal('-20.00'),
+                                    (self.alice.pk, self.carol.pk): Decimal('-25.00')})
+        out = StringIO()
+        call_command('rebuild_balances', '--check', stdout=out)
+        self.assertIn('consistent', out.getvalue())
+
+    def test_check_reports_drifted_pairs(self):
+        self.post_expense(self.alice, [self.alice, self.bob], 50)
+        Balance.objects.update(amount=Decimal('1.00'))
+        out = StringIO()
+        call_command('rebuild_balances', '--check', stdout=out)
+        self.assertIn('1 drifted pairs found', out.getvalue())
+        self.assertRegex(out.getvalue(), r'Aggregated 2 passbook entries with 1 worker in [\d.]+s \(\d+ rows/s\)')
+
+        call_command('rebuild_balances', stdout=StringIO())
+        self.assertEqual(Balance.objects.get().amount, Decimal('-25.00'))
+
+
+class SettlementTests(TestCase):
+
+    def test_chain_is_reduced_to_one_transfer(self):
+        positions = {'a': Decimal('-10.00'), 'b': Decimal('0.00'), 'c': Decimal('10.00')}
+        self.assertEqual(settle_positions(positions), ([('a', 'c', Decimal('10.00'))], True))
+
+    def test_deadline_cuts_the_settlement_short(self):
+        positions = {'a': Decimal('-10.00'), 'b': Decimal('-5.00'), 'c': Decimal('15.00')}
+        self.assertEqual(settle_positions(positions, deadline=time.monotonic() - 1), ([], False))
+
+    def test_endpoint_settles_a_chain_and_validates_time_limit(self):
+        alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        Passbook.objects.create(user=alice, owes_to=bob, amount='10.00')
+        Passbook.objects.create(user=bob, owes_to=carol, amount='10.00')
+
+        response = self.client.get('/api/passbook/settle')
+        self.assertEqual(response.data, {"transfers": [{"from": alice.userId, "to": carol.userId, "amount": Decimal('10.00')}],
+                                         "complete": True})
+        for time_limit in ('nan', 'inf', '-1', 'abc'):
+            self.assertEqual(self.client.get(f'/api/passbook/settle?time_limit={time_limit}').status_code, 400)
+        self.assertEqual(self.client.get('/api/passbook/settle?time_limit=5').data['complete'], True)
+
+    def test_only_users_with_a_position_are_looked_up(self):
+        from django.test.utils import CaptureQueriesContext
+        users = [User.objects.create(name=f'User {index}', email=f'user{index}@example.com',
+                                     mobile_number=f'90000{index:05d}') for index in range(20)]
+        Passbook.objects.create(user=users[0], owes_to=users[1], amount='10.00')
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(generate_settlements()['transfers'],
+                             [{"from": users[0].userId, "to": users[1].userId, "amount": Decimal('10.00')}])
+        user_queries = [query['sql'] for query in queries.captured_queries if 'user_user' in query['sql']]
+        self.assertEqual(len(user_queries), 1)
+        self.assertIn(' IN ', user_queries[0])
+
+
+class AggregatePairBalancesTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        self.carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        entries = [(self.alice, self.bob, '10.00')] * 50 + [(self.bob, self.alice, '15.00')] * 20 + \
+                  [(self.carol, self.alice, '20.00')] * 10 + [(self.alice, self.alice, '5.00')] * 5
+        Passbook.objects.bulk_create([Passbook(user=user, owes_to=owes_to, amount=amount) for user, owes_to, amount in entries])
+
+    def test_one_query_and_one_row_per_pair(self):
+        with self.assertNumQueries(1):
+            rows = list(aggregate_pair_balances())
+        self.assertEqual(len(rows), 2)
+        balances = {(low, high): Decimal(amount) for low, high, amount in rows}
+        self.assertEqual(balances[(self.alice.pk, self.bob.pk)], Decimal('200.00'))
+        self.assertEqual(balances[(self.alice.pk, self.carol.pk)], Decimal('-200.00'))
+
+    def test_cancelled_pairs_are_not_fetched(self):
+        Passbook.objects.create(user=self.bob, owes_to=self.alice, amount='200.00')
+        rows = list(aggregate_pair_balances())
+        self.assertEqual([(low, high) for low, high, _ in rows], [(self.alice.pk, self.carol.pk)])
+
+    def test_simplified_balances_read_one_row_per_pair(self):
+        call_command('rebuild_balances', stdout=StringIO())
+        with self.assertNumQueries(1):
+            balances = generate_balances(simplify=True)
+        self.assertEqual(balances, {
+            self.bob.userId: {self.alice.userId: Decimal('200.00')},
+            self.alice.userId: {self.carol.userId: Decimal('200.00')},
+        })
+
+
+class BackfillPassbookExpensesTests(TestCase):
+
+    def test_orphan_expenses_are_skipped_without_dropping_the_payer_history(self):
+        alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        orphan = Expense.objects.create(payer=alice, amount='75.00', expense_type='equal')
+        entries = [Passbook.objects.create(user=user, owes_to=alice, amount='30.00') for user in (bob, carol)]
+        dinner = Expense.objects.create(payer=alice, amount='60.00', expense_type='equal')
+        entries += [Passbook.objects.create(user=user, owes_to=alice, amount='20.00') for user in (bob, carol)]
+        lunch = Expense.objects.create(payer=alice, amount='40.00', expense_type='equal')
+
+        out = StringIO()
+        call_command('backfill_passbook_expenses', stdout=out)
+        self.assertEqual([Passbook.objects.get(pk=entry.pk).expense_id for entry in entries],
+                         [dinner.pk, dinner.pk, lunch.pk, lunch.pk])
+        self.assertFalse(orphan.passbook_entries.exists())
+        self.assertIn('Linked 4 passbook entries', out.getvalue())
+        self.assertIn('Skipped 1 expenses', out.getvalue())
+
+    def test_backfills_refuse_to_rebuild_from_a_compacted_passbook(self):
+        import tempfile
+        from django.core.management.base import CommandError
+        alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        self.client.post('/api/expense', {"payer": alice.pk, "amount": 60, "expense_type": "equal",
+                                          "participant_detail": [{"id": alice.pk}, {"id": bob.pk}]},
+                         content_type='application/json')
+        Passbook.objects.create(user=bob, owes_to=alice, amount='10.00')
+        checkpoint_balances(safety_lag=0)
+        tomorrow = timezone.localdate() + timedelta(days=1)
+        with tempfile.TemporaryDirectory() as directory:
+            call_command('compact_passbook', '--before', tomorrow.isoformat(), '--archive', f'{directory}/passbook.ndjson.gz',
+                         stdout=StringIO())
+        self.assertFalse(Passbook.objects.exists())
+        rollups = set(DailyRollup.objects.values_list('user_id', 'day', 'paid', 'owed', 'count'))
+
+        with self.assertRaisesMessage(CommandError, 'not linked to an expense'):
+            call_command('backfill_passbook_expenses', stdout=StringIO())
+        for args in ([], ['--since', timezone.localdate().isoformat()]):
+            with self.assertRaisesMessage(CommandError, f'Pass --since {tomorrow} or later'):
+                call_command('backfill_daily_rollups', *args, stdout=StringIO())
+        call_command('backfill_daily_rollups', '--since', tomorrow.isoformat(), stdout=StringIO())
+        self.assertEqual(set(DailyRollup.objects.values_list('user_id', 'day', 'paid', 'owed', 'count')), rollups)
+        self.assertEqual(len(rollups), 2)
+
+
+class PassbookIndexTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+
+    def test_debtor_lookup_uses_user_owes_to_index(self):
+        plan = Passbook.objects.filter(user=self.alice).explain()
+        self.assertIn('passbook_user_owes_to_idx', plan)
+
+    def test_pair_lookup_searches_both_columns_of_an_index(self):
+        plan = Passbook.objects.filter(user=self.alice, owes_to=self.bob).explain()
+        self.assertRegex(plan, r'USING (COVERING )?INDEX passbook_(user_owes_to|owes_to_user)_idx')
+        self.assertIn('user_id=?', plan)
+        self.assertIn('owes_to_id=?', plan)
+
+    def test_owed_lookup_uses_owes_to_user_index(self):
+        plan = Passbook.objects.filter(owes_to=self.bob).explain()
+        self.assertIn('passbook_owes_to_user_idx', plan)
+
+    def test_time_window_uses_created_at_index(self):
+        now = timezone.now()
+        plan = Passbook.objects.filter(created_at__gte=now - timedelta(days=7), created_at__lt=now).explain()
+        self.assertIn('passbook_created_at_idx', plan)
+
+
+class ListingPaginationTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        for amount in range(1, 6):
+            expense = Expense.objects.create(payer=self.alice, amount=amount, expense_type='equal')
+            Passbook.objects.create(expense=expense, user=self.bob, owes_to=self.alice, amount=amount)
+        # Every row shares one created_at, so only the id breaks the ties.
+        tie = timezone.now()
+        Expense.objects.update(created_at=tie)
+        Passbook.objects.update(created_at=tie)
+
+    def walk(self, url):
+        ids, cursor = [], ''
+        while True:
+            response = self.client.get(f'{url}?page_size=2&cursor={cursor}')
+            self.assertEqual(response.status_code, 200)
+            self.assertLessEqual(len(response.data['results']), 2)
+            ids += [row['id'] for row in response.data['results']]
+            cursor = response.data['next']
+            if cursor is None:
+                return ids
+
+    def test_cursor_pages_cover_every_row_once_despite_ties(self):
+        self.assertEqual(self.walk('/api/expense'), list(Expense.objects.order_by('id').values_list('id', flat=True)))
+        self.assertEqual(self.walk('/api/passbook'), list(Passbook.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_invalid_page_size_and_cursor_are_rejected(self):
+        for query in ('page_size=abc', 'page_size=0', 'cursor=garbage'):
+            self.assertEqual(self.client.get(f'/api/expense?{query}').status_code, 400)
+            self.assertEqual(self.client.get(f'/api/passbook?{query}').status_code, 400)
+
+    def test_ndjson_stream_holds_every_row(self):
+        for url, model in (('/api/expense', Expense), ('/api/passbook', Passbook)):
+            response = self.client.get(f'{url}?stream=ndjson')
+            self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+            rows = [json.loads(line) for line in b''.join(response.streaming_content).decode().splitlines()]
+            self.assertEqual([row['id'] for row in rows], list(model.objects.order_by('id').values_list('id', flat=True)))
+
+
+class AsyncViewTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+
+    async def test_async_post_then_paged_get(self):
+        from django.test import AsyncClient
+        client = AsyncClient()
+        for amount in (30, 60, 90):
+            response = await client.post('/api/async/expense', {
+                "payer": self.alice.pk, "amount": amount, "expense_type": "equal",
+                "participant_detail": [{"id": self.alice.pk}, {"id": self.bob.pk}]}, content_type='application/json')
+            self.assertEqual(response.status_code, 201)
+        response = await client.post('/api/async/expense', '{broken', content_type='application/json')
+        self.assertEqual(response.status_code, 400)
+
+        first = (await client.get('/api/async/expense?page_size=2')).json()
+        self.assertEqual([row['amount'] for row in first['results']], ['30.00', '60.00'])
+        second = (await client.get(f'/api/async/expense?page_size=2&cursor={first["next"]}')).json()
+        self.assertEqual([row['amount'] for row in second['results']], ['90.00'])
+        self.assertIsNone(second['next'])
+
+        passbook = (await client.get(f'/api/async/passbook/{self.bob.pk}?page_size=10')).json()
+        self.assertEqual(len(passbook['results']), 3)
+        self.assertEqual((await client.get('/api/async/passbook?page_size=0')).status_code, 400)
+
+
+class FlatPassbookSerializerTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='12.50')
+        Passbook.objects.create(user=self.bob, owes_to=self.alice, amount='7.00')
+
+    def test_matches_passbook_serializer(self):
+        queryset = Passbook.objects.select_related('user', 'owes_to').order_by('id')
+        expected = PassbookSerializer(queryset, many=True).data
+        with self.assertNumQueries(1):
+            flat = FlatPassbookSerializer(FlatPassbookSerializer.prepare_queryset(queryset), many=True).data
+        self.assertEqual(flat, [dict(row) for row in expected])
+
+
+class LedgerCacheTests(TestCase):
+
+    def setUp(self):
+        from unittest import mock
+        self.enterContext(mock.patch('expense.cache.LEDGER_CACHE_ENABLED', True))
+        cache.clear()
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='12.50')
+
+    def test_user_passbook_is_served_from_cache_until_the_user_version_changes(self):
+        url = f'/api/passbook/{self.alice.pk}'
+        self.assertEqual(len(self.client.get(url).data['results']), 1)
+        Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='5.00')
+        with self.assertNumQueries(0):
+            self.assertEqual(len(self.client.get(url).data['results']), 1)
+
+        bump_ledger_versions([self.alice.pk])
+        self.assertEqual(len(self.client.get(url).data['results']), 2)
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 2})
+
+    def test_other_users_keep_their_cached_passbook(self):
+        url = f'/api/passbook/{self.bob.pk}'
+        self.client.get(url)
+        bump_ledger_versions([self.alice.pk])
+        self.client.get(url)
+        self.assertEqual(cache_stats(), {"hits": 1, "misses": 1})
+
+    def test_process_local_backends_are_never_read(self):
+        from unittest import mock
+        url = f'/api/passbook/{self.alice.pk}'
+        with mock.patch('expense.cache.LEDGER_CACHE_ENABLED', False):
+            self.client.get(url)
+            Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='5.00')
+            self.assertEqual(len(self.client.get(url).data['results']), 2)
+        self.assertEqual(cache_stats(), {"hits": 0, "misses": 0})
+
+
+class BulkExpenseImportTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+
+    def test_imports_valid_lines_and_rejects_the_others(self):
+        records = [
+            {"payer": self.alice.pk, "amount": 90, "expense_type": "equal", "participant_detail": [{"id": self.alice.pk}, {"id": self.bob.pk}]},
+            {"payer": self.alice.pk, "amount": 90, "expense_type": "equal", "participant_detail": [{"id": 0}]},
+        ]
+        body = '\n'.join(json.dumps(record) for record in records) + '\n{broken\n'
+        response = self.client.post('/api/expense/bulk', body, content_type='application/x-ndjson')
+
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(sorted(reject['line'] for reject in response.data['rejected']), [2, 3])
+        self.assertEqual(Passbook.objects.filter(expense__isnull=False).count(), 2)
+        self.assertEqual(Balance.objects.get().amount, Decimal('-45.00'))
+
+    def test_malformed_participants_are_rejected_by_the_endpoint_and_the_command(self):
+        import tempfile
+        valid = {"payer": self.alice.pk, "amount": 90, "expense_type": "equal",
+                 "participant_detail": [{"id": self.alice.pk}, {"id": self.bob.pk}]}
+        records = [valid, {"participant_detail": [{"name": "x"}]},
+                   dict(valid, participant_detail=[{"name": "x"}]), dict(valid, participant_detail=["x"]), valid]
+        body = '\n'.join(json.dumps(record) for record in records)
+        response = self.client.post('/api/expense/bulk', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual(sorted(reject['line'] for reject in response.data['rejected']), [2, 3, 4])
+
+        with tempfile.TemporaryDirectory() as directory:
+            source, rejects = f'{directory}/expenses.ndjson', f'{directory}/rejects.ndjson'
+            with open(source, 'w') as file:
+                file.write(body + '\n')
+            call_command('import_expenses', source, '--rejects', rejects, '--chunk-size', '1', stdout=StringIO())
+            with open(rejects) as file:
+                self.assertEqual(len(file.read().splitlines()), 3)
+        self.assertEqual(Expense.objects.count(), 4)
+
+    def test_invalid_amounts_and_encodings_are_rejected_per_line(self):
+        import tempfile
+        valid = {"payer": self.alice.pk, "amount": 90, "expense_type": "equal",
+                 "participant_detail": [{"id": self.alice.pk}, {"id": self.bob.pk}]}
+        not_a_number = dict(valid, expense_type="exact", participant_detail=[{"id": self.alice.pk, "amount": "NaN"}])
+        latin_1 = json.dumps(dict(valid, expense_name="caf\xe9"), ensure_ascii=False).encode('latin-1')
+        body = b'\n'.join([json.dumps(valid).encode(), json.dumps(not_a_number).encode(), latin_1, json.dumps(valid).encode()])
+        response = self.client.post('/api/expense/bulk', body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['created'], 2)
+        self.assertEqual([reject['line'] for reject in response.data['rejected']], [2, 3])
+        self.assertEqual(response.data['rejected'][1]['error'], "Line is not valid UTF-8")
+
+        csv_body = ('payer,amount,expense_type,expense_name,participant_detail\n'
+                    f'{self.alice.pk},90,equal,ok,"[{{""id"": {self.bob.pk}}}]"\n').encode() + \
+                   f'{self.alice.pk},90,equal,caf\xe9,"[{{""id"": {self.bob.pk}}}]"\n'.encode('latin-1')
+        response = self.client.post('/api/expense/bulk', csv_body, content_type='text/csv')
+        self.assertEqual(response.data['created'], 1)
+        self.assertEqual(response.data['rejected'], [{"line": 3, "error": "Line is not valid UTF-8"}])
+
+        with tempfile.TemporaryDirectory() as directory:
+            source, rejects = f'{directory}/expenses.ndjson', f'{directory}/rejects.ndjson'
+            with open(source, 'wb') as file:
+                file.write(body + b'\n')
+            call_command('import_expenses', source, '--rejects', rejects, '--chunk-size', '1', stdout=StringIO())
+            with open(rejects) as file:
+                self.assertEqual([json.loads(line)['line'] for line in file], [2, 3])
+        self.assertEqual(Expense.objects.count(), 5)
+
+
+class SplitTests(TestCase):
+
+    def test_percentage_shares_always_add_up_to_the_total(self):
+        participants = [{"id": index, "percentage": "33.33"} for index in range(2)] + [{"id": 2, "percentage": "33.34"}]
+        shares, error = compute_percentage_shares(Decimal('0.10'), participants)
+        self.assertIsNone(error)
+        self.assertEqual(sum(amount for _, amount in shares), Decimal('0.10'))
+        self.assertEqual([amount for _, amount in shares], [Decimal('0.03'), Decimal('0.03'), Decimal('0.04')])
+
+    def test_equal_shares_differ_by_at_most_one_paisa(self):
+        shares, _ = compute_equal_shares(Decimal('200.00'), [{"id": index} for index in range(6)])
+        self.assertEqual([amount for _, amount in shares], [Decimal('33.34')] * 2 + [Decimal('33.33')] * 4)
+
+    def test_exact_shares_are_compared_without_float_error(self):
+        shares, error = compute_exact_shares(Decimal('0.30'), [{"id": 1, "amount": 0.1}, {"id": 2, "amount": 0.2}])
+        self.assertIsNone(error)
+        _, error = compute_exact_shares(Decimal('0.30'), [{"id": 1, "amount": 0.1}, {"id": 2, "amount": 0.21}])
+        self.assertIsNotNone(error)
+
+    def test_negative_exact_amounts_are_rejected(self):
+        shares, error = compute_exact_shares(Decimal('10'), [{"id": 1, "amount": 15}, {"id": 2, "amount": -5}])
+        self.assertIsNone(shares)
+        self.assertEqual(error, "Participant amounts must not be negative")
+
+    def test_non_finite_and_non_numeric_amounts_are_rejected(self):
+        alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        for expense_type, key in (('exact', 'amount'), ('percent', 'percentage')):
+            for value in ("NaN", "Infinity", "sNaN", [1], True, {"value": 1}):
+                body = {"payer": alice.pk, "amount": 100, "expense_type": expense_type,
+                        "participant_detail": [{"id": alice.pk, key: value}]}
+                response = self.client.post('/api/expense', body, content_type='application/json')
+                self.assertEqual(response.status_code, 400, (expense_type, value))
+        self.assertFalse(Expense.objects.exists())
+
+    def test_largest_remainder_split(self):
+        self.assertEqual(split_by_weights(100, [1, 1, 1]), [34, 33, 33])
+        self.assertEqual(split_by_weights(10, [1, 2, 7]), [1, 2, 7])
+        self.assertEqual(split_by_weights(5, [2, 2, 6]), [1, 1, 3])
+
+
+class BalanceSnapshotTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='30.00')
+
+    def test_snapshot_plus_delta_matches_the_full_passbook(self):
+        checkpoint_balances(safety_lag=0)
+        Passbook.objects.create(user=self.bob, owes_to=self.alice, amount='10.00')
+        self.assertEqual(current_pair_balances(), {(self.alice.pk, self.bob.pk): Decimal('20.00')})
+
+    def test_young_entries_are_left_for_the_next_checkpoint(self):
+        self.assertIsNone(checkpoint_balances(safety_lag=3600))
+
+    def test_id_ranges_and_partial_sums_cover_the_whole_ledger(self):
+        self.assertEqual(split_id_range(1, 10, 4), [(1, 3), (4, 6), (7, 9), (10, 10)])
+        self.assertEqual(split_id_range(5, 6, 8), [(5, 5), (6, 6)])
+        merged = merge_pair_balances([{(1, 2): Decimal('5.00')}, {(1, 2): Decimal('-5.00'), (2, 3): Decimal('1.50')}])
+        self.assertEqual(merged, {(1, 2): Decimal('0.00'), (2, 3): Decimal('1.50')})
+
+
+class DatabaseProfileTests(TestCase):
+
+    @override_settings(SQLITE_PRAGMAS={'cache_size': -2000, 'busy_timeout': 5000})
+    def test_pragmas_are_applied_to_new_connections(self):
+        from splitwise.db import apply_sqlite_pragmas
+        apply_sqlite_pragmas(sender=None, connection=connection)
+        with connection.cursor() as cursor:
+            cursor.execute('PRAGMA busy_timeout')
+            self.assertEqual(cursor.fetchone()[0], 5000)
+            cursor.execute('PRAGMA cache_size')
+            self.assertEqual(cursor.fetchone()[0], -2000)
+
+
+class PerformanceMiddlewareTests(TestCase):
+
+    def setUp(self):
+        from splitwise.metrics import registry
+        self.registry = registry
+        self.registry.reset()
+        cache.clear()
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+
+    def test_server_timing_header_and_prometheus_histograms(self):
+        response = self.client.get(f'/api/passbook/{self.alice.pk}')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+        metrics = self.client.get('/metrics', REMOTE_ADDR='127.0.0.1').content.decode()
+        self.assertIn('splitwise_request_duration_seconds_count{view="api/passbook/<int:user>",method="GET"} 1', metrics)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.1').status_code, 403)
+
+    async def test_async_requests_stay_on_the_event_loop(self):
+        from asgiref.sync import iscoroutinefunction
+        from django.test import AsyncClient
+        from splitwise.middleware import PerformanceMiddleware
+
+        async def get_response(request):
+            return None
+        self.assertTrue(iscoroutinefunction(PerformanceMiddleware(get_response)))
+        response = await AsyncClient().get(f'/api/async/passbook/{self.alice.pk}')
+        self.assertRegex(response['Server-Timing'], r'^total;dur=[\d.]+, db;dur=[\d.]+;desc="\d+ queries"$')
+
+    def test_repeated_statements_are_flagged(self):
+        from splitwise.middleware import QueryProfiler
+        profiler = QueryProfiler()
+        with connection.execute_wrapper(profiler):
+            for _ in range(3):
+                list(User.objects.filter(pk=self.alice.pk))
+        self.assertEqual(profiler.queries, 3)
+        self.assertEqual([count for _, count in profiler.duplicates(3)], [3])
+
+
+class NotificationBatchTests(TestCase):
+
+    def email_data(self, count):
+        return [{'user_name': f'User {index}', 'user_email': f'user{index}@example.com',
+                 'owes_to_name': 'Alice', 'amount': '10.00'} for index in range(count)]
+
+    def test_notifications_are_split_into_chunks(self):
+        from unittest import mock
+        from .tasks import send_expense_notifications_task, send_email_batch_task
+        with mock.patch('expense.tasks.NOTIFICATION_BATCH_SIZE', 2), \
+             mock.patch.object(send_email_batch_task, 'delay') as delay:
+            send_expense_notifications_task.apply(args=[self.email_data(5)])
+        self.assertEqual([len(call.args[0]) for call in delay.call_args_list], [2, 2, 1])
+
+    def test_a_chunk_is_sent_over_one_connection_and_retried_as_a_whole(self):
+        from unittest import mock
+        from smtplib import SMTPException
+        from django.core import mail
+        from django.core.mail import get_connection
+        from .tasks import send_email_batch_task
+        with mock.patch('expense.tasks.get_connection', wraps=get_connection) as connections:
+            send_email_batch_task.apply(args=[self.email_data(3)])
+        self.assertEqual(connections.call_count, 1)
+        self.assertEqual([message.to for message in mail.outbox], [['user0@example.com'], ['user1@example.com'], ['user2@example.com']])
+
+        with mock.patch('expense.tasks.send_mass_mail', side_effect=[SMTPException('down'), 2]) as send:
+            result = send_email_batch_task.apply(args=[self.email_data(2)])
+        self.assertTrue(result.successful())
+        self.assertEqual(send.call_count, 2)
+
+
+class WeeklySummaryTests(TestCase):
+
+    def test_summaries_are_fanned_out_in_chunks_with_weekly_totals(self):
+        from unittest import mock
+        from django.core import mail
+        from .tasks import send_weekly_summary_email, send_weekly_summary_chunk_task
+        alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        Passbook.objects.create(user=bob, owes_to=alice, amount='10.00')
+        Passbook.objects.create(user=bob, owes_to=alice, amount='5.50')
+        Passbook.objects.create(user=bob, owes_to=carol, amount='2.00')
+        Passbook.objects.create(user=carol, owes_to=alice, amount='7.00')
+        Passbook.objects.create(user=alice, owes_to=alice, amount='7.00')
+        old = Passbook.objects.create(user=alice, owes_to=bob, amount='99.00')
+        Passbook.objects.filter(pk=old.pk).update(created_at=timezone.now() - timedelta(days=30))
+
+        with mock.patch('expense.tasks.WEEKLY_SUMMARY_CHUNK_SIZE', 1), \
+             mock.patch.object(send_weekly_summary_chunk_task, 'delay') as delay:
+            send_weekly_summary_email()
+        chunks = [call.args[0] for call in delay.call_args_list]
+        self.assertEqual([[summary['email'] for summary in chunk] for chunk in chunks],
+                         [['bob@example.com'], ['carol@example.com']])
+        self.assertEqual(sorted(chunks[0][0]['owed']), [('Alice', 15.5), ('Carol', 2.0)])
+
+        send_weekly_summary_chunk_task.apply(args=[chunks[0]])
+        self.assertIn('Total Owed Amount: ₹17.50', mail.outbox[0].body)
+
+
+class OutboxRelayTests(TestCase):
+
+    def setUp(self):
+        from .models import Outbox
+        self.task_name = 'expense.tasks.send_email_batch_task'
+        Outbox.objects.bulk_create([Outbox(task_name=self.task_name, args=[[{'index': index}]]) for index in range(3)])
+
+    def test_rows_are_published_in_order_and_deleted(self):
+        from unittest import mock
+        from .models import Outbox
+        from .outbox import relay_outbox
+        from .tasks import send_email_batch_task
+        with mock.patch.object(send_email_batch_task, 'apply_async') as apply_async:
+            self.assertEqual(relay_outbox(batch_size=2), 2)
+            self.assertEqual(relay_outbox(batch_size=2), 1)
+            self.assertEqual(relay_outbox(batch_size=2), 0)
+        self.assertEqual([call.kwargs['args'] for call in apply_async.call_args_list],
+                         [[[{'index': index}]] for index in range(3)])
+        self.assertFalse(Outbox.objects.exists())
+
+    def test_a_publish_failure_rolls_the_batch_back(self):
+        from unittest import mock
+        from kombu.exceptions import OperationalError
+        from .models import Outbox
+        from .outbox import relay_outbox
+        from .tasks import send_email_batch_task
+        with mock.patch.object(send_email_batch_task, 'apply_async', side_effect=[None, OperationalError('down')]):
+            with self.assertRaises(OperationalError):
+                relay_outbox()
+        self.assertEqual(Outbox.objects.count(), 3)
+
+
+class TaskMetricsTests(TestCase):
+
+    def setUp(self):
+        import tempfile
+        from django.conf import settings
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        caches_setting = dict(settings.CACHES, task_metrics={
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache', 'LOCATION': directory.name})
+        self.enterContext(override_settings(CACHES=caches_setting))
+
+    def test_process_local_default_cache_falls_back_to_a_shared_store(self):
+        from django.conf import settings
+        from splitwise import task_metrics, settings as project_settings
+        self.assertEqual(project_settings.CACHES['default']['BACKEND'], 'django.core.cache.backends.locmem.LocMemCache')
+        self.assertEqual(project_settings.CACHES['task_metrics']['BACKEND'], 'django.core.cache.backends.filebased.FileBasedCache')
+        local = dict(settings.CACHES, task_metrics={'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'})
+        with override_settings(CACHES=local), self.assertLogs('splitwise.task_metrics', 'WARNING'):
+            task_metrics.connect()
+
+    def test_run_time_and_failures_are_recorded_per_task(self):
+        from splitwise import task_metrics
+        from .tasks import send_weekly_summary_chunk_task
+        send_weekly_summary_chunk_task.apply(args=[[]])
+        send_weekly_summary_chunk_task.apply(args=[None])
+
+        metrics = task_metrics.render([send_weekly_summary_chunk_task.name])
+        self.assertIn(f'splitwise_task_run_seconds_count{{task="{send_weekly_summary_chunk_task.name}"}} 2', metrics)
+        self.assertIn(f'splitwise_task_failures_total{{task="{send_weekly_summary_chunk_task.name}"}} 1', metrics)
+
+    def test_published_messages_are_routed_by_kind(self):
+        from splitwise.celery import app
+        self.assertEqual(app.amqp.router.route({}, 'expense.tasks.send_email_batch_task')['queue'].name, 'notifications')
+        self.assertEqual(app.amqp.router.route({}, 'expense.tasks.send_weekly_summary_chunk_task')['queue'].name, 'summaries')
+
+
+class NotificationDigestTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+
+    def test_expenses_of_a_quiet_buffer_are_sent_as_one_digest(self):
+        from unittest import mock
+        from django.core import mail
+        from .models import Outbox, PendingNotification
+        from .tasks import flush_notification_digests_task, send_digest_batch_task
+        for amount in (30, 60, 90):
+            self.client.post('/api/expense', {"payer": self.alice.pk, "amount": amount, "expense_type": "equal",
+                                              "participant_detail": [{"id": self.alice.pk}, {"id": self.bob.pk}]},
+                             content_type='application/json')
+        self.assertEqual(PendingNotification.objects.count(), 6)
+
+        self.assertEqual(flush_notification_digests_task(), 0)
+        with mock.patch('expense.tasks.NOTIFICATION_DIGEST_WINDOW', 0):
+            self.assertEqual(flush_notification_digests_task(), 6)
+        self.assertFalse(PendingNotification.objects.exists())
+
+        send_digest_batch_task.apply(args=Outbox.objects.get().args)
+        self.assertEqual(sorted(message.to[0] for message in mail.outbox), ['alice@example.com', 'bob@example.com'])
+        self.assertIn('3 new expenses', mail.outbox[0].body)
+
+
+class DailyRollupTests(TestCase):
+
+    def setUp(self):
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        for payer, amount, expense_type, detail in (
+            (self.alice, 90, 'equal', [{"id": self.alice.pk}, {"id": self.bob.pk}]),
+            (self.alice, 30, 'exact', [{"id": self.bob.pk, "amount": 30}]),
+            (self.bob, 40, 'equal', [{"id": self.alice.pk}, {"id": self.bob.pk}]),
+        ):
+            self.client.post('/api/expense', {"payer": payer.pk, "amount": amount, "expense_type": expense_type,
+                                              "participant_detail": detail}, content_type='application/json')
+
+    def test_stats_are_served_from_the_rollups(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(f'/api/expense/{self.alice.pk}/stats?bucket=month')
+        self.assertEqual([(row['expense_type'], row['paid'], row['owed'], row['count']) for row in response.data['results']],
+                         [('equal', Decimal('90.00'), Decimal('20.00'), 2), ('exact', Decimal('30.00'), Decimal('0.00'), 1)])
+        self.assertEqual(self.client.get(f'/api/expense/{self.alice.pk}/stats?bucket=year').status_code, 400)
+
+    def test_backfill_matches_the_incremental_rollups(self):
+        fields = ('user_id', 'day', 'expense_type', 'paid', 'owed', 'count')
+        incremental = set(DailyRollup.objects.values_list(*fields))
+        DailyRollup.objects.all().delete()
+        call_command('backfill_daily_rollups', stdout=StringIO())
+        self.assertEqual(set(DailyRollup.objects.values_list(*fields)), incremental)
+
+
+class GroupTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        self.carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        self.group = self.client.post('/api/group', {"name": "Trip", "members": [self.alice.pk, self.bob.pk]},
+                                      content_type='application/json').data['id']
+
+    def add_expense(self, payer, participants, group=None):
+        body = {"payer": payer.pk, "amount": 60, "expense_type": "equal",
+                "participant_detail": [{"id": user.pk} for user in participants]}
+        if group is not None:
+            body["group"] = group
+        return self.client.post('/api/expense', body, content_type='application/json')
+
+    def test_group_balances_only_cover_the_group_expenses(self):
+        self.assertEqual(self.add_expense(self.alice, [self.alice, self.bob], self.group).status_code, 201)
+        self.add_expense(self.carol, [self.alice, self.carol])
+
+        response = self.client.get(f'/api/group/{self.group}/passbook?simplify=true')
+        self.assertEqual(response.data, {self.alice.userId: {self.bob.userId: Decimal('30.00')}})
+        settle = self.client.get(f'/api/group/{self.group}/passbook/settle').data
+        self.assertEqual(settle['transfers'], [{"from": self.bob.userId, "to": self.alice.userId, "amount": Decimal('30.00')}])
+
+    def test_only_members_take_part_in_group_expenses(self):
+        self.assertEqual(self.add_expense(self.alice, [self.alice, self.carol], self.group).status_code, 400)
+        self.client.post(f'/api/group/{self.group}/members', {"members": [self.carol.pk]}, content_type='application/json')
+        self.assertEqual(self.add_expense(self.alice, [self.alice, self.carol], self.group).status_code, 201)
+
+    def test_invalid_member_bodies_are_rejected(self):
+        url = f'/api/group/{self.group}/members'
+        for body in ([self.carol.pk], {"members": "x"}, {"members": [1.5]}, {"members": [999999]}, {}):
+            response = self.client.post(url, body, content_type='application/json')
+            self.assertEqual(response.status_code, 400, body)
+            self.assertIn('Error', response.data)
+        self.assertEqual(sorted(Group.objects.get().members.values_list('pk', flat=True)), [self.alice.pk, self.bob.pk])
+
+    def test_compaction_keeps_the_group_entries(self):
+        import gzip
+        import tempfile
+        self.add_expense(self.alice, [self.alice, self.bob], self.group)
+        self.add_expense(self.carol, [self.alice, self.carol])
+        checkpoint_balances(safety_lag=0)
+        tomorrow = (timezone.localdate() + timedelta(days=1)).isoformat()
+        with tempfile.TemporaryDirectory() as directory:
+            archive = f'{directory}/passbook.ndjson.gz'
+            call_command('compact_passbook', '--before', tomorrow, '--archive', archive, stdout=StringIO())
+            with gzip.open(archive, 'rt') as file:
+                rows = [json.loads(line) for line in file]
+        self.assertEqual({row['group_id'] for row in rows}, {None})
+        self.assertEqual(len(rows), 2)
+
+        response = self.client.get(f'/api/group/{self.group}/passbook?simplify=true')
+        self.assertEqual(response.data, {self.alice.userId: {self.bob.userId: Decimal('30.00')}})
+        self.assertEqual(len(self.client.get(f'/api/group/{self.group}/passbook/settle').data['transfers']), 1)
+
+    def test_group_lookup_uses_group_index(self):
+        plan = Passbook.objects.filter(group=self.group).explain()
+        self.assertIn('passbook_group_user_idx', plan)
+
+
+class LedgerEngineTests(TestCase):
+
+    def setUp(self):
+        import tempfile
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+        self.path = f'{self.directory.name}/ledger_engine.bin'
+        self.alice = User.objects.create(name='Alice', email='alice@example.com', mobile_number='9000000001')
+        self.bob = User.objects.create(name='Bob', email='bob@example.com', mobile_number='9000000002')
+        self.carol = User.objects.create(name='Carol', email='carol@example.com', mobile_number='9000000003')
+        Passbook.objects.create(user=self.alice, owes_to=self.bob, amount='30.00')
+        Passbook.objects.create(user=self.carol, owes_to=self.alice, amount='12.50')
+
+    def test_snapshot_file_round_trip(self):
+        checkpoint_balances(safety_lag=0)
+        written = build_engine(self.path)
+        engine = LedgerEngine.open(self.path)
+        self.assertEqual(list(engine.pairs()), list(written.pairs()))
+        self.assertEqual(engine.user_key(engine.index_of(self.carol.pk)), self.carol.userId)
+        self.assertEqual(len(engine), 2)
+        self.assertLess(engine.nbytes, 200)
+
+    def test_engine_reads_entries_written_after_its_snapshot(self):
+        checkpoint_balances(safety_lag=0)
+        build_engine(self.path)
+        dave = User.objects.create(name='Dave', email='dave@example.com', mobile_number='9000000004')
+        Passbook.objects.create(user=self.bob, owes_to=self.alice, amount='30.00')
+        Passbook.objects.create(user=dave, owes_to=self.carol, amount='1.00')
+        expected_settlements = generate_settlements()
+
+        with override_settings(LEDGER_ENGINE_ENABLED=True, LEDGER_ENGINE_PATH=self.path):
+            self.assertIsNotNone(get_engine())
+            self.assertEqual(generate_balances(True), {self.alice.userId: {self.carol.userId: Decimal('12.50')},
+                                                       self.carol.userId: {dave.userId: Decimal('1.00')}})
+            self.assertEqual(generate_settlements(), expected_settlements)
+            checkpoint_balances(safety_lag=0)
+            self.assertIsNone(get_engine())
+
+    async def test_async_balances_are_read_from_the_engine(self):
+        from asgiref.sync import sync_to_async
+        await sync_to_async(checkpoint_balances)(safety_lag=0)
+        await sync_to_async(build_engine)(self.path)
+        with override_settings(LEDGER_ENGINE_ENABLED=True, LEDGER_ENGINE_PATH=self.path):
+            response = await self.async_client.get('/api/async/passbook?simplify=true')
+        # The passbook entries of setUp were written without the Balance table, so only the engine holds them.
+        self.assertEqual(json.loads(response.content), {self.bob.userId: {self.alice.userId: 30.0},
+                                                        self.alice.userId: {self.carol.userId: 12.5}})
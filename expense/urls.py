@@ -1,12 +1,28 @@
 from django.urls import path
 from .views import (AddExpense,
+                    BulkExpense,
                     RetreiveExpense,
+                    ExpenseStats,
                     ListPassbook,
-                    UserPassbook)
+                    SettlePassbook,
+                    UserPassbook,
+                    LedgerCacheStats,
+                    GroupList,
+                    GroupMembers,
+                    GroupPassbook,
+                    GroupSettle)
 
 urlpatterns = [
     path('expense',AddExpense.as_view()), # endpoint for creating new expense and listing all the expenses
+    path('expense/bulk',BulkExpense.as_view()), # endpoint for importing many expenses from NDJSON or CSV
     path('expense/<int:user>',RetreiveExpense.as_view()), # endpoint to show user specific expenses
+    path('expense/<int:user>/stats',ExpenseStats.as_view()), # endpoint reporting user spending from the daily rollups
     path('passbook',ListPassbook.as_view()), # endpoint for listing all passbook entries
+    path('passbook/settle',SettlePassbook.as_view()), # endpoint for settling all debts with the fewest transfers
     path('passbook/<int:user>',UserPassbook.as_view()), # endpoint to show user specific passbook
+    path('passbook/cache-stats',LedgerCacheStats.as_view()), # endpoint exposing passbook cache hit/miss counters
+    path('group',GroupList.as_view()), # endpoint for creating and listing groups
+    path('group/<int:group>/members',GroupMembers.as_view()), # endpoint for adding members to a group
+    path('group/<int:group>/passbook',GroupPassbook.as_view()), # endpoint for the passbook and balances of a group
+    path('group/<int:group>/passbook/settle',GroupSettle.as_view()), # endpoint for settling the debts within a group
 ]
\ No newline at end of file
@@ -1,13 +1,73 @@
 from user.models import User
-from .models import Passbook
-from rest_framework import status
-from collections import defaultdict
-from expense.tasks import send_email_task
-from .serializers import PassbookSerializer
+from .models import Group, Passbook, Balance, PendingNotification
+from django.db import transaction
+from django.db.models import F, Q, Case, When, Value
+from rest_framework import status, serializers
+import time
+from decimal import Decimal
+from .cache import bump_ledger_versions
+from .serializers import ExpenseSerializer, MAX_ID
+from .netting import net_pair_balances, group_by_creditor, settle_positions
+from .ledger import current_net_positions, group_pair_balances, net_positions
+from .engine import get_engine, engine_pair_balances, engine_net_positions
+from .rollups import rollup_deltas_dict, add_expense_to_rollups, apply_rollup_deltas
+from .splits import MINOR_UNITS, to_minor_units, from_minor_units, split_equal, split_by_weights
 from rest_framework.response import Response
 
+# Keeps id__in lookups under SQLite's limit on query parameters.
+USER_LOOKUP_BATCH_SIZE = 900
 
-def manage_equal_expense(total_amount, payer, participant_detail):
+# Participant ids are parsed like the integer fields of the serializers, so 1.7 is rejected rather than truncated.
+PARTICIPANT_ID_FIELD = serializers.IntegerField(max_value=MAX_ID)
+
+
+def create_expense(request_data):
+    """
+    Validates a new expense request and hands it to the split manager of its expense type.
+
+    Parameters:
+    - request_data (dict): The request body, see AddExpense.post for its format.
+
+    Returns: Response indicating the status of the expense creation.
+    """
+    try:
+        participant_detail = request_data.pop('participant_detail')
+    except:
+        return Response({'Error':"Participant_detail key is required"},status=status.HTTP_400_BAD_REQUEST)
+    
+    serializer = ExpenseSerializer(data = request_data)
+    if not serializer.is_valid():
+        return Response({"Error":serializer.errors},status=status.HTTP_400_BAD_REQUEST)
+    expense_detail = serializer.validated_data
+    expense_type = expense_detail.get("expense_type")
+    total_amount = expense_detail['amount']
+    payer = expense_detail['payer']
+    
+    error = validate_participant_detail(participant_detail)
+    if error:
+        return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+
+    if len(participant_detail) > 1000:
+        return Response({"Error":"Too many participants. Maximum allowed is 1000."},status=status.HTTP_400_BAD_REQUEST)
+    
+    if total_amount > 10000000:
+        return Response({"Error":"Expense amount exceeds the maximum limit of 10,000,000."},status=status.HTTP_400_BAD_REQUEST)
+    
+    if expense_type == "equal":
+        response =  manage_equal_expense(total_amount,payer,participant_detail,serializer)
+
+    elif expense_type == "exact":
+        response = manage_exact_expense(total_amount,payer,participant_detail,serializer)
+         
+    elif expense_type == "percent":
+        response = manage_percentage_expense(total_amount,payer,participant_detail,serializer)
+    else:
+        return Response({"Error":"Invalid expense_type"},status=status.HTTP_400_BAD_REQUEST)
+    
+    return response
+
+
+def manage_equal_expense(total_amount, payer, participant_detail, expense_serializer):
     """
     Manages equal expenses among participants.
     
@@ -16,6 +76,7 @@ def manage_equal_expense(total_amount, payer, participant_detail):
     - payer (str): The user who paid the expense.
     - participant_detail (list): List of dictionaries containing participant details. 
                                  Eg: [{"id":1},{"id":3}...]
+    - expense_serializer (ExpenseSerializer): Validated serializer of the expense being created.
 
     Returns: Response indicating the status of the expense creation.
 
@@ -25,36 +86,13 @@ def manage_equal_expense(total_amount, payer, participant_detail):
     - Emails are sent to notify participants about their share of the expense.
 
     """
-    if any("amount" in participant for participant in participant_detail) or any("percentage" in participant for participant in participant_detail):
-        return Response({"Error":"Amount or percentage is not required for equal type of split"},status=status.HTTP_400_BAD_REQUEST)
-
-    each_person_owes = round(total_amount/len(participant_detail),2)
-    for index, participant in enumerate(participant_detail):
-        passbook = Passbook()
-        passbook.owes_to = payer
-        passbook.user = User.objects.get(pk = participant['id'])
-
-        if each_person_owes * len(participant_detail) == total_amount:
-            passbook.amount = each_person_owes
-        else:
-            if index == 0:
-                remaining_amount = total_amount - each_person_owes * len(participant_detail)
-                passbook.amount = each_person_owes+remaining_amount
-            else:
-                passbook.amount = each_person_owes
-        passbook.save()
-        email_data = {
-            'user_name': passbook.user.name,
-            'user_email': passbook.user.email,
-            'owes_to_name': passbook.owes_to.name,
-            'amount': passbook.amount
-        }
-        send_email_task.delay(email_data)
-
-    return Response({"Message":"Expense Created"},status=status.HTTP_201_CREATED)
+    shares, error = compute_equal_shares(total_amount, participant_detail)
+    if error:
+        return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+    return create_expense_entries(expense_serializer, payer, shares)
 
 
-def manage_exact_expense(total_amount, payer, participant_detail):
+def manage_exact_expense(total_amount, payer, participant_detail, expense_serializer):
     """
     Manages exact expenses among participants.
 
@@ -63,6 +101,7 @@ def manage_exact_expense(total_amount, payer, participant_detail):
     - payer (str): The user who paid the expense.
     - participant_detail (list): List of dictionaries containing participant details, including their specific amounts.
                                  Eg: [{"id":1,"amount":1000} , {"id":3, "amount":3000}]
+    - expense_serializer (ExpenseSerializer): Validated serializer of the expense being created.
 
     Returns: Response indicating the status of the expense creation.
 
@@ -72,31 +111,13 @@ def manage_exact_expense(total_amount, payer, participant_detail):
     - Emails are sent to notify participants about their share of the expense.
 
     """
-    try:
-        participant_total_amount = sum(round(item['amount'],2) for item in participant_detail)
-    except:
-        return Response({"Error":"Each participant's amount is required for exact type of split"},status=status.HTTP_400_BAD_REQUEST)
-    
-    if participant_total_amount != total_amount:
-        return Response({"Error":"The calculated total amount of participants does not match the provided total amount"},status=status.HTTP_400_BAD_REQUEST)
-
-    for participant in participant_detail:
-        passbook = Passbook()
-        passbook.owes_to = payer
-        passbook.user = User.objects.get(pk = participant['id'])
-        passbook.amount = round(participant['amount'],2)
-        passbook.save()
-        email_data = {
-            'user_name': passbook.user.name,
-            'user_email': passbook.user.email,
-            'owes_to_name': passbook.owes_to.name,
-            'amount': passbook.amount
-        }
-        send_email_task.delay(email_data)
-    return Response({"Message":"Expense Created"},status=status.HTTP_201_CREATED)
+    shares, error = compute_exact_shares(total_amount, participant_detail)
+    if error:
+        return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+    return create_expense_entries(expense_serializer, payer, shares)
 
 
-def manage_percentage_expense(total_amount, payer, participant_detail):
+def manage_percentage_expense(total_amount, payer, participant_detail, expense_serializer):
     """
     Manages expenses split by percentage among participants.
 
@@ -105,6 +126,7 @@ def manage_percentage_expense(total_amount, payer, participant_detail):
     - payer (str): The user who paid the expense.
     - participant_detail (list): List of dictionaries containing participant details, including their percentages.
                                  Eg: [{"id":1,"percentage":40},{"id":3,"percentage":60}]
+    - expense_serializer (ExpenseSerializer): Validated serializer of the expense being created.
 
     Returns: Response indicating the status of the expense creation.
 
@@ -113,77 +135,300 @@ def manage_percentage_expense(total_amount, payer, participant_detail):
     - Passbook entries are created for each participant.
     - Emails are sent to notify participants about their share of the expense.
     """
+    shares, error = compute_percentage_shares(total_amount, participant_detail)
+    if error:
+        return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+    return create_expense_entries(expense_serializer, payer, shares)
+
+
+def compute_shares(expense_type, total_amount, participant_detail):
+    """
+    Computes the amount owed by each participant of an expense, without touching the database.
+
+    Parameters:
+    - expense_type (str): One of "equal", "exact" or "percent".
+    - total_amount (Decimal): The total amount of the expense.
+    - participant_detail (list): List of dictionaries containing participant details, as accepted by the split managers.
+
+    Returns: A tuple (shares, error). shares is a list of (participant id, amount owed) tuples, error is None
+             or a message describing why the split is invalid.
+    """
+    error = validate_participant_detail(participant_detail)
+    if error:
+        return None, error
+    if expense_type == "equal":
+        return compute_equal_shares(total_amount, participant_detail)
+    elif expense_type == "exact":
+        return compute_exact_shares(total_amount, participant_detail)
+    elif expense_type == "percent":
+        return compute_percentage_shares(total_amount, participant_detail)
+    return None, "Invalid expense_type"
+
+
+def validate_participant_detail(participant_detail):
+    """
+    Checks that participant_detail is a non-empty list of objects that each carry an "id".
+
+    Returns: None when the list is well formed, otherwise a message describing the problem.
+    """
+    if not isinstance(participant_detail, list) or not participant_detail:
+        return "Participant_detail must be a non-empty list"
+    if any(not isinstance(participant, dict) or 'id' not in participant for participant in participant_detail):
+        return "Each participant must be an object with an id"
+    return None
+
+
+def parse_participant_ids(shares):
+    """
+    Converts the participant ids of computed shares to ints.
+
+    Ids such as 3, 3.0 or "3" are accepted, while 1.7, "abc", true or 1e309 are not integers.
+
+    Returns: The list of (participant id, amount owed) tuples with int ids, or None when an id is not an integer.
+    """
     try:
-        participant_total_percentage = sum(round(float(item['percentage']),2) for item in participant_detail)
-    except:
-        return Response({"Error":"Each participant's percentage is required for percent type of split"},status=status.HTTP_400_BAD_REQUEST)
-    
-    if participant_total_percentage != 100:
-        return Response({"Error":"The sum of participant's percentage is not equal to 100."},status=status.HTTP_400_BAD_REQUEST)
-
-    for participant in participant_detail:
-        passbook = Passbook()
-        passbook.owes_to = payer
-        passbook.user = User.objects.get(pk = participant['id'])
-        passbook.amount = round(float(total_amount/100) * float(participant['percentage']),2)
-        passbook.save()
-        email_data = {
-            'user_name': passbook.user.name,
-            'user_email': passbook.user.email,
-            'owes_to_name': passbook.owes_to.name,
-            'amount': passbook.amount
-        }
-        send_email_task.delay(email_data)
+        return [(PARTICIPANT_ID_FIELD.run_validation(participant_id), amount) for participant_id, amount in shares]
+    except serializers.ValidationError:
+        return None
+
+
+def compute_equal_shares(total_amount, participant_detail):
+    """
+    Splits the total equally. Shares differ by at most one paisa and always add up to the total.
+
+    Returns: A tuple (shares, error), see compute_shares.
+    """
+    if any("amount" in participant for participant in participant_detail) or any("percentage" in participant for participant in participant_detail):
+        return None, "Amount or percentage is not required for equal type of split"
+
+    minor_shares = split_equal(to_minor_units(total_amount), len(participant_detail))
+    return [(participant['id'], from_minor_units(share)) for participant, share in zip(participant_detail, minor_shares)], None
+
+
+def compute_exact_shares(total_amount, participant_detail):
+    """
+    Uses the amount given for each participant, rounded to the paisa, which must add up to the total exactly.
+
+    Returns: A tuple (shares, error), see compute_shares.
+    """
+    try:
+        minor_amounts = [to_minor_units(item['amount']) for item in participant_detail]
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return None, "Each participant's amount is required for exact type of split"
+
+    if any(amount < 0 for amount in minor_amounts):
+        return None, "Participant amounts must not be negative"
+
+    if sum(minor_amounts) != to_minor_units(total_amount):
+        return None, "The calculated total amount of participants does not match the provided total amount"
+
+    return [(participant['id'], from_minor_units(amount)) for participant, amount in zip(participant_detail, minor_amounts)], None
+
+
+def compute_percentage_shares(total_amount, participant_detail):
+    """
+    Splits the total by the percentage given for each participant, which must add up to exactly 100.
+    Percentages are taken to two decimal places and the shares are rounded with the largest-remainder method,
+    so they always add up to the total.
+
+    Returns: A tuple (shares, error), see compute_shares.
+    """
+    try:
+        # to_minor_units turns a percentage with two decimals into basis points.
+        basis_points = [to_minor_units(item['percentage']) for item in participant_detail]
+    except (KeyError, TypeError, ValueError, ArithmeticError):
+        return None, "Each participant's percentage is required for percent type of split"
+
+    if sum(basis_points) != 100 * MINOR_UNITS or any(points < 0 for points in basis_points):
+        return None, "The sum of participant's percentage is not equal to 100."
+
+    minor_shares = split_by_weights(to_minor_units(total_amount), basis_points)
+    return [(participant['id'], from_minor_units(share)) for participant, share in zip(participant_detail, minor_shares)], None
+
+
+def create_expense_entries(expense_serializer, payer, shares):
+    """
+    Saves an expense together with the passbook entries of all its participants.
+
+    Parameters:
+    - expense_serializer (ExpenseSerializer): Validated serializer of the expense being created.
+    - payer (User): The user who paid the expense.
+    - shares (list): List of (participant id, amount owed) tuples computed by the split managers.
+
+    Returns: Response indicating the status of the expense creation.
+
+    Notes:
+    - All participants are fetched with a single query, unknown ids are rejected before anything is written.
+    - Expenses of a group may only involve its members, the group is copied to every passbook entry.
+    - The expense, its passbook entries, the affected pairwise balances and daily rollups are written in one transaction.
+    - The cache versions of the payer and every participant are bumped once the transaction commits.
+    - The notification of every participant is added to their digest buffer in the same transaction, the
+      buffers are flushed as digest emails by flush_notification_digests_task, so the request never waits
+      on the broker.
+    """
+    shares = parse_participant_ids(shares)
+    if shares is None:
+        return Response({"Error":"Each participant's id must be an integer"},status=status.HTTP_400_BAD_REQUEST)
+
+    participants = User.objects.in_bulk({participant_id for participant_id, _ in shares})
+    missing_ids = sorted({participant_id for participant_id, _ in shares if participant_id not in participants})
+    if missing_ids:
+        return Response({"Error":f"Participants with ids {missing_ids} do not exist"},status=status.HTTP_400_BAD_REQUEST)
+
+    group = expense_serializer.validated_data.get('group')
+    if group is not None:
+        involved_ids = {payer.pk} | set(participants)
+        member_ids = set(Group.members.through.objects.filter(group=group, user_id__in=involved_ids).values_list('user_id', flat=True))
+        if involved_ids - member_ids:
+            return Response({"Error":f"Users with ids {sorted(involved_ids - member_ids)} are not members of group {group.pk}"},status=status.HTTP_400_BAD_REQUEST)
+
+    with transaction.atomic():
+        expense = expense_serializer.save()
+        passbooks = Passbook.objects.bulk_create([
+            Passbook(expense=expense, group=group, user=participants[participant_id], owes_to=payer, amount=amount)
+            for participant_id, amount in shares
+        ])
+        update_balances(payer, shares)
+        rollup_deltas = rollup_deltas_dict()
+        add_expense_to_rollups(rollup_deltas, expense, shares)
+        apply_rollup_deltas(rollup_deltas)
+        affected_user_ids = [payer.pk] + [participant_id for participant_id, _ in shares]
+        group_id = group.pk if group is not None else None
+        transaction.on_commit(lambda: bump_ledger_versions(affected_user_ids, group_id))
+
+        PendingNotification.objects.bulk_create([
+            PendingNotification(user_email=passbook.user.email, email_data={
+                'user_name': passbook.user.name,
+                'user_email': passbook.user.email,
+                'owes_to_name': passbook.owes_to.name,
+                'amount': passbook.amount
+            }) for passbook in passbooks
+        ])
+
     return Response({"Message":"Expense Created"},status=status.HTTP_201_CREATED)
 
 
-def generate_balances(simplify):
+def update_balances(payer, shares):
+    """
+    Applies the shares of a new expense to the materialized pairwise balances.
+
+    Parameters:
+    - payer (User): The user who paid the expense.
+    - shares (list): List of (participant id, amount owed) tuples of the expense.
+
+    Notes:
+    - Must be called inside the transaction that writes the passbook entries.
+    - The shares are netted per pair with net_pair_balances, so the payer's own share is skipped.
+    """
+    apply_balance_deltas(net_pair_balances((participant_id, payer.pk, amount) for participant_id, amount in shares))
+
+
+def apply_balance_deltas(pair_deltas, batch_size=500):
+    """
+    Adds signed amounts to the materialized pairwise balances.
+
+    Parameters:
+    - pair_deltas (dict): (user_low, user_high) -> signed amount, positive when user_low owes user_high.
+    - batch_size (int): Number of pairs updated per UPDATE statement.
+
+    Notes:
+    - Must be called inside the transaction that writes the passbook entries.
+    - Missing pair rows are created first, then each batch of pairs is incremented with a single
+      UPDATE using F() expressions so concurrent expenses never overwrite each other.
+    """
+    pairs = [(pair, amount) for pair, amount in pair_deltas.items() if amount != 0]
+    for start in range(0, len(pairs), batch_size):
+        batch = pairs[start:start + batch_size]
+        Balance.objects.bulk_create([Balance(user_low_id=low, user_high_id=high) for (low, high), _ in batch],
+                                    ignore_conflicts=True)
+
+        pair_filter = Q()
+        for (low, high), _ in batch:
+            pair_filter |= Q(user_low_id=low, user_high_id=high)
+        deltas = Case(
+            *[When(user_low_id=low, user_high_id=high, then=Value(amount)) for (low, high), amount in batch],
+            output_field=Balance._meta.get_field('amount'),
+        )
+        Balance.objects.filter(pair_filter).update(amount=F('amount') + deltas)
+
+
+def generate_balances(simplify, group=None):
     """
     Generates balances for users based on passbook entries.
 
     Parameters:
     - simplify (bool): A boolean flag indicating whether to simplify the balances or not.
+    - group (int): Optional id of a group, only the passbook entries of its expenses are then considered.
 
     Returns:
     - If simplify is True, returns a dictionary containing simplified balances between users.
-    - If simplify is False, returns serialized data of all passbook entries.
+    - If simplify is False, returns a queryset of all passbook entries, to be paginated by the caller.
 
     Notes:
     - If simplify is True, balances between users are simplified, where each user only owes or is owed by another user.
+      They are read from the materialized Balance table, keyed by the user who is owed.
     - If simplify is False, detailed passbook entries are returned.
+    - Balances of a group are aggregated from its own passbook entries rather than read from the Balance table.
+    - When LEDGER_ENGINE_ENABLED is set, simplified balances are read from the memory-mapped ledger engine plus the
+      passbook entries written since its snapshot, see expense/engine.py.
     """
+    if group is not None:
+        if not simplify:
+            return Passbook.objects.filter(group=group).select_related('user', 'owes_to')
+        pair_balances = group_pair_balances(group)
+        user_keys = user_keys_of({user_id for pair in pair_balances for user_id in pair})
+        return group_by_creditor(((user_keys[low], user_keys[high]), amount) for (low, high), amount in pair_balances.items())
     if simplify:
-        user_passbooks = Passbook.objects.values('user__userId', 'owes_to__userId', 'amount').order_by('user__userId')
+        engine = get_engine()
+        if engine is not None:
+            return group_by_creditor(engine_pair_balances(engine))
+        balances = Balance.objects.exclude(amount=0).values_list('user_low__userId', 'user_high__userId', 'amount')
+        return group_by_creditor(((low_key, high_key), amount) for low_key, high_key, amount in balances)
+    else:
+        return Passbook.objects.select_related('user', 'owes_to')
 
-        required_dict = defaultdict(dict)
 
-        for data in user_passbooks:
-            current_key, other_key, amount = data['user__userId'], data['owes_to__userId'], data['amount']
+def generate_settlements(time_limit=None, group=None):
+    """
+    Generates the transfers that settle all outstanding debts, reducing chains such as A owes B and B owes C.
 
-            required_dict[other_key][current_key] = required_dict[other_key].get(current_key, 0) + amount
+    Parameters:
+    - time_limit (float): Optional number of seconds after which the settlement computation is cut short.
+    - group (int): Optional id of a group, only the debts of its expenses are then settled.
 
-        for current_key, current_value in required_dict.items():
-            for other_key, other_value in required_dict.items():
-                if current_key != other_key:
-                    if current_key in other_value and other_key in current_value:
-                        max_value = max(other_value[current_key], current_value[other_key])
+    Returns: A dictionary with the list of transfers and a flag telling whether every debt was settled.
 
-                        other_value[current_key] = max_value - other_value[current_key]
-                        current_value[other_key] = max_value - current_value[other_key]
+    Notes:
+    - Each user's net position is computed from the latest balance snapshot plus a GROUP BY aggregate over the
+      passbook entries written since, see expense/ledger.py. Positions within a group are aggregated from the
+      passbook entries of the group alone.
+    - When LEDGER_ENGINE_ENABLED is set, the positions of all users are read from the ledger engine instead.
+    - The transfers are then computed with a heap based greedy settlement in O(U log U).
+    """
+    engine = get_engine() if group is None else None
+    if engine is not None:
+        keyed_positions = engine_net_positions(engine)
+    else:
+        positions = net_positions(group_pair_balances(group)) if group is not None else current_net_positions()
+        user_keys = user_keys_of(positions)
+        keyed_positions = {user_keys[user_id]: amount for user_id, amount in positions.items()}
 
-                        if other_value[current_key] == 0.0:
-                            del required_dict[other_key][current_key]
-                        if current_value[other_key] == 0.0:
-                            del required_dict[current_key][other_key]
+    deadline = time.monotonic() + time_limit if time_limit is not None else None
+    transfers, complete = settle_positions(keyed_positions, deadline)
+    return {
+        "transfers": [{"from": debtor, "to": creditor, "amount": amount.quantize(Decimal('0.01'))} for debtor, creditor, amount in transfers],
+        "complete": complete,
+    }
 
-        final_dict = {key: value for key, value in required_dict.items() if bool(value)}
-        
-        new_dict = {}
-        for key,value in final_dict.items():
-            if key in value:
-                del value[key]
-                new_dict[key]=value
 
-        return {key:value for key, value in new_dict.items() if new_dict[key]}
-    else:
-        return PassbookSerializer(Passbook.objects.select_related('user'), many=True).data
\ No newline at end of file
+def user_keys_of(user_ids):
+    """
+    Returns a user id -> userId dictionary for the given users, the keys the balance endpoints are reported with.
+
+    Notes:
+    - Users are looked up in batches of USER_LOOKUP_BATCH_SIZE ids, under SQLite's limit on query parameters.
+    """
+    user_ids, user_keys = list(user_ids), {}
+    for start in range(0, len(user_ids), USER_LOOKUP_BATCH_SIZE):
+        user_keys.update(User.objects.filter(id__in=user_ids[start:start + USER_LOOKUP_BATCH_SIZE]).values_list('id', 'userId'))
+    return user_keys
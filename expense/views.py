@@ -1,12 +1,19 @@
-from rest_framework import views
+import math
+from rest_framework import views, generics
 from rest_framework import status
-from .models import Expense, Passbook
+from django.db.models import Q
+from .models import Group, Expense, Passbook
+from .pagination import list_response
+from .importer import read_records, import_expenses
+from .rollups import rollup_stats, BUCKETS
+from .cache import cache_key, cached_response, cache_stats, user_scope, group_scope, BALANCES_SCOPE
 from rest_framework.response import Response
-from .serializers import ExpenseSerializer,PassbookSerializer
-from .utility import (manage_equal_expense,
-                      manage_exact_expense,
-                      manage_percentage_expense,
-                      generate_balances)
+from datetime import date, timedelta
+from django.utils import timezone
+from .serializers import ExpenseSerializer,FlatPassbookSerializer,GroupSerializer,GroupMembersSerializer
+from .utility import (create_expense,
+                      generate_balances,
+                      generate_settlements)
 
 
 class AddExpense(views.APIView):
@@ -23,11 +30,10 @@ class AddExpense(views.APIView):
 
     def get(self, request, *args, **kwargs):
         """
-        Retrieves a list of all expenses.
+        Retrieves a page of all expenses, or streams them with ?stream=ndjson.
         """
         queryset = Expense.objects.all()
-        serializer = ExpenseSerializer(queryset, many= True)
-        return Response(serializer.data)
+        return list_response(request, queryset, ExpenseSerializer)
 
     def post(self, request, *args, **kwargs):
         """
@@ -47,38 +53,31 @@ class AddExpense(views.APIView):
         - Success response if the expense is added successfully.
         - Error response if there are missing or invalid parameters.
         """
-        request_data = request.data
-        try:
-            participant_detail = request_data.pop('participant_detail')
-        except:
-            return Response({'Error':"Participant_detail key is required"},status=status.HTTP_400_BAD_REQUEST)
-        
-        serializer = ExpenseSerializer(data = request_data)
-        serializer.is_valid()
-        expense_detail = serializer.validated_data
-        expense_type = expense_detail.get("expense_type")
-        total_amount = expense_detail['amount']
-        payer = expense_detail['payer']
-        
-        if len(participant_detail) > 1000:
-            return Response({"Error":"Too many participants. Maximum allowed is 1000."},status=status.HTTP_400_BAD_REQUEST)
-        
-        if total_amount > 10000000:
-            return Response({"Error":"Expense amount exceeds the maximum limit of 10,000,000."},status=status.HTTP_400_BAD_REQUEST)
-        
-        if expense_type == "equal":
-            response =  manage_equal_expense(total_amount,payer,participant_detail)
-
-        elif expense_type == "exact":
-            response = manage_exact_expense(total_amount,payer,participant_detail)
-             
-        elif expense_type == "percent":
-            response = manage_percentage_expense(total_amount,payer,participant_detail)
-        else:
-            return Response({"Error":"Invalid expense_type"},status=status.HTTP_400_BAD_REQUEST)
-        
-        serializer.save()
-        return response
+        return create_expense(request.data)
+
+class BulkExpense(views.APIView):
+    """
+    A view to import many expenses at once.
+
+    Methods: POST
+
+    The body is either NDJSON (one expense per line, in the same format as POST /api/expense) or, with a
+    text/csv content type, CSV with a header row and the participant_detail column holding JSON.
+    Lines that are not valid UTF-8 are rejected like any other invalid record.
+    """
+    def post(self, request, *args, **kwargs):
+        """
+        Imports every valid expense of the body and reports the rejected lines.
+        """
+        if request.stream is None:
+            return Response({"Error":"Request body is required"},status=status.HTTP_400_BAD_REQUEST)
+        content_format = 'csv' if request.content_type.startswith('text/csv') else 'ndjson'
+        lines = iter(request.stream.readline, b'')
+
+        rejected = []
+        created = import_expenses(read_records(lines, content_format),
+                                  lambda line_number, record, error: rejected.append({"line": line_number, "error": error}))
+        return Response({"created": created, "rejected": rejected},status=status.HTTP_201_CREATED)
 
 class RetreiveExpense(views.APIView):
     """
@@ -88,12 +87,41 @@ class RetreiveExpense(views.APIView):
     """
     def get(self, request, *args, **kwargs):
         """
-        Retrieves the list of expenses for a particular user.
+        Retrieves a page of the expenses for a particular user, or streams them with ?stream=ndjson.
         """
         user = kwargs['user']
         queryset = Expense.objects.filter(payer=user)
-        serializer_data = ExpenseSerializer(queryset,many = True).data
-        return Response(serializer_data)
+        return list_response(request, queryset, ExpenseSerializer)
+
+class ExpenseStats(views.APIView):
+    """
+    A view to report the spending of a user, read from the daily rollups.
+
+    Methods: GET
+    """
+    def get(self, request, *args, **kwargs):
+        """
+        Returns the amounts paid and owed and the number of expenses of a user, by period and expense type.
+
+        Query parameters:
+        - from, to: First and last day of the report, as YYYY-MM-DD. Defaults to the last 30 days.
+        - bucket: Length of the periods, day, week or month. Defaults to day.
+        """
+        user = kwargs['user']
+        bucket = request.query_params.get('bucket', 'day')
+        if bucket not in BUCKETS:
+            return Response({"Error":"bucket must be one of day, week or month"},status=status.HTTP_400_BAD_REQUEST)
+        try:
+            date_to = date.fromisoformat(request.query_params['to']) if 'to' in request.query_params else timezone.localdate()
+            date_from = date.fromisoformat(request.query_params['from']) if 'from' in request.query_params else date_to - timedelta(days=29)
+        except ValueError:
+            return Response({"Error":"from and to must be dates formatted as YYYY-MM-DD"},status=status.HTTP_400_BAD_REQUEST)
+        if date_from > date_to:
+            return Response({"Error":"from must not be after to"},status=status.HTTP_400_BAD_REQUEST)
+
+        results = rollup_stats(user, date_from, date_to, bucket)
+        return Response({"user": user, "from": date_from, "to": date_to, "bucket": bucket, "results": results},
+                        status=status.HTTP_200_OK)
 
 class ListPassbook(views.APIView):
     """
@@ -104,9 +132,46 @@ class ListPassbook(views.APIView):
     def get(self, request, *args, **kwargs):
         """
         If 'simplify' query parameter is set to True, simplified passbook entries are returned else detailed passbook entries are returned.
+        Detailed entries are paginated, or streamed with ?stream=ndjson.
         """
         simplify = request.query_params.get('simplify',False)
-        result_dict = generate_balances(simplify)
+        if simplify:
+            key = cache_key('simplified_balances', [BALANCES_SCOPE])
+            return cached_response(key, lambda: Response(generate_balances(simplify),status=status.HTTP_200_OK))
+        return list_response(request, generate_balances(simplify), FlatPassbookSerializer)
+
+def parse_time_limit(query_params):
+    """
+    Reads the optional 'time_limit' query parameter of the settlement endpoints.
+
+    Returns: A tuple (time_limit, error). time_limit is None when the parameter is absent, error is None or a message.
+    """
+    time_limit = query_params.get('time_limit')
+    if time_limit is None:
+        return None, None
+    try:
+        time_limit = float(time_limit)
+    except ValueError:
+        return None, "time_limit must be a number of seconds"
+    if not math.isfinite(time_limit) or time_limit < 0:
+        return None, "time_limit must be a finite, non-negative number of seconds"
+    return time_limit, None
+
+
+class SettlePassbook(views.APIView):
+    """
+    A view to compute the transfers that settle all outstanding debts.
+
+    Methods: GET
+    """
+    def get(self, request, *args, **kwargs):
+        """
+        Returns a near-minimal list of transfers. The optional 'time_limit' query parameter caps the computation time in seconds.
+        """
+        time_limit, error = parse_time_limit(request.query_params)
+        if error:
+            return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+        result_dict = generate_settlements(time_limit)
         return Response(result_dict,status=status.HTTP_200_OK)
 
 class UserPassbook(views.APIView):
@@ -117,10 +182,90 @@ class UserPassbook(views.APIView):
     """
     def get(self, request, *args, **kwargs):
         """
-        Retrieves passbook entries for a specific user.
+        Retrieves a page of the passbook entries for a specific user, either owed by or owed to them,
+        or streams them with ?stream=ndjson.
         """
         user = kwargs['user']
-        user_data = PassbookSerializer(Passbook.objects.filter(user=user), many=True)
-        owes_to_data = PassbookSerializer(Passbook.objects.filter(owes_to = user),many = True)
-        response_data = user_data.data + owes_to_data.data 
-        return Response(response_data,status=status.HTTP_200_OK)
\ No newline at end of file
+        queryset = Passbook.objects.filter(Q(user=user) | Q(owes_to=user)).select_related('user', 'owes_to')
+        if request.query_params.get('stream') == 'ndjson':
+            return list_response(request, queryset, FlatPassbookSerializer)
+        key = cache_key('user_passbook', [user_scope(user)],
+                        [request.query_params.get('cursor', ''), request.query_params.get('page_size', '')])
+        return cached_response(key, lambda: list_response(request, queryset, FlatPassbookSerializer))
+
+class LedgerCacheStats(views.APIView):
+    """
+    A view exposing the hit and miss counters of the passbook cache for monitoring.
+
+    Methods: GET
+    """
+    def get(self, request, *args, **kwargs):
+        return Response(cache_stats(),status=status.HTTP_200_OK)
+
+
+class GroupList(generics.ListCreateAPIView):
+    """
+    A view to handle the creation and listing of groups using built in ListCreateAPIView.
+
+    Methods:
+    - Get: Retrieves a list of groups with their members
+    - Post: Creates a new group, eg. {"name": "Trip", "members": [1, 2, 3]}
+    """
+    queryset = Group.objects.prefetch_related('members')
+    serializer_class = GroupSerializer
+
+class GroupMembers(views.APIView):
+    """
+    A view to add members to a group.
+
+    Methods: POST
+    """
+    def post(self, request, *args, **kwargs):
+        """
+        Adds users to the group. Request Body Format: {"members": [int, ...]}
+        """
+        group = Group.objects.filter(pk=kwargs['group']).first()
+        if group is None:
+            return Response({"Error":"Group not found"},status=status.HTTP_404_NOT_FOUND)
+        body = GroupMembersSerializer(data=request.data)
+        if not body.is_valid():
+            return Response({"Error":body.errors},status=status.HTTP_400_BAD_REQUEST)
+        serializer = GroupSerializer(group, data=body.validated_data, partial=True)
+        if not serializer.is_valid():
+            return Response({"Error":serializer.errors},status=status.HTTP_400_BAD_REQUEST)
+        group.members.add(*serializer.validated_data['members'])
+        return Response(GroupSerializer(group).data,status=status.HTTP_200_OK)
+
+class GroupPassbook(views.APIView):
+    """
+    A view to list the passbook entries of a group.
+
+    Methods: GET
+    """
+    def get(self, request, *args, **kwargs):
+        """
+        With ?simplify=true the net balances between the members of the group are returned, otherwise
+        its passbook entries page by page, or streamed with ?stream=ndjson.
+        """
+        group = kwargs['group']
+        if not Group.objects.filter(pk=group).exists():
+            return Response({"Error":"Group not found"},status=status.HTTP_404_NOT_FOUND)
+        if request.query_params.get('simplify',False):
+            key = cache_key('group_balances', [group_scope(group)])
+            return cached_response(key, lambda: Response(generate_balances(True, group),status=status.HTTP_200_OK))
+        return list_response(request, generate_balances(False, group), FlatPassbookSerializer)
+
+class GroupSettle(views.APIView):
+    """
+    A view to compute the transfers that settle the debts within a group.
+
+    Methods: GET
+    """
+    def get(self, request, *args, **kwargs):
+        group = kwargs['group']
+        if not Group.objects.filter(pk=group).exists():
+            return Response({"Error":"Group not found"},status=status.HTTP_404_NOT_FOUND)
+        time_limit, error = parse_time_limit(request.query_params)
+        if error:
+            return Response({"Error":error},status=status.HTTP_400_BAD_REQUEST)
+        return Response(generate_settlements(time_limit, group),status=status.HTTP_200_OK)
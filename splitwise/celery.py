@@ -2,6 +2,7 @@ from __future__ import absolute_import, unicode_literals
 import os
 from celery import Celery
 from celery.schedules import crontab
+from . import task_metrics
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'splitwise.settings')
 
@@ -13,9 +14,19 @@ app.conf.beat_schedule = {
     'send_weekly_summary_email_on_monday':{
         'task': 'expense.tasks.send_weekly_summary_email',
         'schedule' : crontab(minute = 0, hour= 12, day_of_week='monday') # Runs a task every Monday at 12:00 PM (noon)
+},
+    'flush_notification_digests_every_minute':{
+        'task': 'expense.tasks.flush_notification_digests_task',
+        'schedule' : crontab() # Runs a task every minute
+},
+    'checkpoint_balances_hourly':{
+        'task': 'expense.tasks.checkpoint_balances_task',
+        'schedule' : crontab(minute = 30) # Runs a task every hour at half past
 }
 }
 
 app.autodiscover_tasks()
 
+task_metrics.connect()
+
 app.conf.timezone = 'UTC' 
\ No newline at end of file
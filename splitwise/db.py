@@ -0,0 +1,46 @@
+import django
+from django.conf import settings
+from django.db import connections
+
+
+def apply_sqlite_pragmas(sender, connection, **kwargs):
+    """
+    Runs the SQLITE_PRAGMAS of the active database profile on every new SQLite connection.
+
+    Notes:
+    - journal_mode=WAL is stored in the database file, the other pragmas only last as long as the connection,
+      which is why the sqlite profile keeps connections open with CONN_MAX_AGE.
+    - WAL lets readers run alongside the single writer, and synchronous=NORMAL only syncs the log at checkpoints,
+      so a commit no longer waits on an fsync.
+    """
+    if connection.vendor != 'sqlite' or not settings.SQLITE_PRAGMAS:
+        return
+    with connection.cursor() as cursor:
+        for pragma, value in settings.SQLITE_PRAGMAS.items():
+            cursor.execute(f'PRAGMA {pragma} = {value}')
+
+
+def database_names():
+    """
+    Returns the database NAME of every connection alias of this process, as passed to setup_worker.
+    """
+    return {alias: connections[alias].settings_dict['NAME'] for alias in connections}
+
+
+def setup_worker(names):
+    """
+    Initializer of worker processes that use the ORM.
+
+    Parameters:
+    - names (dict): Connection alias -> database NAME of the parent process, see database_names.
+
+    Notes:
+    - Under the spawn and forkserver start methods the worker starts from a fresh interpreter, so Django is set up
+      again and the database names are copied over, since the parent may have switched to a test database.
+    - Under fork the connections inherited from the parent are closed, so none is shared with it.
+    - This module imports no model, so unpickling the initializer does not need the app registry.
+    """
+    django.setup()
+    for alias, name in names.items():
+        connections[alias].settings_dict['NAME'] = name
+    connections.close_all()
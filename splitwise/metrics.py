@@ -0,0 +1,113 @@
+import threading
+from collections import defaultdict
+from bisect import bisect_left
+from django.http import HttpResponse, HttpResponseForbidden
+from django.conf import settings
+from celery import current_app
+from . import task_metrics
+
+# Upper bounds, in seconds, of the request and database time histogram buckets.
+DURATION_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+# Upper bounds of the query count histogram buckets.
+QUERY_BUCKETS = (1, 2, 5, 10, 20, 50, 100, 200, 500)
+
+
+class Histogram:
+    """
+    Cumulative histogram in the Prometheus sense: one counter per bucket upper bound plus a sum and a count.
+    """
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def samples(self):
+        """
+        Yields (le, cumulative count) pairs, ending with the +Inf bucket.
+        """
+        cumulative = 0
+        for bound, count in zip(list(self.buckets) + ['+Inf'], self.counts):
+            cumulative += count
+            yield bound, cumulative
+
+
+class Registry:
+    """
+    Process-local store of the per view request metrics.
+
+    Every worker process keeps its own registry, so a scrape only sees the requests served by the process that
+    answered it. Scrape each worker, or aggregate in Prometheus, when running several of them.
+    """
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.request_seconds = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.db_seconds = defaultdict(lambda: Histogram(DURATION_BUCKETS))
+        self.db_queries = defaultdict(lambda: Histogram(QUERY_BUCKETS))
+        self.duplicate_queries = defaultdict(int)
+
+    def observe(self, labels, duration, db_duration, queries, duplicates):
+        with self.lock:
+            self.request_seconds[labels].observe(duration)
+            self.db_seconds[labels].observe(db_duration)
+            self.db_queries[labels].observe(queries)
+            if duplicates:
+                self.duplicate_queries[labels] += duplicates
+
+    def reset(self):
+        with self.lock:
+            self.request_seconds.clear()
+            self.db_seconds.clear()
+            self.db_queries.clear()
+            self.duplicate_queries.clear()
+
+    def render(self):
+        """
+        Returns every metric in the Prometheus text exposition format.
+        """
+        lines = []
+        with self.lock:
+            for name, help_text, histograms in (
+                ('splitwise_request_duration_seconds', 'Wall time of a request.', self.request_seconds),
+                ('splitwise_db_duration_seconds', 'Time spent in database queries per request.', self.db_seconds),
+                ('splitwise_db_queries', 'Database queries per request.', self.db_queries),
+            ):
+                lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+                for labels, histogram in sorted(histograms.items()):
+                    label_text = format_labels(labels)
+                    for bound, count in histogram.samples():
+                        lines.append(f'{name}_bucket{{{label_text},le="{bound}"}} {count}')
+                    lines.append(f'{name}_sum{{{label_text}}} {histogram.sum:.6f}')
+                    lines.append(f'{name}_count{{{label_text}}} {histogram.count}')
+
+            name = 'splitwise_duplicate_queries_total'
+            lines += [f'# HELP {name} Repeated queries flagged as possible N+1 patterns.', f'# TYPE {name} counter']
+            for labels, count in sorted(self.duplicate_queries.items()):
+                lines.append(f'{name}{{{format_labels(labels)}}} {count}')
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    view, method = labels
+    view = view.replace('\\', '\\\\').replace('"', '\\"')
+    return f'view="{view}",method="{method}"'
+
+
+registry = Registry()
+
+
+def metrics_view(request):
+    """
+    Serves the request metrics of this process and the task metrics stored in the cache in the Prometheus
+    text format. Only clients listed in METRICS_ALLOWED_IPS may read them.
+    """
+    if request.META.get('REMOTE_ADDR') not in settings.METRICS_ALLOWED_IPS:
+        return HttpResponseForbidden()
+    task_names = sorted(name for name in current_app.tasks if not name.startswith('celery.'))
+    body = registry.render() + task_metrics.render(task_names)
+    return HttpResponse(body, content_type='text/plain; version=0.0.4; charset=utf-8')
@@ -0,0 +1,86 @@
+import time
+import logging
+from collections import Counter
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.db import connection
+from django.conf import settings
+from .metrics import registry
+
+logger = logging.getLogger(__name__)
+
+
+class QueryProfiler:
+    """
+    Database execute wrapper timing every query of a request and counting repeated statements.
+    """
+    def __init__(self):
+        self.queries = 0
+        self.duration = 0.0
+        self.statements = Counter()
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.duration += time.perf_counter() - start
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def duplicates(self, threshold):
+        """
+        Returns the (statement, count) pairs executed at least `threshold` times. The statements are compared
+        before their parameters are bound, so a query run once per row of a loop shows up here.
+        """
+        return [(sql, count) for sql, count in self.statements.most_common() if count >= threshold]
+
+
+class PerformanceMiddleware:
+    """
+    Records the wall time, the number of database queries and the database time of every request.
+
+    Notes:
+    - The figures are sent back in a Server-Timing header and aggregated per view and method in the
+      process-local registry served by splitwise.metrics.metrics_view.
+    - Statements repeated DUPLICATE_QUERY_THRESHOLD times or more in one request are logged as possible
+      N+1 patterns and counted in splitwise_duplicate_queries_total.
+    - Queries run while a streaming response is consumed happen after the middleware returns and are not counted.
+    - The middleware is sync and async capable, so under ASGI the async views are not pushed into a thread.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.async_mode = iscoroutinefunction(get_response)
+        if self.async_mode:
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if self.async_mode:
+            return self.__acall__(request)
+        profiler = QueryProfiler()
+        start = time.perf_counter()
+        with connection.execute_wrapper(profiler):
+            response = self.get_response(request)
+        return self.record(request, response, profiler, time.perf_counter() - start)
+
+    async def __acall__(self, request):
+        profiler = QueryProfiler()
+        start = time.perf_counter()
+        with connection.execute_wrapper(profiler):
+            response = await self.get_response(request)
+        return self.record(request, response, profiler, time.perf_counter() - start)
+
+    def record(self, request, response, profiler, duration):
+        match = request.resolver_match
+        view = match.route if match is not None else 'unmatched'
+        duplicates = profiler.duplicates(settings.DUPLICATE_QUERY_THRESHOLD)
+        for sql, count in duplicates:
+            logger.warning('%s %s ran the same query %d times: %s', request.method, view, count, sql)
+        registry.observe((view, request.method), duration, profiler.duration, profiler.queries,
+                         sum(count for _, count in duplicates))
+
+        response['Server-Timing'] = (f'total;dur={duration * 1000:.1f}, '
+                                     f'db;dur={profiler.duration * 1000:.1f};desc="{profiler.queries} queries"')
+        return response
@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.0/ref/settings/
 """
 from dotenv import load_dotenv
 import os
+import tempfile
 from pathlib import Path
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -48,6 +49,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'splitwise.middleware.PerformanceMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -81,12 +83,49 @@ WSGI_APPLICATION = 'splitwise.wsgi.application'
 # Database
 # https://docs.djangoproject.com/en/5.0/ref/settings/#databases
 
-DATABASES = {
-    'default': {
-        'ENGINE': 'django.db.backends.sqlite3',
-        'NAME': BASE_DIR / 'db.sqlite3',
+# DB_PROFILE selects the database configuration:
+# - sqlite: WAL journal, tuned pragmas, busy timeout and persistent connections (default)
+# - sqlite-basic: the untuned SQLite configuration, kept to compare against
+# - postgresql: persistent, health checked connections to a PostgreSQL server configured by the POSTGRES_* variables
+DB_PROFILE = os.environ.get('DB_PROFILE', 'sqlite')
+DB_CONN_MAX_AGE = int(os.environ.get('DB_CONN_MAX_AGE', 600))
+
+if DB_PROFILE == 'postgresql':
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.postgresql',
+            'NAME': os.environ.get('POSTGRES_DB', 'splitwise'),
+            'USER': os.environ.get('POSTGRES_USER', 'splitwise'),
+            'PASSWORD': os.environ.get('POSTGRES_PASSWORD', ''),
+            'HOST': os.environ.get('POSTGRES_HOST', 'localhost'),
+            'PORT': os.environ.get('POSTGRES_PORT', '5432'),
+            'CONN_MAX_AGE': DB_CONN_MAX_AGE,
+            'CONN_HEALTH_CHECKS': True,
+        }
     }
-}
+elif DB_PROFILE in ('sqlite', 'sqlite-basic'):
+    DATABASES = {
+        'default': {
+            'ENGINE': 'django.db.backends.sqlite3',
+            'NAME': os.environ.get('SQLITE_NAME', BASE_DIR / 'db.sqlite3'),
+        }
+    }
+    if DB_PROFILE == 'sqlite':
+        DATABASES['default']['CONN_MAX_AGE'] = DB_CONN_MAX_AGE
+        # Seconds a writer waits for the database lock before raising "database is locked".
+        DATABASES['default']['OPTIONS'] = {'timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20))}
+else:
+    raise ValueError(f"Unknown DB_PROFILE {DB_PROFILE!r}, expected sqlite, sqlite-basic or postgresql")
+
+# Pragmas run on every new SQLite connection of the sqlite profile, see splitwise/db.py.
+SQLITE_PRAGMAS = {
+    'journal_mode': 'WAL',
+    'synchronous': 'NORMAL',
+    'mmap_size': int(os.environ.get('SQLITE_MMAP_SIZE', 256 * 1024 * 1024)),
+    'cache_size': int(os.environ.get('SQLITE_CACHE_SIZE', -64000)),
+    'temp_store': 'MEMORY',
+    'busy_timeout': int(os.environ.get('SQLITE_BUSY_TIMEOUT', 20)) * 1000,
+} if DB_PROFILE == 'sqlite' else {}
 
 
 # Password validation
@@ -131,9 +170,82 @@ STATIC_URL = 'static/'
 DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
+# CACHE SETTINGS
+# The local-memory backend is per process, deployments running several workers should point
+# CACHE_BACKEND at a shared cache (eg. django.core.cache.backends.redis.RedisCache) so invalidations reach every worker.
+CACHES = {
+    'default': {
+        'BACKEND': os.environ.get('CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.environ.get('CACHE_LOCATION', 'splitwise'),
+    }
+}
+LEDGER_CACHE_TIMEOUT = int(os.environ.get('LEDGER_CACHE_TIMEOUT', 300))
+# Ledger writes made by management commands and Celery workers run in their own processes and can only invalidate
+# a cache they share with the web workers, so the ledger cache stays off on per-process backends unless forced on.
+PROCESS_LOCAL_CACHE_BACKENDS = ('django.core.cache.backends.locmem.LocMemCache', 'django.core.cache.backends.dummy.DummyCache')
+LEDGER_CACHE_ENABLED = os.environ.get('LEDGER_CACHE_ENABLED',
+                                      str(CACHES['default']['BACKEND'] not in PROCESS_LOCAL_CACHE_BACKENDS)) == 'True'
+# Task metrics are written by every Celery worker process and read by the web workers. When the default cache is
+# per process they go to a file based cache shared by the processes of this host instead. Its increments are not
+# atomic, so concurrent workers may lose a few counts: set TASK_METRICS_CACHE_BACKEND to a shared cache for exact figures.
+if CACHES['default']['BACKEND'] in PROCESS_LOCAL_CACHE_BACKENDS:
+    task_metrics_cache = ('django.core.cache.backends.filebased.FileBasedCache',
+                          os.path.join(tempfile.gettempdir(), 'splitwise_task_metrics'))
+else:
+    task_metrics_cache = (CACHES['default']['BACKEND'], CACHES['default']['LOCATION'])
+CACHES['task_metrics'] = {
+    'BACKEND': os.environ.get('TASK_METRICS_CACHE_BACKEND', task_metrics_cache[0]),
+    'LOCATION': os.environ.get('TASK_METRICS_CACHE_LOCATION', task_metrics_cache[1]),
+}
+
+
+# LISTING SETTINGS
+LISTING_PAGE_SIZE = int(os.environ.get('LISTING_PAGE_SIZE', 100))
+LISTING_MAX_PAGE_SIZE = int(os.environ.get('LISTING_MAX_PAGE_SIZE', 1000))
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 2000))
+
+
+# PERFORMANCE METRICS SETTINGS
+# A statement run this many times in one request is logged as a possible N+1 pattern.
+DUPLICATE_QUERY_THRESHOLD = int(os.environ.get('DUPLICATE_QUERY_THRESHOLD', 5))
+# Clients allowed to read the Prometheus metrics at /metrics.
+METRICS_ALLOWED_IPS = os.environ.get('METRICS_ALLOWED_IPS', '127.0.0.1,::1').split(',')
+
+
+# LEDGER SNAPSHOT SETTINGS
+# Passbook entries younger than this many seconds are left out of a checkpoint.
+SNAPSHOT_SAFETY_LAG = int(os.environ.get('SNAPSHOT_SAFETY_LAG', 300))
+# Optional compact copy of the latest snapshot, memory-mapped by every web worker for the simplified balances and
+# settlements. It is rewritten after each checkpoint, the path must be readable by the web workers of the host.
+LEDGER_ENGINE_ENABLED = os.environ.get('LEDGER_ENGINE_ENABLED', 'False') == 'True'
+LEDGER_ENGINE_PATH = os.environ.get('LEDGER_ENGINE_PATH', str(BASE_DIR / 'ledger_engine.bin'))
+
+
+# IMPORT SETTINGS
+IMPORT_CHUNK_SIZE = int(os.environ.get('IMPORT_CHUNK_SIZE', 500))
+
+
 # CELERY SETTINGS
 CELERY_BROKER_URL = os.environ.get('CELERY_BROKER_URL')
 CELERY_RESULT_BACKEND = os.environ.get('CELERY_RESULT_BACKEND')
+# Transactional notifications and batch summaries run on their own queues, so a flood of one cannot delay the other.
+# Run one worker per queue, see the README for the recommended prefetch and pool options.
+CELERY_TASK_DEFAULT_QUEUE = 'celery'
+CELERY_TASK_ROUTES = {
+    'expense.tasks.send_email_task': {'queue': 'notifications'},
+    'expense.tasks.send_expense_notifications_task': {'queue': 'notifications'},
+    'expense.tasks.send_email_batch_task': {'queue': 'notifications'},
+    'expense.tasks.flush_notification_digests_task': {'queue': 'notifications'},
+    'expense.tasks.send_digest_batch_task': {'queue': 'notifications'},
+    'expense.tasks.send_weekly_summary_email': {'queue': 'summaries'},
+    'expense.tasks.send_weekly_summary_chunk_task': {'queue': 'summaries'},
+}
+CELERY_WORKER_PREFETCH_MULTIPLIER = int(os.environ.get('CELERY_WORKER_PREFETCH_MULTIPLIER', 4))
+# Task metrics are kept in the 'task_metrics' cache, see CACHES.
+TASK_METRICS_TIMEOUT = int(os.environ.get('TASK_METRICS_TIMEOUT', 7 * 24 * 3600))
+# Tasks triggered by requests are written to the Outbox table and published by manage.py relay_outbox.
+OUTBOX_RELAY_BATCH_SIZE = int(os.environ.get('OUTBOX_RELAY_BATCH_SIZE', 500))
+OUTBOX_RELAY_INTERVAL = float(os.environ.get('OUTBOX_RELAY_INTERVAL', 1))
 
 # # SMTP SETTINGS
 EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND')
@@ -144,3 +256,13 @@ EMAIL_HOST_USER = os.environ.get('EMAIL_HOST_USER')
 EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD')
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL')
 
+# NOTIFICATION SETTINGS
+NOTIFICATION_BATCH_SIZE = int(os.environ.get('NOTIFICATION_BATCH_SIZE', 100))
+NOTIFICATION_MAX_RETRIES = int(os.environ.get('NOTIFICATION_MAX_RETRIES', 3))
+# Expense notifications are buffered per recipient and sent as one digest once no new notification arrived for
+# NOTIFICATION_DIGEST_WINDOW seconds, or at the latest NOTIFICATION_DIGEST_MAX_DELAY seconds after the first one.
+NOTIFICATION_DIGEST_WINDOW = int(os.environ.get('NOTIFICATION_DIGEST_WINDOW', 300))
+NOTIFICATION_DIGEST_MAX_DELAY = int(os.environ.get('NOTIFICATION_DIGEST_MAX_DELAY', 3600))
+NOTIFICATION_DIGEST_FLUSH_LIMIT = int(os.environ.get('NOTIFICATION_DIGEST_FLUSH_LIMIT', 1000))
+WEEKLY_SUMMARY_CHUNK_SIZE = int(os.environ.get('WEEKLY_SUMMARY_CHUNK_SIZE', 500))
+
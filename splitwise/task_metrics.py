@@ -0,0 +1,129 @@
+import time
+import logging
+from bisect import bisect_left
+from django.core.cache import caches
+from django.conf import settings
+
+# Upper bounds, in seconds, of the queue wait and run time histogram buckets.
+TASK_BUCKETS = (0.01, 0.05, 0.1, 0.5, 1, 5, 10, 30, 60, 300)
+PUBLISHED_AT_HEADER = 'published_at'
+PREFIX = 'task_metrics'
+CACHE_ALIAS = 'task_metrics'
+
+logger = logging.getLogger(__name__)
+
+
+def metric_key(task_name, metric, suffix):
+    return f'{PREFIX}:{task_name}:{metric}:{suffix}'
+
+
+def increment(key, delta=1):
+    cache = caches[CACHE_ALIAS]
+    # incr fails on a missing key, add is a no-op on an existing one.
+    cache.add(key, 0, settings.TASK_METRICS_TIMEOUT)
+    try:
+        cache.incr(key, delta)
+    except ValueError:
+        cache.set(key, delta, settings.TASK_METRICS_TIMEOUT)
+
+
+def observe(task_name, metric, seconds):
+    """
+    Adds one observation to the histogram `metric` of a task. The sum is kept in microseconds, so every counter
+    stays an integer the cache can increment.
+    """
+    increment(metric_key(task_name, metric, bisect_left(TASK_BUCKETS, seconds)))
+    increment(metric_key(task_name, metric, 'sum_us'), int(seconds * 1000000))
+    increment(metric_key(task_name, metric, 'count'))
+
+
+def record_publish(sender=None, headers=None, **kwargs):
+    """
+    before_task_publish handler stamping every message with its publish time.
+    """
+    if headers is not None:
+        headers[PUBLISHED_AT_HEADER] = time.time()
+
+
+def record_start(sender=None, task=None, **kwargs):
+    """
+    task_prerun handler recording how long the message waited in its queue.
+    Eagerly run tasks are never published, so they only record their run time.
+    """
+    published_at = task.request.get(PUBLISHED_AT_HEADER)
+    if published_at is not None:
+        observe(task.name, 'queue_wait', max(time.time() - float(published_at), 0))
+    task.request.started_at = time.perf_counter()
+
+
+def record_finish(sender=None, task=None, **kwargs):
+    """
+    task_postrun handler recording the run time of the task, whatever its outcome.
+    """
+    started_at = getattr(task.request, 'started_at', None)
+    if started_at is not None:
+        observe(task.name, 'run', time.perf_counter() - started_at)
+
+
+def record_failure(sender=None, **kwargs):
+    increment(metric_key(sender.name, 'failures', 'total'))
+
+
+def record_retry(sender=None, **kwargs):
+    increment(metric_key(sender.name, 'retries', 'total'))
+
+
+def connect():
+    """
+    Connects the metric handlers to the Celery signals, both in publishing processes and in workers.
+
+    Warns when the task metrics cache is per process: every prefork child would then keep its own counters and
+    /metrics would never show what the workers recorded.
+    """
+    if settings.CACHES[CACHE_ALIAS]['BACKEND'] in settings.PROCESS_LOCAL_CACHE_BACKENDS:
+        logger.warning('The %r cache uses %s, task metrics recorded by workers will not reach /metrics. '
+                       'Point TASK_METRICS_CACHE_BACKEND at a cache shared by every process.',
+                       CACHE_ALIAS, settings.CACHES[CACHE_ALIAS]['BACKEND'])
+    from celery import signals
+    signals.before_task_publish.connect(record_publish, weak=False)
+    signals.task_prerun.connect(record_start, weak=False)
+    signals.task_postrun.connect(record_finish, weak=False)
+    signals.task_failure.connect(record_failure, weak=False)
+    signals.task_retry.connect(record_retry, weak=False)
+
+
+def render(task_names):
+    """
+    Returns the task metrics of `task_names` in the Prometheus text exposition format.
+    """
+    suffixes = [str(index) for index in range(len(TASK_BUCKETS) + 1)] + ['sum_us', 'count']
+    histogram_keys = [metric_key(name, metric, suffix)
+                      for name in task_names for metric in ('queue_wait', 'run') for suffix in suffixes]
+    counter_keys = [metric_key(name, metric, 'total') for name in task_names for metric in ('failures', 'retries')]
+    values = caches[CACHE_ALIAS].get_many(histogram_keys + counter_keys)
+
+    lines = []
+    for metric, help_text in (('queue_wait', 'Time between publishing a task and a worker starting it.'),
+                              ('run', 'Run time of a task.')):
+        name = f'splitwise_task_{metric}_seconds'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+        for task_name in task_names:
+            count = values.get(metric_key(task_name, metric, 'count'))
+            if not count:
+                continue
+            cumulative = 0
+            for index, bound in enumerate(list(TASK_BUCKETS) + ['+Inf']):
+                cumulative += values.get(metric_key(task_name, metric, index), 0)
+                lines.append(f'{name}_bucket{{task="{task_name}",le="{bound}"}} {cumulative}')
+            total = values.get(metric_key(task_name, metric, 'sum_us'), 0) / 1000000
+            lines.append(f'{name}_sum{{task="{task_name}"}} {total:.6f}')
+            lines.append(f'{name}_count{{task="{task_name}"}} {count}')
+
+    for metric, help_text in (('failures', 'Tasks that raised an exception.'), ('retries', 'Task retries.')):
+        name = f'splitwise_task_{metric}_total'
+        lines += [f'# HELP {name} {help_text}', f'# TYPE {name} counter']
+        for task_name in task_names:
+            count = values.get(metric_key(task_name, metric, 'total'))
+            if count:
+                lines.append(f'{name}{{task="{task_name}"}} {count}')
+    return '\n'.join(lines) + '\n'
@@ -16,9 +16,12 @@ Including another URLconf
 """
 from django.contrib import admin
 from django.urls import path, include
+from .metrics import metrics_view
 
 urlpatterns = [
     path('admin/', admin.site.urls),
     path('api/',include('user.urls')),
-    path('api/',include('expense.urls'))
+    path('api/',include('expense.urls')),
+    path('api/async/',include('expense.async_urls')),
+    path('metrics', metrics_view)
 ]